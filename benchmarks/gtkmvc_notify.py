@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#  Author: Roberto Cavada <cavada@fbk.eu>
+#
+#  Copyright (c) 2005 by Roberto Cavada
+#
+#  pygtkmvc is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU Lesser General Public
+#  License as published by the Free Software Foundation; either
+#  version 2 of the License, or (at your option) any later version.
+#
+#  pygtkmvc is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#  Lesser General Public License for more details.
+#
+#  You should have received a copy of the GNU Lesser General Public
+#  License along with this library; if not, write to the Free
+#  Software Foundation, Inc., 51 Franklin Street, Fifth Floor,
+#  Boston, MA 02110, USA.
+#
+#  For more information on pygtkmvc see <http://pygtkmvc.sourceforge.net>
+#  or email to the author Roberto Cavada <cavada@fbk.eu>.
+#  Please report bugs to <cavada@fbk.eu>.
+
+"""
+Times observer registration and property notification in the gtkmvc
+Model, with as many properties as the main model of the application
+
+Run from the top of the source tree:  python benchmarks/gtkmvc_notify.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from gui.contrib.gtkmvc.model import Model
+from gui.contrib.gtkmvc.observer import Observer
+
+PROPERTIES = 40   # about as many as the main model of the application
+OBSERVED = 10     # properties with a value change method in the observer
+REPEAT = 10000
+
+
+class BenchModel (Model):
+    __properties__ = dict([("prop%d" % i, 0) for i in range(PROPERTIES)])
+    pass
+
+
+def _value_change(self, model, old, new):
+    return
+
+BenchObserver = type("BenchObserver", (Observer,),
+                     dict([("property_prop%d_value_change" % i, _value_change)
+                           for i in range(OBSERVED)]))
+
+
+def timed(func, repeat=REPEAT):
+    start = time.time()
+    for i in xrange(repeat): func(i)
+    return (time.time() - start) / repeat
+
+
+def bench_register(model):
+    def register(i):
+        observer = BenchObserver(model)
+        observer.unregister_model()
+        return
+    return timed(register)
+
+
+def bench_set(model, prop_name):
+    def set_value(i): setattr(model, prop_name, i)
+    return timed(set_value, REPEAT * 10)
+
+
+def main():
+    model = BenchModel()
+    print "%d properties, %d observed" % (PROPERTIES, OBSERVED)
+    print "register + unregister:  %7.2f us" % (bench_register(model) * 1e6)
+    print "set, no observer:       %7.2f us" % (bench_set(model, "prop0") * 1e6)
+
+    observer = BenchObserver(model)
+    print "set, observed:          %7.2f us" % (bench_set(model, "prop0") * 1e6)
+    print "set, not observed:      %7.2f us" % (
+        bench_set(model, "prop%d" % (PROPERTIES - 1)) * 1e6)
+    observer.unregister_model()
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Generates a messages DB with 50k messages and compares the time and peak
+memory needed to load it with one query per thread (as get_messages used
+to) against the single query of DBSMSManager.iter_messages
+
+Every strategy runs in a forked child, so its peak RSS is not inflated by
+the ones that ran before it. Generating the DB takes a while.
+
+Run from the top of the source tree:  python benchmarks/sms_bulk_load.py
+"""
+
+import datetime
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from dateutil.tz import gettz, tzutc
+
+from wader.common.provider import Message as DBMessage
+
+from gui.messages import DBSMSManager, KNOWN_FOLDERS
+
+MESSAGES = 50000
+CONTACTS = 500
+START = datetime.datetime(2010, 1, 1, tzinfo=tzutc())
+
+
+def generate(path):
+    smanager = DBSMSManager(path)
+    random.seed(0)
+    numbers = ['+3461%07d' % random.randint(0, 9999999)
+               for i in range(CONTACTS)]
+    for i in xrange(MESSAGES):
+        date = START + datetime.timedelta(seconds=i * 600)
+        msg = DBMessage(random.choice(numbers), 'message %d ' % i * 4,
+                        _datetime=date)
+        smanager.provider.add_sms(msg, folder=random.choice(KNOWN_FOLDERS))
+    smanager.close()
+
+
+def load_per_thread(smanager):
+    tz = gettz()
+    ret = []
+    for i in range(3):
+        tab = i + 1
+        for thread in smanager.provider.list_from_folder(KNOWN_FOLDERS[i]):
+            msgs = list(smanager.provider.list_from_thread(thread))
+            for msg in msgs:
+                msg.where = tab
+                msg.datetime = msg.datetime.astimezone(tz)
+            ret.extend(msgs)
+    return len(ret)
+
+
+def load_bulk(smanager):
+    return len(smanager.get_messages())
+
+
+def load_streamed(smanager):
+    count = 0
+    for msg in smanager.iter_messages():
+        count += 1
+    return count
+
+
+STRATEGIES = [
+    ('per thread', load_per_thread),
+    ('single query', load_bulk),
+    ('streamed', load_streamed),
+]
+
+
+def measure(path, func):
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if not pid:
+        os.close(rfd)
+        smanager = DBSMSManager(path)
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        count = func(smanager)
+        elapsed = time.time() - start
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base
+        os.write(wfd, '%d %f %d' % (count, elapsed, peak))
+        os._exit(0)
+
+    os.close(wfd)
+    result = os.read(rfd, 128)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    count, elapsed, peak = result.split()
+    return int(count), float(elapsed), int(peak)
+
+
+def main():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'messages.db')
+        start = time.time()
+        generate(path)
+        print "generated %d messages in %.1fs" % (MESSAGES,
+                                                  time.time() - start)
+
+        # the first connection creates the indexes, keep it out of the runs
+        smanager = DBSMSManager(path)
+        smanager.get_messages_page(1, limit=1)
+        smanager.close()
+
+        print "%-14s %9s %10s %10s" % ('strategy', 'messages', 'time',
+                                        'peak rss')
+        for name, func in STRATEGIES:
+            count, elapsed, peak = measure(path, func)
+            print "%-14s %9d %9.2fs %9dK" % (name, count, elapsed, peak)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
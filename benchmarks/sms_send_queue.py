@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Sends a few hundred messages through SendQueue to a mock device and
+compares the throughput of several in-flight windows against handing
+every message to the device at once, as the new SMS dialog used to
+
+The mock device behaves like a modem behind a serial port: every call
+takes a while to reach it and to come back, it executes one command at
+a time and it times out the commands that don't fit in its buffer.
+Every run also checks that each message was saved to the sent folder
+exactly once.
+
+Run from the top of the source tree:  python benchmarks/sms_send_queue.py
+"""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import gobject
+
+from gui import sendqueue
+from gui.logger import logger
+from gui.messages import DBSMSManager
+from gui.sendqueue import SendQueue
+
+MESSAGES = 300
+# seconds a call takes to reach the modem, and its answer to come back
+LATENCY = 0.01
+# seconds the modem needs to send a message
+SERVICE = 0.01
+# commands the modem can hold, the rest time out
+BUFFER = 8
+WINDOWS = [1, 2, 4, 8]
+
+TIMEOUT = 'org.freedesktop.ModemManager.Error.SerialResponseTimeout'
+
+
+class MockError(Exception):
+
+    def get_dbus_name(self):
+        return self.args[0]
+
+
+def _later(delay, func, *args):
+
+    def _call():
+        func(*args)
+        return False
+
+    gobject.timeout_add(max(0, int(delay * 1000)), _call)
+
+
+class MockDevice(object):
+    """I answer Send calls like a modem would"""
+
+    def __init__(self):
+        super(MockDevice, self).__init__()
+        self.busy_until = 0
+        self.pending = 0
+        self.calls = 0
+        self.timeouts = 0
+
+    def Send(self, params, dbus_interface=None, reply_handler=None,
+             error_handler=None):
+        self.calls += 1
+        _later(LATENCY, self._arrived, reply_handler, error_handler)
+
+    def _arrived(self, reply_handler, error_handler):
+        if self.pending >= BUFFER:
+            self.timeouts += 1
+            _later(LATENCY, error_handler, MockError(TIMEOUT))
+            return
+
+        self.pending += 1
+        now = time.time()
+        self.busy_until = max(now, self.busy_until) + SERVICE
+        _later(self.busy_until - now, self._done, reply_handler)
+
+    def _done(self, reply_handler):
+        self.pending -= 1
+        _later(LATENCY, reply_handler, [self.calls % 256])
+
+
+def run(path, window):
+    smanager = DBSMSManager(path)
+    loop = gobject.MainLoop()
+    failed = []
+
+    def progress_cb(processed, total=None):
+        if processed is None:
+            loop.quit()
+
+    queue = SendQueue(smanager, failed_cb=failed.extend,
+                      progress_cb=progress_cb, window=window)
+    device = MockDevice()
+    queue.enqueue(['+3461%07d' % i for i in range(MESSAGES)], 'benchmark',
+                  smsc='+34607003110', msgvp=167)
+
+    start = time.time()
+    queue.set_device(device)
+    loop.run()
+    elapsed = time.time() - start
+
+    saved = len(list(smanager.iter_messages(where=3)))
+    smanager.close()
+    return elapsed, device.calls, device.timeouts, len(failed), saved
+
+
+def main():
+    # retry soon, or the runs with timeouts would just measure the backoff
+    sendqueue.RETRY_DELAY = 0.05
+    # every timeout is logged, keep the table readable
+    logger.setLevel(logging.CRITICAL)
+
+    print "%-10s %8s %9s %7s %9s %7s %6s" % ('window', 'time', 'msg/s',
+                                            'calls', 'timeouts', 'failed',
+                                            'saved')
+    for window in WINDOWS + [MESSAGES]:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'messages.db')
+            elapsed, calls, timeouts, failed, saved = run(path, window)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        name = window == MESSAGES and 'all' or str(window)
+        print "%-10s %7.2fs %9.1f %7d %9d %7d %6d" % (name, elapsed,
+                        (saved / elapsed), calls, timeouts, failed, saved)
+        assert saved == MESSAGES - failed, "messages saved more than once"
+
+
+if __name__ == '__main__':
+    main()
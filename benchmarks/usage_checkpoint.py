@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Simulates a 12 hour session crossing midnight and measures the cost of
+checkpointing its usage, for several checkpoint budgets
+
+For every budget it reports the number of writes, the growth of the
+usage DB and the time the main loop would be stalled by each write.
+
+Run from the top of the source tree:  python benchmarks/usage_checkpoint.py
+"""
+
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from wader.common.provider import UsageProvider
+
+from gui.models.main import CHECKPOINT_INTERVAL, CHECKPOINT_BYTES
+from gui.providers import pool
+from gui.usage import UsageRollups, to_local
+
+SESSION = 12 * 60 * 60      # seconds, one SIG_DIAL_STATS tick per second
+START = datetime.datetime(2012, 3, 31, 18, 0, 0)
+
+BUDGETS = [
+    ('every tick', 1, 0),
+    ('every minute', 60, CHECKPOINT_BYTES),
+    ('default', CHECKPOINT_INTERVAL, CHECKPOINT_BYTES),
+]
+
+
+def db_size(path):
+    size = 0
+    for suffix in ['', '-journal']:
+        if os.path.exists(path + suffix):
+            size += os.path.getsize(path + suffix)
+    return size
+
+
+def simulate(path, interval, max_bytes):
+    provider = UsageProvider(path)
+    rollups = UsageRollups(provider, path)
+    size = db_size(path)
+
+    random.seed(0)
+    stalls = []
+    rx = tx = 0
+    last_time, last_rx, last_tx = START, 0, 0
+    checkpoint_bytes = 0
+    last_checkpoint = 0
+
+    for tick in xrange(1, SESSION + 1):
+        now = START + datetime.timedelta(seconds=tick)
+        rx += random.randint(0, 64 * 1024)
+        tx += random.randint(0, 8 * 1024)
+        pending = (rx - last_rx) + (tx - last_tx)
+
+        timer = tick - last_checkpoint >= interval
+        budget = max_bytes and pending - checkpoint_bytes >= max_bytes
+        if not (timer or budget):
+            continue
+
+        last_checkpoint = tick
+        start = time.time()
+        if to_local(now).date() != to_local(last_time).date():
+            rollups.write_segment(last_time, now,
+                                  rx - last_rx, tx - last_tx, True)
+            last_time, last_rx, last_tx = now, rx, tx
+            checkpoint_bytes = 0
+        else:
+            rollups.save_checkpoint(last_time, now,
+                                    rx - last_rx, tx - last_tx, True)
+            checkpoint_bytes = pending
+        stalls.append(time.time() - start)
+
+    rollups.write_segment(last_time, now, rx - last_rx, tx - last_tx, True)
+
+    v_3g, v_2g = rollups.get_usage_for_month(START.date())
+    v_3g_next, _ = rollups.get_usage_for_month(now.date())
+    assert v_3g + v_2g + v_3g_next == rx + tx
+
+    growth = db_size(path) - size
+    pool.close_all()
+    provider.close()
+    return stalls, growth, rx + tx
+
+
+def main():
+    print "%-14s %7s %10s %10s %10s %10s" % (
+        'budget', 'writes', 'db growth', 'avg stall', 'max stall', 'total')
+
+    for name, interval, max_bytes in BUDGETS:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'usage.db')
+            stalls, growth, traffic = simulate(path, interval, max_bytes)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        print "%-14s %7d %9dK %8.2fms %8.2fms %9.2fs" % (
+            name, len(stalls), growth / 1024,
+            sum(stalls) / len(stalls) * 1000, max(stalls) * 1000,
+            sum(stalls))
+
+    print "session traffic: %d MiB" % (traffic / 2 ** 20)
+
+
+if __name__ == '__main__':
+    main()
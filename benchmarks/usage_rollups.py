@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Compares month totals computed by scanning usage segments against the
+materialized totals kept by L{gui.usage.UsageRollups}
+
+Run from the top of the source tree:  python benchmarks/usage_rollups.py
+"""
+
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from wader.common.provider import UsageProvider
+
+from gui.providers import pool
+from gui.usage import UsageRollups, next_month
+
+SEGMENTS_PER_DAY = 96  # a bearer flip every quarter of an hour
+DAYS = 365
+
+
+def old_calc_month(provider, month):
+    v_3g = v_2g = 0
+    for item in provider.get_usage_for_month(month):
+        if item.is_3g():
+            v_3g += item.total()
+        else:
+            v_2g += item.total()
+    return (v_3g, v_2g)
+
+
+def populate(provider, start):
+    step = datetime.timedelta(days=1) / SEGMENTS_PER_DAY
+    when = datetime.datetime.combine(start, datetime.time())
+    for i in xrange(DAYS * SEGMENTS_PER_DAY):
+        provider.add_usage_item(when, when + step,
+                                random.randint(0, 2 ** 20),
+                                random.randint(0, 2 ** 18),
+                                random.random() > 0.2)
+        when += step
+
+
+def timed(func, *args):
+    start = time.time()
+    ret = func(*args)
+    return time.time() - start, ret
+
+
+def main():
+    # the scan groups segments by UTC month and the rollups by local
+    # month, they only agree on the totals in UTC
+    os.environ['TZ'] = 'UTC'
+    time.tzset()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'usage.db')
+        provider = UsageProvider(path)
+
+        today = datetime.date.today()
+        first = (today - datetime.timedelta(days=DAYS - 1)).replace(day=1)
+        elapsed, _ = timed(populate, provider, first)
+        print "populated %d segments in %.2fs" % (
+            DAYS * SEGMENTS_PER_DAY, elapsed)
+
+        elapsed, rollups = timed(UsageRollups, provider, path)
+        print "backfill: %.3fs" % elapsed
+
+        months = []
+        month = first
+        while month <= today:
+            months.append(month)
+            month = next_month(month)
+
+        old_total = new_total = 0.0
+        for month in months:
+            t_old, old = timed(old_calc_month, provider, month)
+            t_new, new = timed(rollups.get_usage_for_month, month)
+            assert old == new, (month, old, new)
+            old_total += t_old
+            new_total += t_new
+            print "%s  scan %8.2fms  rollup %6.3fms" % (
+                month.strftime("%b %Y"), t_old * 1000, t_new * 1000)
+
+        print "all months: scan %.3fs, rollup %.5fs (%.0fx)" % (
+            old_total, new_total, old_total / max(new_total, 1e-9))
+
+        pool.close_all()
+        provider.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
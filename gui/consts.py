@@ -69,6 +69,7 @@ LOG_FILE = join(GUI_HOME, 'log')
 
 DB_DIR = join(GUI_HOME, 'db')
 MESSAGES_DB = join(DB_DIR, 'messages.db')
+CONTACTS_DB = join(DB_DIR, 'contacts.db')
 USAGE_DB = join(DB_DIR, 'usage.db')
 
 GCONF_BASE_DIR = '/apps/%s' % APP_SLUG_NAME
@@ -87,6 +88,16 @@ CFG_SMS_VALIDITY_R1W = '1week'
 CFG_SMS_VALIDITY_MAX = 'maximum'
 CFG_PREFS_DEFAULT_SMS_VALIDITY = CFG_SMS_VALIDITY_R1W
 CFG_PREFS_DEFAULT_SMS_CONFIRMATION = False
+# move the SIM messages to the DB once the SIM is this full
+CFG_PREFS_DEFAULT_SMS_AUTO_OFFLOAD = False
+CFG_PREFS_DEFAULT_SIM_SMS_CAPACITY = 20
+CFG_PREFS_DEFAULT_SIM_SMS_THRESHOLD = 0.8
+# queued messages handed to the device at once
+CFG_PREFS_DEFAULT_SMS_SEND_WINDOW = 2
 
 TV_CNT_TYPE, TV_CNT_NAME, TV_CNT_NUMBER, TV_CNT_EDITABLE, TV_CNT_OBJ = range(5)
-TV_SMS_TYPE, TV_SMS_TEXT, TV_SMS_NUMBER, TV_SMS_DATE, TV_SMS_OBJ = range(5)
+# TV_SMS_DATE is the epoch, sorted natively, TV_SMS_DATE_TEXT is shown
+TV_SMS_TYPE, TV_SMS_TEXT, TV_SMS_NUMBER, TV_SMS_DATE, TV_SMS_OBJ, \
+    TV_SMS_STATUS, TV_SMS_DATE_TEXT = range(7)
+TV_CONV_NAME, TV_CONV_TEXT, TV_CONV_COUNT, TV_CONV_DATE_TEXT, \
+    TV_CONV_OBJ = range(5)
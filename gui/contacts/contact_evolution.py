@@ -16,12 +16,51 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
+import threading
+
+from gobject import idle_add
 from zope.interface import implements
-from os.path import join
+from os.path import expanduser, join
 
 from gui.translate import _
 from gui.consts import IMAGES_DIR
 from gui.contacts.interface import IContact
+from gui.logger import logger
+
+# contacts handed back to the main loop at once
+CHUNK_SIZE = 200
+
+# where the local addressbooks live, Evolution 2.x and 3.x
+EV_LOCAL_DIRS = [join('.evolution', 'addressbook', 'local'),
+                 join('.local', 'share', 'evolution', 'addressbook')]
+# the file of a local addressbook, written on every change
+EV_DB_FILES = ['addressbook.db', 'contacts.db']
+
+
+def get_addressbook_revision(uri):
+    """
+    Returns the revision of the addressbook at C{uri}, None if unknown
+
+    The revision of a local addressbook changes along with the file its
+    contacts are stored in, remote ones don't have any.
+    """
+    if uri.startswith('file://'):
+        dirs = [uri[len('file://'):]]
+    elif ':' in uri and not uri.startswith('local:'):
+        return None
+    else:
+        name = uri.split(':')[-1]
+        dirs = [join(expanduser('~'), d, name) for d in EV_LOCAL_DIRS]
+
+    for d in dirs:
+        for f in EV_DB_FILES:
+            try:
+                st = os.stat(join(d, f))
+            except OSError:
+                continue
+            return '%r:%d' % (st.st_mtime, st.st_size)
+    return None
 
 
 class EVContact(object):
@@ -46,6 +85,9 @@ class EVContact(object):
     def __ne__(self, c):
         return not (self.name == c.name and self.number == c.number)
 
+    def __hash__(self):
+        return hash((self.name, self.number))
+
     def get_index(self):
         return self.index
 
@@ -94,17 +136,44 @@ class EVContactsManager(object):
     def delete_contact_by_id(self, index):
         return False
 
-    def get_contacts(self):
+    def _get_addressbooks(self):
         try:
             import evolution
         except:
             return []
 
+        return evolution.ebook.list_addressbooks() or []
+
+    def get_fingerprint(self):
+        """
+        Returns what changes along with the contacts, see snapshot
+
+        None if it can't be told, i.e. there are remote addressbooks.
+        """
+        revisions = []
+        for name, id in self._get_addressbooks():
+            revision = get_addressbook_revision(id)
+            if revision is None:
+                return None
+            revisions.append('%s=%s' % (id, revision))
+        return ';'.join(revisions)
+
+    def make_contact(self, name, number, index=None):
+        return EVContact(name=name, number=number, index=index)
+
+    def _iter_contacts(self):
+        try:
+            import evolution
+        except:
+            return
+
         addressbooks = evolution.ebook.list_addressbooks()
         if not addressbooks:
-            return []
+            return
 
-        ret = []
+        # Ubuntu one mirrors personal address books, so avoid duplicate
+        # entries, EVContacts are equal if their name and number are
+        seen = set()
         for i in addressbooks:
             name, id = i  # ('Personal', 'default')
 
@@ -113,17 +182,32 @@ class EVContactsManager(object):
                 continue
 
             for c in addressbook.get_all_contacts():
+                key = (c.get_name(), c.get_property('mobile-phone'))
+                if key in seen:
+                    continue
+                seen.add(key)
 
-                item = EVContact(name=c.get_name(),
-                                 number=c.get_property('mobile-phone'),
-                                 index=c.get_property('id'))
+                yield EVContact(name=key[0], number=key[1],
+                                index=c.get_property('id'))
 
-                # Ubuntu one mirrors personal address books, so avoid
-                # duplicate entry - might be slow with many contacts
-                if not item in ret:
-                    ret.append(item)
-
-        return ret
+    def get_contacts(self):
+        return list(self._iter_contacts())
+
+    def get_contacts_async(self, chunk_cb, done_cb, chunk_size=CHUNK_SIZE,
+                           known=None):
+        """
+        Reads the contacts in a thread, handing them back in chunks
+
+        C{chunk_cb(contacts)} is called from the main loop with every
+        C{chunk_size} contacts read and C{done_cb(fingerprint, changed)}
+        once all of them are. If the fingerprint of the addressbooks is
+        still C{known} nothing is read and C{changed} is False. Returns
+        the L{EVContactsLoader} doing it.
+        """
+        loader = EVContactsLoader(self._iter_contacts, chunk_cb, done_cb,
+                                  chunk_size, self.get_fingerprint, known)
+        loader.start()
+        return loader
 
     def get_contact_by_id(self, index):
         print "EVContactsManager::get_contact_by_id called"
@@ -134,3 +218,78 @@ class EVContactsManager(object):
 
     def name(self):
         return _('Evolution')
+
+
+class EVContactsLoader(object):
+    """
+    I enumerate the Evolution addressbooks out of the main loop
+
+    Opening the addressbooks and reading thousands of contacts takes
+    seconds, so I do it in a worker thread and pass the contacts to the
+    main loop with C{idle_add}, C{chunk_size} at a time. Nothing is
+    read if C{get_fingerprint()} returns the C{known} fingerprint. Once
+    cancelled no more callbacks are called.
+    """
+
+    def __init__(self, iter_contacts, chunk_cb, done_cb,
+                 chunk_size=CHUNK_SIZE, get_fingerprint=None, known=None):
+        super(EVContactsLoader, self).__init__()
+        self.iter_contacts = iter_contacts
+        self.chunk_cb = chunk_cb
+        self.done_cb = done_cb
+        self.chunk_size = max(1, chunk_size)
+        self.get_fingerprint = get_fingerprint
+        self.known = known
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name='EVContactsLoader')
+        # don't keep the application alive on exit
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def _run(self):
+        fingerprint = None
+        if self.get_fingerprint is not None:
+            try:
+                fingerprint = self.get_fingerprint()
+            except Exception, e:
+                logger.error("Error checking Evolution contacts: %s" % e)
+
+        if fingerprint is not None and fingerprint == self.known:
+            idle_add(self._done, fingerprint, False)
+            return
+
+        chunk = []
+        try:
+            for contact in self.iter_contacts():
+                if self.cancelled:
+                    return
+                chunk.append(contact)
+                if len(chunk) >= self.chunk_size:
+                    idle_add(self._deliver, chunk)
+                    chunk = []
+        except Exception, e:
+            logger.error("Error reading Evolution contacts: %s" % e)
+            # don't let what was read pass for the whole addressbooks
+            fingerprint = None
+
+        if chunk:
+            idle_add(self._deliver, chunk)
+        idle_add(self._done, fingerprint, True)
+
+    def _deliver(self, chunk):
+        # from the main loop
+        if not self.cancelled:
+            self.chunk_cb(chunk)
+        return False
+
+    def _done(self, fingerprint, changed):
+        if not self.cancelled:
+            self.done_cb(fingerprint, changed)
+        return False
@@ -16,12 +16,18 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import os
 from zope.interface import implements
-from os.path import join
+from os.path import expanduser, join
 
 from gui.translate import _
 from gui.consts import IMAGES_DIR
 from gui.contacts.interface import IContact
+from gui.logger import logger
+
+KDE_ADDRESSBOOK = join('.kde', 'share', 'apps', 'kabc', 'std.vcf')
+# the only vCard properties we look at
+KDE_FIELDS = ['FN', 'TEL', 'EMAIL']
 
 
 class KDEContact(object):
@@ -94,34 +100,55 @@ class KDEContactsManager(object):
         return False
 
     def get_contacts(self):
-        from os.path import expanduser
-
         # XXX: maybe we should try to read a system version of the
         #      vcard library provided with pycocuma
-        from gui.contrib.pycocuma.vcard import vCardList
+        from gui.contrib.pycocuma.vcard import iterVCards
 
-        vl = vCardList()
+        try:
+            fd = open(self._get_path(), 'rb')
+        except IOError:
+            return []
 
         ret = []
-        if vl.LoadFromFile(expanduser('~') + '/.kde/share/apps/kabc/std.vcf'):
-            for vc in vl.data.keys():
+        try:
+            # the cards are parsed as they are read, and only the
+            # properties we need
+            for card in iterVCards(fd, KDE_FIELDS):
 
-                fn = vl.data[vc].fn.get()
+                fn = card.fn.get()
 
                 if len(fn):
-                    tel = vl.data[vc].tel
                     cell = ''
-                    for num in tel:
+                    for num in card.tel:
                         if 'CELL' in num.params.get('type'):
                             cell = num.value.get()
                             break
 
                     # try to exclude distribution lists etc
-                    email = vl.data[vc].email
-                    if len(cell) or len(email):
+                    if len(cell) or len(card.email):
                         ret.append(KDEContact(name=fn, number=cell))
+        except Exception, e:
+            logger.error("Error reading KDE contacts: %s" % e)
+            ret = []
+        finally:
+            fd.close()
+
         return ret
 
+    def _get_path(self):
+        return join(expanduser('~'), KDE_ADDRESSBOOK)
+
+    def get_fingerprint(self):
+        """Returns what changes along with the contacts, see snapshot"""
+        try:
+            st = os.stat(self._get_path())
+        except OSError:
+            return 'missing'
+        return '%r:%d' % (st.st_mtime, st.st_size)
+
+    def make_contact(self, name, number, index=None):
+        return KDEContact(name=name, number=number, index=index)
+
     def get_contact_by_id(self, index):
         print "KDEContactsManager::get_contact_by_id called"
         return None
@@ -24,6 +24,7 @@ from wader.common.consts import CTS_INTFACE
 from gui.translate import _
 from gui.consts import IMAGES_DIR
 from gui.contacts.interface import IContact
+from gui.contacts.snapshot import snapshots
 
 
 class SIMContact(object):
@@ -95,6 +96,8 @@ class SIMContact(object):
         if index <= 0:
             return False
 
+        # the SIM is only read again if we forget its contacts
+        snapshots.invalidate(SIMContactsManager.__name__)
         return True
 
 
@@ -115,6 +118,7 @@ class SIMContactsManager(object):
         index = self.device.Add(name, number,
                                 dbus_interface=CTS_INTFACE)
         if index > 0:
+            snapshots.invalidate(self.__class__.__name__)
             return SIMContact(name, number, index, self.device)
         else:
             return None
@@ -126,8 +130,15 @@ class SIMContactsManager(object):
 
     def delete_contact_by_id(self, index):
         self.device.Delete(index, dbus_interface=CTS_INTFACE)
+        snapshots.invalidate(self.__class__.__name__)
         return True
 
+    def delete_contact_async(self, contact, reply_handler, error_handler):
+        snapshots.invalidate(self.__class__.__name__)
+        self.device.Delete(contact.get_index(), dbus_interface=CTS_INTFACE,
+                           reply_handler=reply_handler,
+                           error_handler=error_handler)
+
     def get_contacts(self):
         ret = []
         clist = self.device.List(dbus_interface=CTS_INTFACE)
@@ -155,6 +166,9 @@ class SIMContactsManager(object):
                             reply_handler=_cb,
                             error_handler=eb)
 
+    def make_contact(self, name, number, index=None):
+        return SIMContact(name, number, index, self.device)
+
     def get_contact_by_id(self, index):
         c = self.device.Get(index, dbus_interface=CTS_INTFACE)
         if c:
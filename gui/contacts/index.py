@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+index maps phone numbers to the contacts holding them
+"""
+
+import re
+
+from gui.network_codes import get_dialing_info
+
+SEPARATORS = re.compile(r'[\s\-\.\(\)/]')
+DIALABLE = re.compile(r'^\+?\d+$')
+
+
+def _to_unicode(s):
+    if isinstance(s, str):
+        return s.decode('utf8', 'replace')
+    return s or u''
+
+
+def normalize_number(number, dialing=None):
+    """
+    Returns C{number} in a canonical form suitable for comparisons
+
+    Separators are stripped and the 00 international prefix is turned
+    into a '+'. If C{dialing}, the (country code, trunk prefix, national
+    length) of the SIM's country, is known national numbers get the
+    country code too, so '0612 345 678' and '+31612345678' are the same
+    number for a Dutch SIM. Where national numbers have a fixed length
+    they get it without the trunk prefix too, so '(212) 555-0100' is
+    '+12125550100' for a US SIM. Numbers that are not dialable
+    (alphanumeric senders) are returned untouched.
+    """
+    if not number:
+        return ''
+
+    cleaned = SEPARATORS.sub('', number)
+    if not DIALABLE.match(cleaned):
+        return number.strip()
+
+    if cleaned.startswith('+'):
+        return cleaned
+
+    if cleaned.startswith('00'):
+        return '+' + cleaned[2:]
+
+    if dialing is None:
+        return cleaned
+
+    code, trunk, length = dialing
+    if not trunk or len(cleaned) == length:
+        return '+' + code + cleaned
+
+    if cleaned.startswith(trunk):
+        return '+' + code + cleaned[len(trunk):]
+
+    # a short code or some number we don't know how to expand
+    return cleaned
+
+
+class ContactIndex(object):
+    """
+    I index contacts by their normalized phone number
+
+    I'm kept up to date as contacts are added, removed or renumbered, so
+    every lookup is a dictionary access rather than a scan of the whole
+    phonebook.
+    """
+
+    def __init__(self, contacts=None, imsi=None):
+        super(ContactIndex, self).__init__()
+        self.dialing = get_dialing_info(imsi) if imsi else None
+        # normalized number -> list of contacts
+        self._index = {}
+        # id(contact) -> (contact, normalized number)
+        self._contacts = {}
+
+        if contacts:
+            for contact in contacts:
+                self.add(contact)
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def _normalize(self, number):
+        return normalize_number(number, self.dialing)
+
+    def set_imsi(self, imsi):
+        """Sets the SIM whose country is used to expand national numbers"""
+        dialing = get_dialing_info(imsi) if imsi else None
+        if dialing == self.dialing:
+            return False
+
+        self.dialing = dialing
+        contacts = [contact for contact, key in self._contacts.values()]
+        self.clear()
+        for contact in contacts:
+            self.add(contact)
+        return True
+
+    def add(self, contact):
+        key = self._normalize(contact.get_number())
+        self._contacts[id(contact)] = (contact, key)
+        if key:
+            self._index.setdefault(key, []).append(contact)
+
+    def remove(self, contact):
+        contact, key = self._contacts.pop(id(contact), (contact, None))
+        if key not in self._index:
+            return
+
+        # some contacts compare equal by value, we want this very one
+        contacts = [c for c in self._index[key] if c is not contact]
+        if contacts:
+            self._index[key] = contacts
+        else:
+            del self._index[key]
+
+    def update(self, contact):
+        """Reindexes C{contact} after its number has changed"""
+        self.remove(contact)
+        self.add(contact)
+
+    def clear(self):
+        self._index = {}
+        self._contacts = {}
+
+    def lookup(self, number):
+        """Returns the list of contacts whose number is C{number}"""
+        return list(self._index.get(self._normalize(number), []))
+
+    def find_by_name(self, pattern):
+        """
+        Returns the contacts whose name contains C{pattern}, ignoring case
+        """
+        pattern = _to_unicode(pattern).lower()
+        return [contact for contact, key in self._contacts.values()
+                    if pattern in _to_unicode(contact.get_name()).lower()]
+
+    def get_number_forms(self, number):
+        """
+        Returns the ways C{number} might have been stored by the network
+
+        Besides the number as written and its normalized form, numbers of
+        the SIM's country are given in their national forms too.
+        """
+        forms = set([number, SEPARATORS.sub('', number or '')])
+        key = self._normalize(number)
+        forms.add(key)
+        if self.dialing is not None and key.startswith('+' + self.dialing[0]):
+            code, trunk, length = self.dialing
+            national = key[len(code) + 1:]
+            forms.add(national)
+            if trunk:
+                forms.add(trunk + national)
+        forms.discard('')
+        return forms
+
+    def find_numbers_by_name(self, pattern):
+        """
+        Returns every form of the numbers whose contact name contains
+        C{pattern}, see L{get_number_forms}
+        """
+        numbers = set()
+        for contact in self.find_by_name(pattern):
+            numbers.update(self.get_number_forms(contact.get_number()))
+        return numbers
+
+    def get_name(self, number):
+        """Returns the name of the first contact with C{number} or None"""
+        contacts = self._index.get(self._normalize(number))
+        return contacts[0].get_name() if contacts else None
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+snapshot keeps a copy of every contacts backend on disk
+"""
+
+import sqlite3
+
+from gui.consts import CONTACTS_DB
+from gui.logger import logger
+from gui.providers import Connection, pool
+
+SNAPSHOT_SCHEMA = """
+create table if not exists backend (
+    name text primary key,
+    fingerprint text not null
+);
+create table if not exists contact (
+    backend text not null,
+    position integer not null,
+    idx,
+    name text,
+    number text
+);
+create index if not exists contact_backend_idx on contact(backend, position);
+"""
+
+
+class ContactsSnapshot(object):
+    """
+    I store the contacts last read from every backend
+
+    Along with the contacts of a backend I keep its fingerprint, what
+    tells if they changed: the IMSI for the SIM, the modification time
+    and size of the vCard file for KDE and the addressbooks revision for
+    Evolution. As long as the backend reports the same fingerprint its
+    contacts can be taken from me instead of being read again. Backends
+    are identified by their manager's class name.
+    """
+
+    def __init__(self, path=CONTACTS_DB):
+        super(ContactsSnapshot, self).__init__()
+        self.path = path
+        # opened on first use
+        self.conn = None
+
+    def _get_conn(self):
+        if self.conn is None:
+            self.conn = pool.get(Connection, self.path)
+            self.conn.executescript(SNAPSHOT_SCHEMA)
+        return self.conn
+
+    def get_fingerprint(self, backend):
+        """Returns the fingerprint of C{backend}'s snapshot or None"""
+        try:
+            c = self._get_conn().execute("select fingerprint from backend "
+                                         "where name = ?", (backend,))
+            row = c.fetchone()
+        except sqlite3.Error, e:
+            logger.error("Error reading the contacts snapshot: %s" % e)
+            return None
+        return row[0] if row else None
+
+    def load(self, backend):
+        """Returns the (name, number, index) of C{backend}'s contacts"""
+        try:
+            c = self._get_conn().execute("select name, number, idx "
+                                         "from contact where backend = ? "
+                                         "order by position", (backend,))
+            return c.fetchall()
+        except sqlite3.Error, e:
+            logger.error("Error reading the contacts snapshot: %s" % e)
+            return []
+
+    def save(self, backend, fingerprint, contacts):
+        """Replaces the snapshot of C{backend} with C{contacts}"""
+        rows = [(backend, i, c.get_index(), c.get_name(), c.get_number())
+                    for i, c in enumerate(contacts)]
+        conn = self._get_conn()
+        try:
+            conn.execute("delete from contact where backend = ?", (backend,))
+            conn.executemany("insert into contact(backend, position, idx, "
+                             "name, number) values (?, ?, ?, ?, ?)", rows)
+            conn.execute("insert or replace into backend(name, fingerprint) "
+                         "values (?, ?)", (backend, fingerprint))
+            conn.commit()
+        except sqlite3.Error, e:
+            conn.rollback()
+            logger.error("Error saving the %s contacts snapshot: %s"
+                         % (backend, e))
+
+    def invalidate(self, backend=None):
+        """Forgets the snapshot of C{backend}, of every backend if None"""
+        conn = self._get_conn()
+        try:
+            if backend is None:
+                conn.execute("delete from contact")
+                conn.execute("delete from backend")
+            else:
+                conn.execute("delete from contact where backend = ?",
+                             (backend,))
+                conn.execute("delete from backend where name = ?",
+                             (backend,))
+            conn.commit()
+        except sqlite3.Error, e:
+            conn.rollback()
+            logger.error("Error invalidating the contacts snapshot: %s" % e)
+
+
+snapshots = ContactsSnapshot()
@@ -42,10 +42,13 @@ class Controller (Observer):
     parameter spurious controls the way spurious value change
     notifications are handled. If True, assignments to observable
     properties that do not actually change the value are
-    notified anyway."""
+    notified anyway.
 
-    def __init__(self, model, spurious=False):
-        Observer.__init__(self, model, spurious)
+    parameter weak registers the controller as a weakly referenced
+    observer, so it does not outlive its view because of the model."""
+
+    def __init__(self, model, spurious=False, weak=False):
+        Observer.__init__(self, model, spurious, weak)
 
         self.view = None
         self.__adapters = []
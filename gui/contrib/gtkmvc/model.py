@@ -21,11 +21,108 @@
 #  or email to the author Roberto Cavada <cavada@fbk.eu>.
 #  Please report bugs to <cavada@fbk.eu>.
 
+import re
+import weakref
+
 import support.metaclasses
 from support.wrappers import ObsWrapperBase
 from observable import Signal
 
 
+_NOTIFICATION_RE = re.compile(
+    r"^property_(.+)_(value_change|signal_emit|before_change|after_change)$")
+
+# observer class -> {property name: {notification kind: method name}}
+_dispatch_tables = weakref.WeakKeyDictionary()
+
+def get_dispatch_table(cls):
+    """Returns the notification methods defined by the observer
+    class cls, as a map from property names to maps from notification
+    kinds ('value_change', 'signal_emit', 'before_change' and
+    'after_change') to method names. The class is searched only the
+    first time, tables are cached afterwards"""
+    try: return _dispatch_tables[cls]
+    except KeyError: pass
+
+    table = {}
+    for name in dir(cls):
+        match = _NOTIFICATION_RE.match(name)
+        if match is None: continue
+        prop_name, kind = match.groups()
+        table.setdefault(prop_name, {})[kind] = name
+        pass
+
+    _dispatch_tables[cls] = table
+    return table
+
+def get_observer_dispatch_table(observer):
+    """Returns the dispatch table of observer, see
+    get_dispatch_table(). Notification methods set on the instance
+    (as adapters do) are added to those of its class"""
+    table = get_dispatch_table(observer.__class__)
+
+    extra = {}
+    for name in getattr(observer, "__dict__", {}).keys():
+        match = _NOTIFICATION_RE.match(name)
+        if match is None: continue
+        prop_name, kind = match.groups()
+        extra.setdefault(prop_name, {})[kind] = name
+        pass
+
+    if not extra: return table
+    table = dict([(prop_name, dict(methods))
+                  for prop_name, methods in table.iteritems()])
+    for prop_name, methods in extra.iteritems():
+        table.setdefault(prop_name, {}).update(methods)
+        pass
+    return table
+
+
+class _WeakMethod (object):
+    """Method of a weakly referenced observer. It behaves as the
+    bound method would, without keeping the observer alive"""
+
+    def __init__(self, ref, name):
+        self.ref = ref
+        self.name = name
+        return
+
+    def __get_im_self(self): return self.ref()
+    im_self = property(__get_im_self)
+
+    def __call__(self, *args, **kwargs):
+        observer = self.ref()
+        if observer is None: return None
+        return getattr(observer, self.name)(*args, **kwargs)
+
+    def __eq__(self, other):
+        return isinstance(other, _WeakMethod) and \
+               self.ref is other.ref and self.name == other.name
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    pass # end of class _WeakMethod
+
+
+class _Batch (object):
+    """Context manager returned by Model.batch()"""
+
+    def __init__(self, model):
+        self.model = model
+        return
+
+    def __enter__(self):
+        self.model.begin_batch()
+        return self.model
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.model.end_batch()
+        return False
+
+    pass # end of class _Batch
+
+
 class Model (object):
     """
     This class is the application model base class. It handles a set
@@ -50,20 +147,57 @@ class Model (object):
     pattern. The notification method gets the emitting model, the
     old value for the property and the new one.  Properties
     functionalities are automatically provided by the
-    ObservablePropertyMeta meta-class."""
+    ObservablePropertyMeta meta-class.
+
+    Several assignments can be grouped in a batch (see batch(),
+    begin_batch() and end_batch()): value change notifications are
+    then deferred to the end of the batch, and each property changed
+    is notified once, with the value it had before the batch and the
+    last one assigned.
+
+    An observer defining a method 'properties_changed' gets, besides
+    the usual notifications, a single call from an idle handler with
+    the model and a map of every property changed since the previous
+    call to its (old, new) values. If the observer has a
+    __changed_properties__ sequence only those properties are
+    reported, otherwise every one is.
+
+    Observers registered with weak=True are only weakly referenced:
+    they are unregistered automatically once nothing else keeps them
+    alive, instead of being kept around by the model."""
 
     __metaclass__  = support.metaclasses.ObservablePropertyMeta
     __properties__ = {} # override this
 
+    # names of the properties whose value changes someone listens to,
+    # notify_property_value_change returns right away for the others
+    _observed_properties = frozenset()
+
     def __init__(self):
         object.__init__(self)
         self.__observers = []
+        # weakly registered observers, id(observer) -> weakref
+        self.__weak_observers = {}
         # keys are properties names, values are methods inside the observer:
         self.__value_notifications = {}
         self.__instance_notif_before = {}
         self.__instance_notif_after = {}
         self.__signal_notif = {}
 
+        # batched value changes, property name -> [old, new]
+        self.__batch_depth = 0
+        self.__batch_changes = {}
+        self.__batch_order = []
+
+        # (properties_changed method, property names or None for all)
+        # of the observers getting the coalesced changes from an idle
+        # handler
+        self.__changed_observers = []
+        # properties they want, None for all of them
+        self.__changed_interest = frozenset()
+        self.__idle_changes = {}
+        self.__idle_id = None
+
         for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
             self.register_property(key)
             pass
@@ -108,25 +242,144 @@ class Model (object):
                self.__derived_properties__.has_key(name)
 
 
-    def register_observer(self, observer):
-        if observer in self.__observers: return # not already registered
+    def register_observer(self, observer, weak=False):
+        if self.__is_registered(observer): return # already registered
 
-        self.__observers.append(observer)
-        for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
-            self.__add_observer_notification(observer, key)
+        if weak:
+            key = id(observer)
+            self.__weak_observers[key] = weakref.ref(observer,
+                lambda ref, key=key: self.__drop_weak_observer(key))
+        else:
+            self.__observers.append(observer)
+            pass
+
+        table = get_observer_dispatch_table(observer)
+        for key, methods in table.iteritems():
+            if self.has_property(key):
+                self.__add_observer_notification(observer, key, methods)
+                pass
+            pass
+
+        if hasattr(observer, "properties_changed"):
+            names = getattr(observer, "__changed_properties__", None)
+            if names is not None: names = frozenset(names)
+            self.__changed_observers.append(
+                (self.__get_method(observer, "properties_changed"), names))
             pass
 
+        self.__update_observed_properties()
         return
 
 
     def unregister_observer(self, observer):
-        if observer not in self.__observers: return
+        if not self.__is_registered(observer): return
 
-        for key in (self.__properties__.keys() + self.__derived_properties__.keys()):
-            self.__remove_observer_notification(observer, key)
+        table = get_observer_dispatch_table(observer)
+        for key, methods in table.iteritems():
+            if self.has_property(key):
+                self.__remove_observer_notification(observer, key, methods)
+                pass
+            pass
+
+        if hasattr(observer, "properties_changed"):
+            method = self.__get_method(observer, "properties_changed")
+            self.__changed_observers = [(m, names)
+                for m, names in self.__changed_observers if m != method]
+            pass
+        self.__cancel_idle_changes()
+
+        if self.__weak_observers.has_key(id(observer)):
+            del self.__weak_observers[id(observer)]
+        else:
+            self.__observers.remove(observer)
+            pass
+
+        self.__update_observed_properties()
+        return
+
+
+    def get_observers_count(self):
+        """Returns the number of observers registered, weakly
+        referenced ones included. Useful to spot leaked observers"""
+        return len(self.__observers) + len(self.__weak_observers)
+
+
+    def __is_registered(self, observer):
+        return self.__weak_observers.has_key(id(observer)) or \
+               observer in self.__observers
+
+
+    def __get_observers(self):
+        observers = list(self.__observers)
+        for ref in self.__weak_observers.values():
+            observer = ref()
+            if observer is not None: observers.append(observer)
+            pass
+        return observers
+
+
+    def __get_method(self, observer, name):
+        """Returns the method to be stored for later notifications"""
+        ref = self.__weak_observers.get(id(observer))
+        if ref is not None: return _WeakMethod(ref, name)
+        return getattr(observer, name)
+
+
+    def __drop_weak_observer(self, key):
+        """Called when a weakly registered observer is collected"""
+        ref = self.__weak_observers.pop(key, None)
+        if ref is None: return
+
+        def alive(method):
+            return not isinstance(method, _WeakMethod) or method.ref is not ref
+
+        # lists are replaced rather than modified, as a notification
+        # might be looping over them right now
+        for notifications in (self.__value_notifications,
+                              self.__signal_notif,
+                              self.__instance_notif_before,
+                              self.__instance_notif_after):
+            for prop_name, methods in notifications.items():
+                notifications[prop_name] = filter(alive, methods)
+                pass
+            pass
+
+        self.__changed_observers = [(method, names)
+            for method, names in self.__changed_observers if alive(method)]
+        self.__cancel_idle_changes()
+        self.__update_observed_properties()
+        return
+
+
+    def __cancel_idle_changes(self):
+        if not self.__changed_observers and self.__idle_id is not None:
+            gobject.source_remove(self.__idle_id)
+            self.__idle_id = None
+            self.__idle_changes = {}
+            pass
+        return
+
+
+    def __update_observed_properties(self):
+        interest = set()
+        for method, names in self.__changed_observers:
+            if names is None:
+                # this properties_changed() wants to hear about everything
+                interest = None
+                break
+            interest.update(names)
             pass
 
-        self.__observers.remove(observer)
+        if interest is None:
+            self.__changed_interest = None
+            observed = self.__value_notifications.keys()
+        else:
+            self.__changed_interest = frozenset(interest)
+            notifications = self.__value_notifications
+            observed = [name for name, methods in notifications.iteritems()
+                        if methods or name in interest]
+            pass
+        self._observed_properties = frozenset(observed)
         return
 
 
@@ -138,20 +391,27 @@ class Model (object):
 
         self.register_property(prop_name)
 
-        for observer in self.__observers:
-            self.__remove_observer_notification(observer, prop_name)
-            self.__add_observer_notification(observer, prop_name)
+        for observer in self.__get_observers():
+            methods = get_observer_dispatch_table(observer).get(prop_name)
+            if methods:
+                self.__remove_observer_notification(observer, prop_name,
+                                                    methods)
+                self.__add_observer_notification(observer, prop_name,
+                                                 methods)
+                pass
             pass
+
+        self.__update_observed_properties()
         return
 
 
-    def __add_observer_notification(self, observer, prop_name):
-        """Searches in the observer for any possible listener, and
-        stores the notification methods to be called later"""
+    def __add_observer_notification(self, observer, prop_name, methods):
+        """Stores the notification methods of the observer to be
+        called later. methods is the entry for prop_name in the
+        dispatch table of the observer class"""
 
-        method_name = "property_%s_value_change" % prop_name
-        if hasattr(observer, method_name):
-            method = getattr(observer, method_name)
+        if methods.has_key("value_change"):
+            method = self.__get_method(observer, methods["value_change"])
             if method not in self.__value_notifications[prop_name]:
                 list.append(self.__value_notifications[prop_name], method)
                 pass
@@ -160,9 +420,8 @@ class Model (object):
         # is it a signal?
         orig_prop = getattr(self, "_prop_%s" % prop_name)
         if isinstance(orig_prop, Signal):
-            method_name = "property_%s_signal_emit" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
+            if methods.has_key("signal_emit"):
+                method = self.__get_method(observer, methods["signal_emit"])
                 if method not in self.__signal_notif[prop_name]:
                     list.append(self.__signal_notif[prop_name], method)
                     pass
@@ -171,17 +430,15 @@ class Model (object):
 
         # is it an instance change notification type?
         elif isinstance(orig_prop, ObsWrapperBase):
-            method_name = "property_%s_before_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
+            if methods.has_key("before_change"):
+                method = self.__get_method(observer, methods["before_change"])
                 if method not in self.__instance_notif_before[prop_name]:
                     list.append(self.__instance_notif_before[prop_name], method)
                     pass
                 pass
 
-            method_name = "property_%s_after_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
+            if methods.has_key("after_change"):
+                method = self.__get_method(observer, methods["after_change"])
                 if method not in self.__instance_notif_after[prop_name]:
                     list.append(self.__instance_notif_after[prop_name], method)
                     pass
@@ -191,11 +448,10 @@ class Model (object):
         return
 
 
-    def __remove_observer_notification(self, observer, prop_name):
+    def __remove_observer_notification(self, observer, prop_name, methods):
         if self.__value_notifications.has_key(prop_name):
-            method_name = "property_%s_value_change" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
+            if methods.has_key("value_change"):
+                method = self.__get_method(observer, methods["value_change"])
                 if method in self.__value_notifications[prop_name]:
                     self.__value_notifications[prop_name].remove(method)
                     pass
@@ -206,9 +462,8 @@ class Model (object):
         orig_prop = getattr(self, "_prop_%s" % prop_name)
         # is it a signal?
         if isinstance(orig_prop, Signal):
-            method_name = "property_%s_signal_emit" % prop_name
-            if hasattr(observer, method_name):
-                method = getattr(observer, method_name)
+            if methods.has_key("signal_emit"):
+                method = self.__get_method(observer, methods["signal_emit"])
                 if method in self.__signal_notif[prop_name]:
                     self.__signal_notif[prop_name].remove(method)
                     pass
@@ -218,9 +473,9 @@ class Model (object):
         # is it an instance change notification type?
         elif isinstance(orig_prop, ObsWrapperBase):
             if self.__instance_notif_before.has_key(prop_name):
-                method_name = "property_%s_before_change" % prop_name
-                if hasattr(observer, method_name):
-                    method = getattr(observer, method_name)
+                if methods.has_key("before_change"):
+                    method = self.__get_method(observer,
+                                               methods["before_change"])
                     if method in self.__instance_notif_before[prop_name]:
                         self.__instance_notif_before[prop_name].remove(method)
                         pass
@@ -228,9 +483,9 @@ class Model (object):
                 pass
 
             if self.__instance_notif_after.has_key(prop_name):
-                method_name = "property_%s_after_change" % prop_name
-                if hasattr(observer, method_name):
-                    method = getattr(observer, method_name)
+                if methods.has_key("after_change"):
+                    method = self.__get_method(observer,
+                                               methods["after_change"])
                     if method in self.__instance_notif_after[prop_name]:
                         self.__instance_notif_after[prop_name].remove(method)
                         pass
@@ -249,14 +504,102 @@ class Model (object):
         return method(*args, **kwargs)
 
 
+    # ---------- Batches:
+
+    def batch(self):
+        """Returns a context manager grouping the assignments done
+        inside the 'with' block in a batch"""
+        return _Batch(self)
+
+    def begin_batch(self):
+        """Starts deferring value change notifications until the
+        matching end_batch(). Batches can be nested, notifications
+        are sent when the outermost one ends"""
+        self.__batch_depth += 1
+        return
+
+    def end_batch(self):
+        """Ends a batch started by begin_batch(), sending one
+        notification per property changed during the batch"""
+        assert(self.__batch_depth > 0)
+        self.__batch_depth -= 1
+        if self.__batch_depth: return
+
+        changes, order = self.__batch_changes, self.__batch_order
+        self.__batch_changes, self.__batch_order = {}, []
+        for prop_name in order:
+            old, new = changes[prop_name]
+            self.__notify_value_change(prop_name, old, new)
+            pass
+        return
+
+    def __queue_idle_change(self, prop_name, old, new):
+        if self.__idle_changes.has_key(prop_name):
+            self.__idle_changes[prop_name][1] = new
+        else:
+            self.__idle_changes[prop_name] = [old, new]
+            pass
+
+        if self.__idle_id is None:
+            self.__idle_id = gobject.idle_add(self.__idle_changes_cb)
+            pass
+        return
+
+    def __idle_changes_cb(self):
+        changes = self.__idle_changes
+        self.__idle_changes, self.__idle_id = {}, None
+
+        changes = dict([(prop_name, (old, new))
+                        for prop_name, (old, new) in changes.iteritems()
+                        if old != new])
+        if changes:
+            for method, names in list(self.__changed_observers):
+                if names is not None:
+                    wanted = dict([(prop_name, change)
+                                   for prop_name, change in changes.iteritems()
+                                   if prop_name in names])
+                else: wanted = changes
+                if wanted:
+                    self.__notify_observer__(method.im_self, method,
+                                             self, wanted)
+                    pass
+                pass
+            pass
+        return False
+
+
     # ---------- Notifiers:
 
     def notify_property_value_change(self, prop_name, old, new):
         assert(self.__value_notifications.has_key(prop_name))
+        if prop_name not in self._observed_properties:
+            # nobody is listening, skip the work of notifying it
+            return
+
+        if self.__batch_depth:
+            if self.__batch_changes.has_key(prop_name):
+                self.__batch_changes[prop_name][1] = new
+            else:
+                self.__batch_changes[prop_name] = [old, new]
+                self.__batch_order.append(prop_name)
+                pass
+            return
+
+        self.__notify_value_change(prop_name, old, new)
+        return
+
+    def __notify_value_change(self, prop_name, old, new):
+        interest = self.__changed_interest
+        if self.__changed_observers and \
+               (interest is None or prop_name in interest):
+            self.__queue_idle_change(prop_name, old, new)
+            pass
+
+        changed = old != new
         for method in self.__value_notifications[prop_name] :
             obs = method.im_self
             # notification occurs checking spuriousness of the observer
-            if old != new or obs.accepts_spurious_change():
+            if changed or obs.accepts_spurious_change():
                 self.__notify_observer__(obs, method,
                                          self, old, new) # notifies the change
                 pass
@@ -295,6 +638,7 @@ class Model (object):
 
 
 
+import gobject
 import gtk
 # ----------------------------------------------------------------------
 class TreeStoreModel (Model, gtk.TreeStore):
@@ -25,6 +25,7 @@
 #from gtkmvc.model import Model
 from model import Model
 import support.metaclasses
+import weakref
 
 try: import threading as _threading
 except ImportError: import dummy_threading as _threading
@@ -46,12 +47,13 @@ class ModelMT (Model):
 
     def __init__(self):
         Model.__init__(self)
-        self.__observer_threads = {}
+        # weak keys, so weakly registered observers can go away
+        self.__observer_threads = weakref.WeakKeyDictionary()
         self._prop_lock = _threading.Lock()
         return
 
-    def register_observer(self, observer):
-        Model.register_observer(self, observer)
+    def register_observer(self, observer, weak=False):
+        Model.register_observer(self, observer, weak)
         self.__observer_threads[observer] = _threading.currentThread()
         return
 
@@ -27,7 +27,7 @@
 class Observer (object):
     """Use this class as base class of all observers"""
 
-    def __init__(self, model=None, spurious=False):
+    def __init__(self, model=None, spurious=False, weak=False):
         """
         When parameter spurious is set to False
         (default value) the observer declares that it is not
@@ -52,17 +52,22 @@ class Observer (object):
         spurious that changes the previous behaviour
         but keeps availability of a possible backward compatible
         feature.
+
+        When parameter weak is True the model only keeps a weak
+        reference to the observer, which is unregistered
+        automatically when nothing else refers to it anymore.
         """
 
         self.model = None
         self.__accepts_spurious__ = spurious
+        self.__weak__ = weak
         self.register_model(model)
         return
 
     def register_model(self, model):
         self.unregister_model()
         self.model = model
-        if self.model: self.model.register_observer(self)
+        if self.model: self.model.register_observer(self, weak=self.__weak__)
         return
 
     def accepts_spurious_change(self):
@@ -79,9 +84,9 @@ class Observer (object):
             pass
         return
 
-    def __del__(self):
-        self.unregister_model()
-        return
+    # There is no __del__ unregistering the observer: a registered
+    # observer is kept alive by its model anyway, and a __del__ would
+    # make the cycles observers are usually part of uncollectable.
 
     def get_model(self): return self.model
 
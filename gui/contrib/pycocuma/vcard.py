@@ -88,6 +88,58 @@ vC_email_types_default = ["internet"]
 
 SUPPORTED_VERSIONS = ["2.1", "3.0"]
 
+# content lines needed to delimit and check every card
+STRUCTURE_NAMES = ["BEGIN", "END", "VERSION"]
+
+def contentline_name(line):
+    "Return the upper-cased NAME of a content line without parsing it"
+    end = len(line)
+    for delim in ";:":
+        pos = line.find(delim)
+        if pos != -1 and pos < end:
+            end = pos
+    name = line[:end].strip()
+    # drop the GROUP
+    return name[name.find(".") + 1:].upper()
+
+def iterVCards(stream, fields=None, encoding='utf8'):
+    """Yield the vCards of stream (any iterable of lines) one at a time
+
+    The stream is read and de-folded as the cards are yielded, so memory
+    use does not depend on the number of cards. If fields, a list of
+    content line names like ["FN", "TEL"], is given only those lines are
+    parsed, the cards have the default values for everything else."""
+    accept = None
+    if fields is not None:
+        fields = set([name.upper() for name in fields] + STRUCTURE_NAMES)
+        # the other lines are not even de-folded
+        accept = lambda line: contentline_name(line) in fields
+
+    vCardBlock = None
+    for line in iterloglines(stream, accept):
+        if not isNonEmptyLine(line):
+            continue
+
+        if type(line) != UnicodeType:
+            line = unicode(line, encoding, 'replace')
+
+        line = vC_contentline(line)
+
+        if line.name == "BEGIN" and line.value.upper() == "VCARD":
+            vCardBlock = []
+
+        if vCardBlock == None:
+            #XXX: maybe we need to be a little more clever with stdout, but it should
+            #     end up in twisted's log
+            print "ERROR: Missing 'BEGIN:VCARD' ?"
+        else:
+            vCardBlock.append(line)
+
+        if line.name == "END" and line.value.upper() == "VCARD" \
+                and vCardBlock is not None:
+            yield vCard(vCardBlock)
+            vCardBlock = None
+
 class vC_n(vC_AbstractCompoundValue):
     "vCard Name record"
     def __init__(self, value="", params=None):
@@ -539,41 +591,20 @@ class vCardList:
         self.forgetLastReturnedField()
         return [ handle for sortstr, handle in decorated ]
 
-    def LoadFromFile(self, fname):
-        "Load from *.vcf file"
+    def LoadFromFile(self, fname, fields=None):
+        "Load from *.vcf file, see iterVCards for fields"
         try:
             fd = open(fname, "rb")
-            self.LoadFromStream(fd)
+            self.LoadFromStream(fd, fields=fields)
             fd.close()
         except:
             return False # Loading failed
         return True
 
-    def LoadFromStream(self, stream, encoding='utf8'):
+    def LoadFromStream(self, stream, encoding='utf8', fields=None):
         "Load from any text stream with file-like methods"
-        vCardBlock = None
-        lines = stream.readlines()
-        makeloglines(lines)
-
-        for line in filter(isNonEmptyLine, lines):
-            if type(line) != UnicodeType:
-                line = unicode(line, encoding, 'replace')
-
-            line = vC_contentline(line)
-
-            if line.name == "BEGIN" and line.value.upper() == "VCARD":
-                vCardName = "default"
-                vCardBlock = []
-
-            if vCardBlock == None:
-                #XXX: maybe we need to be a little more clever with stdout, but it should
-                #     end up in twisted's log
-                print "ERROR: Missing 'BEGIN:VCARD' ?"
-            else:
-                vCardBlock.append(line)
-
-            if line.name == "END" and line.value.upper() == "VCARD":
-                self.add(vCard(vCardBlock))
+        for card in iterVCards(stream, fields, encoding):
+            self.add(card)
 
     def SaveToFile(self, fname):
         "Save to *.vcf file"
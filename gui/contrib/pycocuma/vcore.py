@@ -84,9 +84,7 @@ def quoteParamValue(str):
 
 def chop_line(line):
     "Truncate line breaks"
-    while len(line) and line[-1] in ["\r","\n"]:
-        line=line[:-1]
-    return line
+    return line.rstrip("\r\n")
 
 def isNonEmptyLine(line):
     """are there characters other than space?
@@ -102,19 +100,36 @@ def isNonEmptyLine(line):
 
 def makeloglines(physical_lines):
     "Line De-Folding (RFC 2425): turn physical lines into logical ones"
-    i = 0
-    while i < len(physical_lines):
-        if i > 0 and len(physical_lines[i]) >= 2:
-            # Line is continued if next phy. line starts with
-            # single space or tab:
-            if physical_lines[i][0] in " \t":
-                physical_lines[i-1] =\
-                chop_line(physical_lines[i-1]) + physical_lines[i][1:]
-                del physical_lines[i]
-            else:
-                i += 1
-        else:
-            i += 1
+    # built anew rather than deleting in place, which is quadratic
+    physical_lines[:] = list(iterloglines(physical_lines))
+
+def iterloglines(physical_lines, accept=None):
+    """Line De-Folding (RFC 2425) of any iterable of lines, a stream too
+
+    yields the logical lines one at a time, in linear time. If accept is
+    given, only the lines for whose first physical line it returns True
+    are de-folded and yielded, the rest are skipped"""
+    parts = None
+    # whether the line being continued is wanted
+    wanted = True
+    first = True
+    for line in physical_lines:
+        # Line is continued if next phy. line starts with
+        # single space or tab:
+        if not first and len(line) >= 2 and line[0] in " \t":
+            if wanted:
+                parts[-1] = chop_line(parts[-1])
+                parts.append(line[1:])
+            continue
+        first = False
+        if parts is not None:
+            yield "".join(parts)
+            parts = None
+        wanted = accept is None or accept(line)
+        if wanted:
+            parts = [line]
+    if parts is not None:
+        yield "".join(parts)
 
 def log2phylines(logical_line):
     "Fold(break) Lines longer than 75-Chars"
@@ -155,7 +170,9 @@ class vC_params:
     "Parameters used by all vCard/vCalendar records"
     def __init__(self, text=""):
         self.dict = {}
-        self.parse(text)
+        # most values have no parameters
+        if text:
+            self.parse(text)
 
     def parse(self, text):
         params = VALUE_DELIM_RE.split(text)
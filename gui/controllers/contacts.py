@@ -114,7 +114,7 @@ class ContactsListController(Controller):
     """Controller for the contacts list"""
 
     def __init__(self, model, parent_ctrl, contacts):
-        super(ContactsListController, self).__init__(model)
+        super(ContactsListController, self).__init__(model, weak=True)
         self.parent_ctrl = parent_ctrl
         self.contacts = contacts
 
@@ -21,18 +21,17 @@ Controllers for diagnostics
 #from gtkmvc import Controller
 from gui.contrib.gtkmvc import Controller
 
-from wader.common.provider import NetworkProvider
-
 from gui.logger import logger
 from gui.constx import (GUI_VIEW_DISABLED, GUI_VIEW_IDLE, GUI_VIEW_BUSY,
                               GUI_MODEM_STATE_REGISTERED)
+from gui.providers import pool, get_open_counts, NetworkProvider
 
 
 class DiagnosticsController(Controller):
     """Controller for the diagnostics window"""
 
     def __init__(self, model, parent_ctrl):
-        super(DiagnosticsController, self).__init__(model)
+        super(DiagnosticsController, self).__init__(model, weak=True)
         self.parent_ctrl = parent_ctrl
         self.ussd_busy = False
 
@@ -49,6 +48,8 @@ class DiagnosticsController(Controller):
         self.view.set_appVersion_info(self.model.get_app_version())
         self.view.set_coreVersion_info(self.model.get_core_version())
         self.view['uptime_number_label'].set_text(self.model.get_uptime())
+        self.view.set_observers_info(self.model.get_observers_count())
+        self.view.set_db_opens_info(get_open_counts())
         self.view['os_name_label'].set_text(self.model.get_os_name())
         self.view['os_version_label'].set_text(self.model.get_os_version())
 
@@ -71,7 +72,7 @@ class DiagnosticsController(Controller):
 
     def set_network_country_info(self, imsi):
         try:
-            provider = NetworkProvider()
+            provider = pool.get(NetworkProvider)
             nets = provider.get_network_by_id(imsi)
             if not len(nets):
                 raise ValueError
@@ -80,8 +81,6 @@ class DiagnosticsController(Controller):
         except (TypeError, ValueError):
             self.view.set_network_info(None)
             self.view.set_country_info(None)
-        finally:
-            provider.close()
 
     # ------------------------------------------------------------ #
     #                       Signals Handling                       #
@@ -29,7 +29,8 @@ import gtk
 from gui.contrib.gtkmvc import Controller
 
 from gettext import dgettext
-from gobject import timeout_add_seconds
+from gobject import (timeout_add, timeout_add_seconds, source_remove,
+                     idle_add)
 
 from wader.common.signals import SIG_SMS_COMP, SIG_SMS_DELV
 from wader.common.keyring import KeyringInvalidPassword
@@ -56,7 +57,12 @@ from gui.consts import (GTK_LOCK, GUIDE_DIR, IMAGES_DIR, APP_URL,
                         CFG_PREFS_DEFAULT_TRAY_ICON,
                         CFG_PREFS_DEFAULT_CLOSE_MINIMIZES,
                         CFG_PREFS_DEFAULT_EXIT_WITHOUT_CONFIRMATION,
-                        TV_CNT_NAME, TV_CNT_NUMBER, TV_CNT_OBJ, TV_SMS_OBJ)
+                        CFG_PREFS_DEFAULT_SMS_AUTO_OFFLOAD,
+                        CFG_PREFS_DEFAULT_SIM_SMS_CAPACITY,
+                        CFG_PREFS_DEFAULT_SIM_SMS_THRESHOLD,
+                        CFG_PREFS_DEFAULT_SMS_SEND_WINDOW,
+                        TV_CNT_NAME, TV_CNT_NUMBER, TV_CNT_OBJ, TV_SMS_OBJ,
+                        TV_SMS_DATE, TV_CONV_OBJ)
 
 from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               GUI_SIM_AUTH_PUK, GUI_SIM_AUTH_PUK2,
@@ -67,11 +73,16 @@ from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               GUI_MODEM_STATE_CONNECTED,
                               TV_DICT, TV_DICT_REV)
 
-from gui.contacts import SIMContact
+from gui.contacts import SIMContact, supported_types
 from gui.phonebook import (get_phonebook, Contact,
                                 all_same_type, all_contacts_writable)
 from gui.csvutils import CSVUnicodeWriter, CSVContactsReader
-from gui.messages import get_messages_obj, is_sim_message
+from gui.messages import (get_messages_obj, is_sim_message,
+                          get_message_key, SIMMigration, DELIVERY_DELIVERED)
+from gui.incoming import IncomingBatcher
+from gui.pipeline import StageBarrier
+from gui.sendqueue import SendQueue
+from gui.smsc import smsc_cache
 
 from gui.network_codes import get_customer_support_info
 
@@ -96,6 +107,22 @@ from gui.models.profile import ProfileModel
 from gui.views.profile import APNSelectionView
 from gui.controllers.profile import APNSelectionController
 
+# the model properties shown in the status line
+STATUS_LINE_PROPERTIES = ['status', 'registration', 'tech', 'operator', 'rssi']
+
+# milliseconds to wait for more keystrokes before searching the messages
+SMS_SEARCH_DELAY = 250
+
+# senders named in the notification of a burst of messages
+SMS_NOTIFY_NAMES = 3
+
+# main notebook page listing the conversations
+CONVERSATIONS_PAGE = 4
+
+# a refresh changing this many rows lays the treeview out once, with its
+# model detached, rather than after every change
+DETACH_THRESHOLD = 50
+
 
 def get_fake_toggle_button():
     """Returns a toggled L{gtk.ToggleToolButton}"""
@@ -109,6 +136,9 @@ class MainController(Controller):
     I am the controller for the main window
     """
 
+    # only these are batched to properties_changed
+    __changed_properties__ = STATUS_LINE_PROPERTIES
+
     def __init__(self, model):
         model.ctrl = self
         super(MainController, self).__init__(model)
@@ -120,6 +150,25 @@ class MainController(Controller):
         self.tray = None
         # ignore cancelled connection attempts errors
         self._ignore_no_reply = False
+        # the Messages object the SMS treeviews are being paged from
+        self.pager_messages = None
+        # the stages of the last refresh_treeviews
+        self.refresh_barrier = None
+        # pending search and keys of the messages it found
+        self.sms_search_id = None
+        self.sms_search_keys = None
+        # SIM messages being moved to the DB
+        self.sim_migration = None
+        # incoming messages, read a burst at a time
+        self.sms_receiver = IncomingBatcher(self._fetch_received_sms,
+                                            self._on_sms_batch_received)
+        # outgoing messages, held until the device is registered
+        self.send_queue = SendQueue(get_messages_obj(None).smanager,
+                            self._on_queued_sms_sent,
+                            self._on_queued_sms_failed,
+                            self._on_send_queue_progress,
+                            config.get('preferences', 'sms_send_window',
+                                       CFG_PREFS_DEFAULT_SMS_SEND_WINDOW))
 
     def register_view(self, view):
         super(MainController, self).register_view(view)
@@ -148,6 +197,15 @@ class MainController(Controller):
             treeview.connect('key_press_event', self.__on_treeview_key_press)
             if treeview.name != 'contacts_treeview':
                 treeview.connect('row-activated', self._row_activated_tv)
+                treeview.get_vadjustment().connect('value-changed',
+                                        self._on_sms_treeview_scrolled,
+                                        treeview)
+                treeview.get_model().connect('sort-column-changed',
+                                        self._on_sms_sort_changed, treeview)
+
+        treeview = self.view['conversations_treeview']
+        treeview.get_vadjustment().connect('value-changed',
+                                        self._on_conversations_scrolled)
 
     def _quit_or_minimize(self, *args):
         close_minimizes = config.get('preferences', 'close_minimizes',
@@ -237,8 +295,11 @@ class MainController(Controller):
         self.model.get_imsi(imsi_callback)
 
     def _close_application_cb(self, *args):
-        message_mgr = get_messages_obj(self.model.device)
-        message_mgr.close()
+        # what is left in the queue will be sent next time
+        self.send_queue.set_device(None)
+
+        if self.pager_messages is not None:
+            self.pager_messages.close()
 
         try:
             os.unlink(GTK_LOCK)
@@ -284,13 +345,28 @@ class MainController(Controller):
         return True
 
     # properties
-    def property_status_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+    def properties_changed(self, model, changes):
+        # a burst of status changes redraws the status line only once
+        for name in STATUS_LINE_PROPERTIES:
+            if name in changes:
+                self.view.set_status_line(self.model.status,
+                                          self.model.registration,
+                                          self.model.tech,
+                                          self.model.operator,
+                                          self.model.rssi)
+                break
+
+    def property_imsi_value_change(self, model, old, new):
+        # the SIM was swapped, its SMSC will be looked up again
+        if old:
+            smsc_cache.invalidate(old)
+
+        # national numbers are expanded with the SIM's country code
+        contacts = self.view['contacts_treeview'].get_model()
+        if contacts.set_imsi(new):
+            self.update_message_contact_info()
 
+    def property_status_value_change(self, model, old, new):
         self.view.set_view_state(new)
 
         if old < GUI_MODEM_STATE_ENABLED and new >= GUI_MODEM_STATE_ENABLED:
@@ -313,33 +389,11 @@ class MainController(Controller):
             self.model.stop_stats_tracking()
             self.model.dial_path = None
 
-    def property_registration_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
-
-    def property_tech_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
-
-    def property_operator_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
-
-    def property_rssi_value_change(self, model, old, new):
-        self.view.set_status_line(self.model.status,
-                                     self.model.registration,
-                                     self.model.tech,
-                                     self.model.operator,
-                                     self.model.rssi)
+        # messages can only be sent while registered
+        if new >= GUI_MODEM_STATE_REGISTERED:
+            self.send_queue.set_device(self.model.device)
+        else:
+            self.send_queue.set_device(None)
 
     def on_net_password_required(self, opath, tag):
         password = ask_password_dialog(self.view)
@@ -409,6 +463,9 @@ class MainController(Controller):
                 sm.remove()
             self._hide_sim_contacts()
             self._hide_sim_messages()
+            # the SIM might come back with another SMSC
+            smsc_cache.invalidate()
+            self.sms_receiver.cancel()
             self.model.status = GUI_MODEM_STATE_NODEVICE
 
     def property_profile_value_change(self, model, old, new):
@@ -501,6 +558,14 @@ class MainController(Controller):
             self.view.set_transfer_rate(new, upload=True)
             logger.info("Rate tx: %d" % new)
 
+    def property_rx_rate_stats_value_change(self, model, old, new):
+        if old != new:
+            self.view.set_rate_stats(new, upload=False)
+
+    def property_tx_rate_stats_value_change(self, model, old, new):
+        if old != new:
+            self.view.set_rate_stats(new, upload=True)
+
     def property_transfer_limit_exceeded_value_change(self, model, old, new):
         if not old and new:
             show_warning_dialog(_("Transfer limit exceeded"),
@@ -561,19 +626,13 @@ class MainController(Controller):
         """
         Executed whenever a SMS delivery receipt is received
         """
-        # XXX: Will just notify user for now. If it's possible in the future,
-        #      it would be good to set flag against those messages in the sent
-        #      items to indicate delivery status, but that's probably going to
-        #      require changes in the on disk DB format to give persistence
-        sms = None
-
-        # Find the original message
-        treeview = self.view['sent_treeview']
-        for message in treeview.get_model().get_messages():
-            msgref = message.status_reference
-            if msgref is not None and msgref == reference:
-                sms = message
-                break
+        # the reference is indexed in the DB, the row is found by its key
+        messages_obj = get_messages_obj(self.model.device)
+        sms = messages_obj.smanager.set_delivered(reference)
+        if sms is not None:
+            model = self.get_unfiltered_model(self.view['sent_treeview'])
+            model.set_delivery_status(get_message_key(sms),
+                                      DELIVERY_DELIVERED)
 
         # Send notification - just display the first forty chars though
         if sms:
@@ -588,40 +647,97 @@ class MainController(Controller):
         title = _("SMS receipt received for %s") % who
         self.tray.attach_notification(title, text, stock=gtk.STOCK_INFO)
 
+    def _on_queued_sms_sent(self, msg, sms):
+        treeview = self.view['sent_treeview']
+        self.get_unfiltered_model(treeview).add_message(msg,
+                                                self._get_contact_index())
+
+    def _on_queued_sms_failed(self, failures):
+        """Shows the drafts C{failures} left and reports them at once"""
+        treeview = self.view['drafts_treeview']
+        contacts = self._get_contact_index()
+        details = []
+        for draft, sms, error in failures:
+            if draft is not None:
+                self.get_unfiltered_model(treeview).add_message(draft,
+                                                                contacts)
+            details.append('%s: %s' % (sms.number, get_error_msg(error)))
+
+        if len(failures) == 1:
+            title = _('Error while sending SMS to %s') % failures[0][1].number
+        else:
+            title = _('Error while sending %d SMS') % len(failures)
+        if [draft for draft, sms, error in failures if draft is not None]:
+            details.append(_('The messages have been saved as drafts.'))
+        show_error_dialog(title, '\n'.join(details))
+
+    def _on_send_queue_progress(self, processed, total=None):
+        self.view.set_sms_send_progress(processed, total)
+
     def on_sms_received_cb(self, index, complete):
         """
         Executed whenever a complete SMS is received, may be single or
         fully reassembled multipart message
 
-        Will read, populate the treeview and notify the user
+        The messages received in a burst are read, shown and notified
+        together, see L{_on_sms_batch_received}
         """
+        self.sms_receiver.add(index)
+
+    def _fetch_received_sms(self, index, reply_handler, error_handler):
         messages_obj = get_messages_obj(self.model.device)
-        sms = messages_obj.get_message(index)
+        messages_obj.get_message_async(index, reply_handler, error_handler)
+
+    def _on_sms_batch_received(self, smslist):
+        """Populates the inbox with C{smslist} and notifies the user once"""
+        contacts = self._get_contact_index()
+        treeview = self.view['inbox_treeview']
+        model = treeview.get_model()
+        store = self.get_unfiltered_model(treeview)
+        store.add_messages(smslist, contacts)
+
+        # scroll to the newest one once the treeview has caught up, the
+        # reference follows the row if others are inserted meanwhile
+        newest = max(smslist, key=lambda sms: sms.datetime)
+        _iter = store.get_message_iter(newest)
+        if _iter is not None and model is not store:
+            _iter = model.convert_child_iter_to_iter(_iter)
+        if _iter is not None:
+            ref = gtk.TreeRowReference(model, model.get_path(_iter))
+
+            def scroll():
+                if ref.valid() and treeview.get_model() is model:
+                    treeview.scroll_to_cell(ref.get_path())
+                return False
+
+            idle_add(scroll)
 
         # It will take care of looking up the number in the phonebook
         # to show the name if it's a known contact instead of its number
-        contact = self._find_contact_by_number(sms.number)
-        if contact:
-            who = contact.get_name()
-            contacts_list = [contact]
+        names = []
+        for sms in smslist:
+            who = contacts.get_name(sms.number) or sms.number
+            if who not in names:
+                names.append(who)
+
+        # Send a single notification for the whole burst
+        if len(smslist) == 1:
+            title = _("SMS received from %s") % names[0]
+            text = smslist[0].text
         else:
-            who = sms.number
-            contacts_list = None
-
-        # Populate treeview
-        treeview = self.view['inbox_treeview']
-        model = treeview.get_model()
-        model.add_message(sms, contacts_list)
+            title = _("%d SMS received") % len(smslist)
+            text = ", ".join(names[:SMS_NOTIFY_NAMES])
+            if len(names) > SMS_NOTIFY_NAMES:
+                text = _("%s and %d more") % (text,
+                                              len(names) - SMS_NOTIFY_NAMES)
+        self.tray.attach_notification(title, text, stock=gtk.STOCK_INFO)
 
-        # Get the path of the new message and scroll to it
-        paths = [str(i) for i, row in enumerate(model)
-                    if row[TV_SMS_OBJ] is sms]
-        if len(paths):
-            treeview.scroll_to_cell(paths[0])
+        if [sms for sms in smslist if is_sim_message(sms)]:
+            self._check_sim_occupancy()
 
-        # Send notification
-        title = _("SMS received from %s") % who
-        self.tray.attach_notification(title, sms.text, stock=gtk.STOCK_INFO)
+        if self.view['main_notebook'].get_current_page() == \
+                CONVERSATIONS_PAGE:
+            self._load_conversations()
 
     def on_is_pin_enabled_cb(self, enabled):
         self.view['change_pin1'].set_sensitive(enabled)
@@ -1068,33 +1184,19 @@ The csv file that you have tried to import has an invalid format.""")
             details = _("No mobile connection. Do you want to continue?")
             return show_warning_request_cancel_ok(message, details)
 
-    def _empty_treeviews(self, treeviews):
-        for treeview_name in treeviews:
-            model = self.view[treeview_name].get_model()
-            if model:
-                model.clear()
-
     def _hide_sim_contacts(self):
         """
         Called when the device holding the SIM is removed
         """
         treeview = self.view['contacts_treeview']
-        model = treeview.get_model()
-
-        iter = model.get_iter_first()
-        while iter:
-            obj = model.get_value(iter, TV_CNT_OBJ)
-            _iter = model.iter_next(iter)
-            if isinstance(obj, SIMContact):
-                model.remove(iter)
-            iter = _iter
+        treeview.get_model().remove_contacts_of_type(SIMContact)
 
     def _hide_sim_messages(self):
         """
         Called when the device holding the SIM is removed
         """
         treeview = self.view['inbox_treeview']
-        model = treeview.get_model()
+        model = self.get_unfiltered_model(treeview)
 
         iter = model.get_iter_first()
         while iter:
@@ -1129,59 +1231,311 @@ The csv file that you have tried to import has an invalid format.""")
         model = treeview.get_model()
         model.add_contacts(contacts)
 
-    def _fill_messages(self, messages):
+    def _reconcile_contacts(self, contacts, cclasses):
+        """Shows C{contacts} as the contacts of the C{cclasses} backends"""
+        treeview = self.view['contacts_treeview']
+        diff = treeview.get_model().get_diff(contacts, cclasses)
+        self._apply_diff(treeview, diff)
+
+    def _apply_diff(self, treeview, diff):
+        """
+        Applies the row C{diff} of the model of C{treeview}
+
+        Unless it's a few rows, C{treeview} is detached from its model
+        meanwhile, so it's laid out once rather than after every row.
+        The selected rows and the row at the top are kept.
+        """
+        added, removed, changed = diff
+        size = len(added) + len(removed) + len(changed)
+        if not size:
+            return
+
+        model = self.get_unfiltered_model(treeview)
+        if size < DETACH_THRESHOLD:
+            model.apply_diff(diff)
+            return
+
+        shown = treeview.get_model()
+
+        def get_key(path):
+            if shown is not model:
+                path = shown.convert_path_to_child_path(path)
+            return model.get_row_key(model.get_iter(path))
+
+        def get_path(key):
+            _iter = model.get_key_iter(key)
+            if _iter is None:
+                return None
+            path = model.get_path(_iter)
+            if shown is not model:
+                path = shown.convert_child_path_to_path(path)
+            return path
+
+        selection = treeview.get_selection()
+        selected = [get_key(path) for path in selection.get_selected_rows()[1]]
+        visible = treeview.get_visible_range()
+        top = visible and get_key(visible[0])
+
+        treeview.set_model(None)
+        model.apply_diff(diff)
+        treeview.set_model(shown)
+
+        for key in selected:
+            path = get_path(key)
+            if path is not None:
+                selection.select_path(path)
+        path = top and get_path(top)
+        if path is not None:
+            treeview.scroll_to_cell(path, None, True, 0.0, 0.0)
+
+    def _set_message_pagers(self, messages_obj, sim_messages):
         """
-        Fills the messages treeview with SIM & DB SMS
+        Sets up the SMS treeviews to be filled a page at a time
 
-        We're using the contacts list installed in the contacts treeview
-        because otherwise, adding dozens of SMS to the treeview would be very
-        inefficient, as we would have to lookup the sender number of every SMS
-        to find out whether is a known contact or not.
+        The rows loaded already are updated from the new pagers, only
+        the tab being shown is populated otherwise, the others will be
+        when they are first shown. See L{_load_sms_pages}
         """
-        contacts = self._get_treeview_contacts()
+        if self.pager_messages is not None:
+            self.pager_messages.close()
+        self.pager_messages = messages_obj
 
-        for sms in messages:
-            active_tv = TV_DICT[sms.where]         # get treeview name
-            treeview = self.view[active_tv]        # get treeview object
-            treeview.get_model().add_message(sms, contacts)  # append to tv
+        contacts = self._get_contact_index()
+        pagers = messages_obj.get_pagers(sim_messages)
+        for where, pager in pagers.iteritems():
+            treeview = self.view[TV_DICT[where]]
+            model = self.get_unfiltered_model(treeview)
+            self._apply_diff(treeview, model.get_pager_diff(pager, contacts))
+
+        page = self.view['main_notebook'].get_current_page() + 1
+        if page in pagers:
+            self._load_sms_pages(self.view[TV_DICT[page]])
+
+    def _load_sms_pages(self, treeview):
+        """Loads pages of messages until C{treeview} can scroll"""
+        model = self.get_unfiltered_model(treeview)
+        sort_id, order = model.get_sort_column_id()
+        if sort_id != TV_SMS_DATE or order != gtk.SORT_DESCENDING:
+            # pages come newest first, other orders need every message
+            model.load_all()
+            return
+
+        adjustment = treeview.get_vadjustment()
+        loaded = model.load_page()
+        if loaded and adjustment.upper <= adjustment.page_size:
+            # the treeview has not been resized yet, one more page won't
+            # hurt and it will be there when it is
+            model.load_page()
+
+    def _on_sms_treeview_scrolled(self, adjustment, treeview):
+        # load the next page when we are less than a screen from the end
+        if adjustment.value + 2 * adjustment.page_size >= adjustment.upper:
+            self._load_sms_pages(treeview)
+
+    def _on_sms_sort_changed(self, model, treeview):
+        if not model.is_loaded() and model.pager.started:
+            self._load_sms_pages(treeview)
 
     def update_message_contact_info(self):
         """
         Iterates through each SMS treeview, updating contact info
         """
 
-        contacts = self._get_treeview_contacts()
+        contacts = self._get_contact_index()
 
         for tv in ['inbox_treeview', 'drafts_treeview', 'sent_treeview']:
             treeview = self.view[tv]
-            treeview.get_model().update_contacts(contacts)
+            self.get_unfiltered_model(treeview).update_contacts(contacts)
+
+        model = self.view['conversations_treeview'].get_model()
+        if model.smanager is not None:
+            model.update_contacts(contacts)
+
+    def _load_conversations(self):
+        """Reloads the conversations, a page at a time as they are shown"""
+        treeview = self.view['conversations_treeview']
+        smanager = get_messages_obj(self.model.device).smanager
+        model = treeview.get_model()
+        model.load(smanager, self._get_contact_index())
+
+        adjustment = treeview.get_vadjustment()
+        if adjustment.upper <= adjustment.page_size:
+            model.load_page()
+
+    def _on_conversations_scrolled(self, adjustment):
+        # load the next page when we are less than a screen from the end
+        if adjustment.value + 2 * adjustment.page_size >= adjustment.upper:
+            self.view['conversations_treeview'].get_model().load_page()
+
+    def on_conversations_treeview_row_activated(self, treeview, path, col):
+        """Shows the messages of the activated conversation"""
+        conversation = treeview.get_model()[path][TV_CONV_OBJ]
+        self.view['main_notebook'].set_current_page(0)
+        # the search takes care of the messages not paged in yet
+        self.view['sms_search_entry'].set_text(conversation.number)
 
     def refresh_treeviews(self):
         """
         Fills the treeviews with SMS and contacts
+
+        The SIM contacts, the desktop contacts, the SIM messages and the
+        DB messages are fetched at once, every treeview being updated as
+        soon as its part is ready. See L{StageBarrier} for the timings.
+        The treeviews are not emptied, only the rows that changed are
+        updated, see L{_apply_diff}.
         """
+        device = self.model.device
+        phonebook = get_phonebook(device=device)
+        messages_obj = get_messages_obj(device)
+
+        def current(func):
+            # a newer refresh took over, ignore what this one gets
+            def wrapper(*args):
+                if barrier is self.refresh_barrier:
+                    func(*args)
+            return wrapper
+
+        barrier = StageBarrier('refresh_treeviews',
+                               current(self._on_refreshed))
+        self.refresh_barrier = barrier
+
+        def get_sim_contacts(reply_handler, error_handler):
+            # the SIM contacts snapshot belongs to an IMSI
+            self.model.get_imsi(lambda imsi:
+                phonebook.get_sim_contacts_async(reply_handler,
+                                                 error_handler, imsi))
+
+        def sim_contacts_cb(contacts):
+            self._reconcile_contacts(contacts, [SIMContact])
+
+        # the backends whose contacts are on their way
+        stale = set()
+
+        def desktop_contacts_cb(contacts):
+            self._reconcile_contacts(contacts,
+                    [cclass for cclass, mclass in supported_types
+                        if cclass is not SIMContact and cclass not in stale])
+
+        def contacts_stale_cb(cclass):
+            # a backend changed or has no snapshot, its contacts are on
+            # their way and those not read again will be removed once they
+            # all are
+            stale.add(cclass)
+            model = self.view['contacts_treeview'].get_model()
+            model.mark_stale(cclass)
+
+        def get_desktop_contacts(reply_handler, error_handler):
+            # mostly from the snapshots, the Evolution ones are read in
+            # the background and added as they arrive
+
+            def done_cb():
+                if barrier is self.refresh_barrier:
+                    treeview = self.view['contacts_treeview']
+                    diff = treeview.get_model().get_stale_diff()
+                    self._apply_diff(treeview, diff)
+                reply_handler()
+
+            phonebook.get_desktop_contacts_async(current(desktop_contacts_cb),
+                                        current(self._fill_contacts),
+                                        done_cb, current(contacts_stale_cb))
+
+        def get_db_messages(reply_handler, error_handler):
+            # DB messages are paged in from the DB as they are shown, the
+            # SIM ones are merged in when they arrive
+            self._set_message_pagers(messages_obj, [])
+            reply_handler()
+
+        barrier.add('SIM contacts', get_sim_contacts,
+                    current(sim_contacts_cb))
+        barrier.add('desktop contacts', get_desktop_contacts)
+        barrier.add('DB messages', get_db_messages)
+        barrier.add('SIM messages', messages_obj.get_sim_messages_async,
+                    current(self._update_sim_messages))
+        barrier.start()
+
+    def _update_sim_messages(self, sim_messages):
+        """Updates the SIM rows with the SIM messages read again"""
+        for name in ['inbox_treeview', 'drafts_treeview', 'sent_treeview']:
+            where = TV_DICT_REV[name]
+            treeview = self.view[name]
+            model = self.get_unfiltered_model(treeview)
+            self._apply_diff(treeview, model.get_sim_diff(
+                [sms for sms in sim_messages if sms.where == where]))
+
+    def _on_refreshed(self, timings):
+        self.refresh_barrier = None
+        # show the names of the contacts that arrived late
+        self.update_message_contact_info()
+        self._check_sim_occupancy()
+        if self.sms_search_keys is not None:
+            # bring the results back
+            self._search_messages()
+
+    def get_unfiltered_model(self, treeview):
+        """Returns the model of C{treeview}, the unfiltered one if searching"""
+        model = treeview.get_model()
+        if isinstance(model, gtk.TreeModelFilter):
+            return model.get_model()
+        return model
+
+    def on_sms_search_entry_changed(self, entry):
+        if self.sms_search_id is not None:
+            source_remove(self.sms_search_id)
+        self.sms_search_id = timeout_add(SMS_SEARCH_DELAY,
+                                         self._search_messages)
+
+    def _search_messages(self):
+        """Shows only the messages matching the text of the search entry"""
+        self.sms_search_id = None
+        query = self.view['sms_search_entry'].get_text().strip()
+        treeviews = [self.view[tv] for tv in
+                        ['inbox_treeview', 'drafts_treeview', 'sent_treeview']]
+
+        if not query:
+            self.sms_search_keys = None
+            for treeview in treeviews:
+                treeview.set_model(self.get_unfiltered_model(treeview))
+            return False
+
+        sim_messages = []
+        for treeview in treeviews:
+            model = self.get_unfiltered_model(treeview)
+            sim_messages.extend(model.get_sim_messages())
 
-        def messages_cb(contacts, messages):
-            # refresh display
-            self._empty_treeviews(list(set(TV_DICT.values())))
-            self._fill_contacts(contacts)
-            self._fill_messages(messages)
+        contacts = self._get_contact_index()
+        messages_obj = get_messages_obj(self.model.device)
+        found = messages_obj.search(query, contacts, sim_messages)
+        self.sms_search_keys = set([get_message_key(sms) for sms in found])
+
+        for treeview in treeviews:
+            model = self.get_unfiltered_model(treeview)
+            # the results that were not paged in yet
+            where = TV_DICT_REV[treeview.name]
+            model.add_search_results([sms for sms in found
+                                        if sms.where == where], contacts)
+
+            if treeview.get_model() is model:
+                results = model.filter_new()
+                results.set_visible_func(self._is_sms_search_result)
+                treeview.set_model(results)
+            else:
+                treeview.get_model().refilter()
 
-        def contacts_cb(contacts):
-            # get messages from all backends(inc SIM)
-            messages_obj = get_messages_obj(self.model.device)
-            messages_obj.get_messages_async(
-                            lambda messages: messages_cb(contacts, messages),
-                            logger.error)
+        return False
 
-        # get contacts from all backends(inc SIM)
-        phonebook = get_phonebook(device=self.model.device)
-        phonebook.get_contacts_async(contacts_cb, logger.error)
+    def _is_sms_search_result(self, model, _iter):
+        message = model.get_value(_iter, TV_SMS_OBJ)
+        return message is not None and \
+                get_message_key(message) in (self.sms_search_keys or ())
 
     def _get_treeview_contacts(self):
         treeview = self.view['contacts_treeview']
         return treeview.get_model().get_contacts()
 
+    def _get_contact_index(self):
+        treeview = self.view['contacts_treeview']
+        return treeview.get_model().index
+
     def update_usage_view(self):
         self.view.update_bars_user_limit()
 
@@ -1252,6 +1606,8 @@ The csv file that you have tried to import has an invalid format.""")
 
     def on_delete_menu_item_activate(self, widget):
         page = self.view['main_notebook'].get_current_page() + 1
+        if page not in TV_DICT:
+            return
         treeview = self.view[TV_DICT[page]]
         self.delete_entries(widget, None, treeview)
         treeview.grab_focus()
@@ -1280,6 +1636,12 @@ The csv file that you have tried to import has an invalid format.""")
         text = self._get_current_message_text(treeview)
         self.view.set_message_preview(text)
 
+        path = treeview.get_cursor()[0]
+        if path is not None and treeview.get_name() == 'inbox_treeview':
+            # it has been opened, its conversation has one unread less
+            sms = treeview.get_model()[path][TV_SMS_OBJ]
+            get_messages_obj(self.model.device).mark_read([sms])
+
     def on_main_notebook_switch_page(self, notebook, ptr, pagenum):
         """
         Callback for whenever GUI's main notebook is switched
@@ -1293,10 +1655,21 @@ The csv file that you have tried to import has an invalid format.""")
             self.view['contacts_toolbar'].show()
             self.view['sms_toolbar'].hide()
             self.view.set_message_preview(None)
+        elif page == CONVERSATIONS_PAGE:
+            self.view['contacts_toolbar'].hide()
+            self.view['sms_toolbar'].hide()
+            self.view.set_message_preview(None)
+            # the summaries are cheap to read, show them fresh
+            self._load_conversations()
         else:
             self.view['contacts_toolbar'].hide()
             self.view['sms_toolbar'].show()
-            text = self._get_current_message_text(self.view[TV_DICT[page + 1]])
+            treeview = self.view[TV_DICT[page + 1]]
+            pager = self.get_unfiltered_model(treeview).pager
+            if pager is not None and not pager.started:
+                # first time shown
+                self._load_sms_pages(treeview)
+            text = self._get_current_message_text(treeview)
             self.view.set_message_preview(text)
 
     #----------------------------------------------#
@@ -1326,7 +1699,7 @@ The csv file that you have tried to import has an invalid format.""")
         if number != model[path][TV_CNT_NUMBER] and is_valid_number(number):
             contact = model[path][TV_CNT_OBJ]
             if contact.set_number(unicode(number, 'utf8')):
-                model[path][TV_CNT_NUMBER] = number
+                model.set_contact_number(model.get_iter(path), number)
                 self.update_message_contact_info()
 
     def _setup_trayicon(self, ignoreconf=False):
@@ -1431,22 +1804,30 @@ The csv file that you have tried to import has an invalid format.""")
         else:
             manager = get_messages_obj(self.model.device)
 
-        manager.delete_objs(objs)
+        first = model.get_path(iters[0])[0]
+        store = self.get_unfiltered_model(treeview)
+        if store is not model:
+            # searching, the rows are removed from the model being filtered
+            iters = [model.convert_iter_to_child_iter(_iter)
+                        for _iter in iters]
 
-        # XXX: when multiple but mixed writable / readonly are in the
-        # selection for delete invalidate the selection after delete or
-        # the selection is wrong
-        _inxt = None
+        # detach the model, otherwise the treeview is updated once per row
+        treeview.set_model(None)
         for _iter in iters:
-            _inxt = model.iter_next(_iter)
-            model.remove(_iter)  # delete from treeview
-        if _inxt:
-            treeview.get_selection().select_iter(_inxt)  # select next item
-        else:
-            n_rows = len(model)                          # select last item
-            if n_rows:
-                _inxt = model[n_rows - 1].iter
-                treeview.get_selection().select_iter(_inxt)
+            store.remove(_iter)  # delete from treeview
+        treeview.set_model(model)
+
+        # the row after the deleted ones takes the place of the first one
+        n_rows = model.iter_n_children(None)
+        if n_rows:
+            path = (min(first, n_rows - 1),)
+            treeview.get_selection().select_path(path)
+            treeview.scroll_to_cell(path)
+
+        # the rows are gone already, the entries that can't be deleted
+        # are put back afterwards
+        manager.delete_objs(objs,
+                    lambda results: self._delete_entries_cb(treeview, results))
 
         # If we are in a sms treeview update displayed text
         if treeview.get_name() != 'contacts_treeview':
@@ -1459,6 +1840,23 @@ The csv file that you have tried to import has an invalid format.""")
         else:
             self.update_message_contact_info()
 
+    def _delete_entries_cb(self, treeview, results):
+        """Puts back the entries that could not be deleted"""
+        failed = [obj for obj, error in results if error is not None]
+        if not failed:
+            return
+
+        model = self.get_unfiltered_model(treeview)
+        if treeview.name == 'contacts_treeview':
+            model.add_contacts(failed)
+            self.update_message_contact_info()
+        else:
+            model.add_messages(failed, self._get_contact_index())
+
+        show_warning_dialog(_("Some entries could not be deleted"),
+                            _("%d of %d entries could not be deleted")
+                            % (len(failed), len(results)))
+
     def _send_sms_to_contact(self, menuitem, treeview):
         selection = treeview.get_selection()
         model, selected = selection.get_selected_rows()
@@ -1496,8 +1894,7 @@ The csv file that you have tried to import has an invalid format.""")
         menu.append(item)
 
         if treeview.get_name() == 'inbox_treeview':
-            msg = self.get_obj_from_selected_row()
-            if msg and is_sim_message(msg):
+            if self._get_selected_sim_messages(treeview):
                 item = gtk.ImageMenuItem(_("Migrate to DB"))
                 img = gtk.image_new_from_stock(gtk.STOCK_CONVERT,
                                                gtk.ICON_SIZE_MENU)
@@ -1527,24 +1924,57 @@ The csv file that you have tried to import has an invalid format.""")
 
         return menu
 
+    def _get_selected_sim_messages(self, treeview):
+        model, selected = treeview.get_selection().get_selected_rows()
+        messages = [model[path][TV_SMS_OBJ] for path in selected]
+        return [sms for sms in messages if is_sim_message(sms)]
+
     def _migrate_sms_to_db(self, widget):
-        """This will save the selected SMS to the drafts tv and the DB"""
-        # XXX: this needs reworking to allow multiple selections
-        row = self.get_model_iter_obj_from_selected_row()
-        if row:
-            model, _iter, old = row
-            if is_sim_message(old):
-                message_mgr = get_messages_obj(self.model.device)
+        """Moves the selected SIM messages to the DB"""
+        treeview = self.view['inbox_treeview']
+        self._migrate_sim_messages(self._get_selected_sim_messages(treeview))
 
-                # Save SMS to DB
-                where = TV_DICT_REV['inbox_treeview']
-                new = message_mgr.add_message(old, where=where)
+    def _migrate_sim_messages(self, smslist):
+        if not smslist or self.sim_migration is not None:
+            return
 
-                # Remove SMS from the SIM
-                message_mgr.delete_objs([old])
+        def progress_cb(old, new, processed, total):
+            if new is not None:
+                treeview = self.view[TV_DICT[old.where]]
+                model = self.get_unfiltered_model(treeview)
+                model.replace_message(old, new, self._get_contact_index())
+            self.view.set_sms_migration_progress(processed, total)
+
+        def done_cb(migrated):
+            self.sim_migration = None
+            self.view.set_sms_migration_progress(None)
+            logger.info("%d of %d SIM messages moved to the DB"
+                        % (len(migrated), len(smslist)))
+
+        self.sim_migration = SIMMigration(get_messages_obj(self.model.device),
+                                          smslist, progress_cb, done_cb)
+        self.view.set_sms_migration_progress(0, len(smslist))
+        self.sim_migration.start()
+
+    def _check_sim_occupancy(self):
+        """Moves the SIM messages to the DB if the SIM is getting full"""
+        if not config.get('preferences', 'sms_auto_offload',
+                          CFG_PREFS_DEFAULT_SMS_AUTO_OFFLOAD):
+            return
 
-                # Update the treeview
-                model.update_message(_iter, new, self._get_treeview_contacts())
+        smslist = []
+        for tv in ['inbox_treeview', 'drafts_treeview', 'sent_treeview']:
+            model = self.get_unfiltered_model(self.view[tv])
+            smslist.extend(model.get_sim_messages())
+
+        capacity = config.get('preferences', 'sim_sms_capacity',
+                              CFG_PREFS_DEFAULT_SIM_SMS_CAPACITY)
+        threshold = config.get('preferences', 'sim_sms_threshold',
+                               CFG_PREFS_DEFAULT_SIM_SMS_THRESHOLD)
+        if len(smslist) >= capacity * threshold:
+            logger.info("SIM holds %d messages, moving them to the DB"
+                        % len(smslist))
+            self._migrate_sim_messages(smslist)
 
     def _save_sms_to_draft(self, widget):
         """This will save the selected SMS to the drafts tv and the DB"""
@@ -1557,7 +1987,7 @@ The csv file that you have tried to import has an invalid format.""")
             new = message_mgr.add_message(old, where=where)
             # Add to the view
             tv = self.view['drafts_treeview']
-            tv.get_model().add_message(new)
+            self.get_unfiltered_model(tv).add_message(new)
 
     def _add_new_contact_cb(self, contact):
         if contact is None:
@@ -1591,6 +2021,8 @@ The csv file that you have tried to import has an invalid format.""")
     def get_model_iter_obj_from_selected_row(self):
         """Returns the model, iter and object from the selected row"""
         page = self.view['main_notebook'].get_current_page() + 1
+        if page not in TV_DICT:
+            return None
 
         treeview = self.view[TV_DICT[page]]
         selection = treeview.get_selection()
@@ -1605,4 +2037,9 @@ The csv file that you have tried to import has an invalid format.""")
             obj = model.get_value(_iter, TV_CNT_OBJ)
         else:
             obj = model.get_value(_iter, TV_SMS_OBJ)
+
+        if isinstance(model, gtk.TreeModelFilter):
+            # searching, return the row of the underlying model
+            _iter = model.convert_iter_to_child_iter(_iter)
+            model = model.get_model()
         return model, _iter, obj
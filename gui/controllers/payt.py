@@ -39,7 +39,8 @@ class PayAsYouTalkController(Controller):
     """Controller for the pay as you talk window"""
 
     def __init__(self, model):
-        super(PayAsYouTalkController, self).__init__(model, spurious=True)
+        super(PayAsYouTalkController, self).__init__(model, spurious=True,
+                                                     weak=True)
 
         self.tz = None
         try:
@@ -22,8 +22,6 @@ import gtk
 #from gtkmvc import Controller
 from gui.contrib.gtkmvc import Controller
 
-from wader.common.provider import NetworkProvider
-
 from gui.consts import (CFG_PREFS_DEFAULT_BROWSER,
                               CFG_PREFS_DEFAULT_EMAIL,
                               CFG_SMS_VALIDITY_R1W, CFG_SMS_VALIDITY_R1D,
@@ -32,6 +30,7 @@ from gui.consts import (CFG_PREFS_DEFAULT_BROWSER,
 from gui.translate import _
 from gui.dialogs import show_warning_dialog
 from gui.tray import tray_available
+from gui.smsc import smsc_cache
 
 VALIDITY_DICT = {
      _('Maximum time').encode('utf8'): CFG_SMS_VALIDITY_MAX,
@@ -65,18 +64,8 @@ class PreferencesController(Controller):
         self.setup_signals()
 
     def get_default_smsc(self, imsi):
-        try:
-            # create a NetworkProvider object to query our Network DB
-            provider = NetworkProvider()
-            # ask for our network attributes based on what our SIM is
-            nets = provider.get_network_by_id(imsi)
-            if not len(nets):
-                raise ValueError
-            return nets[0].smsc
-        except (TypeError, ValueError):
-            return None
-        finally:
-            provider.close()
+        # the networks DB is only queried once per SIM
+        return smsc_cache.get_network_smsc(imsi)
 
     def setup_sms_tab(self):
         # Setup the sms preferences to reflect what's in our model on startup
@@ -16,7 +16,6 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from wader.common.provider import NetworkProvider
 from wader.common.utils import convert_int_to_ip, convert_ip_to_int
 from wader.common.keyring import KeyringNoMatchError
 
@@ -24,6 +23,7 @@ from gui.constx import BAND_MAP_REV, MODE_MAP_REV, AUTH_MAP_REV
 from gui.controllers import Controller
 from gui.dialogs import show_error_dialog
 from gui.logger import logger
+from gui.providers import pool, NetworkProvider
 from gui.utils import get_error_msg
 from gui.translate import _
 
@@ -164,9 +164,8 @@ class APNSelectionController(Controller):
 
         self.callback = callback
 
-        netdb = NetworkProvider()
+        netdb = pool.get(NetworkProvider)
         self.apns = netdb.get_network_by_id(imsi)
-        netdb.close()
 
     def register_view(self, view):
         super(APNSelectionController, self).register_view(view)
@@ -18,28 +18,27 @@
 """Controllers for the sms dialogs"""
 
 from datetime import datetime
+import sqlite3
+
 from dateutil.tz import gettz
 
 #from gtkmvc import Controller, Model
 from gui.contrib.gtkmvc import Controller, Model
 
-from messaging.sms import SmsSubmit, is_gsm_text
-from messaging.sms.consts import (SEVENBIT_SIZE, UCS2_SIZE,
-                                 SEVENBIT_MP_SIZE, UCS2_MP_SIZE)
+from messaging.sms.consts import SEVENBIT_SIZE
 
-from wader.common.consts import SMS_INTFACE
-from wader.common.provider import NetworkProvider
 from wader.common.sms import Message
 
 from gui import dialogs
 from gui.translate import _
 from gui.logger import logger
 from gui.messages import get_messages_obj
+from gui.segments import SegmentCounter
+from gui.smsc import smsc_cache
 from gui.utils import get_error_msg
 from gui.consts import (APP_LONG_NAME, CFG_PREFS_DEFAULT_SMS_VALIDITY,
                         CFG_SMS_VALIDITY_R1D, CFG_SMS_VALIDITY_R3D,
-                        CFG_SMS_VALIDITY_R1W, CFG_SMS_VALIDITY_MAX,
-                        TV_SMS_OBJ)
+                        CFG_SMS_VALIDITY_R1W, CFG_SMS_VALIDITY_MAX)
 from gui.constx import TV_DICT, TV_DICT_REV
 
 from gui.views.contacts import ContactsListView
@@ -58,13 +57,15 @@ class NewSmsController(Controller):
     """Controller for the new sms dialog"""
 
     def __init__(self, model, parent_ctrl=None, contacts=None):
-        super(NewSmsController, self).__init__(model)
+        super(NewSmsController, self).__init__(model, weak=True)
         self.state = IDLE
         self.parent_ctrl = parent_ctrl
         self.max_length = SEVENBIT_SIZE
         self.numbers_entry = ValidatedEntry(v_phone)
         self.sms = None
         self.contacts = contacts
+        # kept up to date with every edit of the text
+        self.counter = SegmentCounter(get_text=self.get_message_text)
 
         try:
             self.numbers_entry.set_tooltip_text(SMS_TOOLTIP)
@@ -85,6 +86,10 @@ class NewSmsController(Controller):
         self.view.get_top_widget().set_title(msg)
         # signals stuff
         textbuffer = self.view['sms_edit_text_view'].get_buffer()
+        # these run before the buffer changes, so the deleted text is
+        # still there to be counted
+        textbuffer.connect('insert-text', self._textbuffer_insert_text)
+        textbuffer.connect('delete-range', self._textbuffer_delete_range)
         textbuffer.connect('changed', self._textbuffer_changed)
         # show up
         self.numbers_entry.grab_focus()
@@ -116,28 +121,6 @@ class NewSmsController(Controller):
                 self.view.set_idle_view()
                 return
 
-        def on_sms_sent_cb(msg, ref):
-            if len(ref):
-                msg.status_reference = ref[0] # for delivery report
-
-            where = TV_DICT_REV['sent_treeview']
-            self.save_messages_to_db([msg], where)
-
-            # if original message is a draft, remove it
-            if self.sms:
-                self.delete_messages_from_db_and_tv([self.sms])
-                self.sms = None
-
-            # hide ourselves if we are not sending more SMS...
-            if self.state == IDLE:
-                if self.view:
-                    self.view.set_idle_view()
-                self.on_delete_event_cb(None)
-
-        def on_sms_sent_eb(error):
-            title = _('Error while sending SMS')
-            dialogs.show_error_dialog(title, get_error_msg(error))
-
         def _get_sms_confirmation():
             return self.model.conf.get('preferences',
                                        'sms_confirmation', False)
@@ -168,17 +151,26 @@ class NewSmsController(Controller):
             status_request = _get_sms_confirmation()
             msgvp = _get_sms_validity_period()
 
-            numbers = self.get_numbers_list()
-            for number in numbers:
-                msg = Message(number, text, _datetime=datetime.now(self.tz))
-                self.model.device.Send(dict(number=number, text=text,
-                                            status_request=status_request,
-                                            smsc=smsc, msgvp=msgvp),
-                    dbus_interface=SMS_INTFACE,
-                    reply_handler=lambda ref: on_sms_sent_cb(msg, ref),
-                    error_handler=on_sms_sent_eb)
+            # the main window sends them, a few at a time and retrying
+            # them if needed, and saves them to the sent folder
+            try:
+                self.parent_ctrl.send_queue.enqueue(self.get_numbers_list(),
+                                    text, smsc, msgvp, status_request)
+            except sqlite3.Error, e:
+                self.state = IDLE
+                self.view.set_idle_view()
+                title = _('Error while sending SMS')
+                dialogs.show_error_dialog(title, get_error_msg(e))
+                return
+
+            # they are safe in the queue, the draft is not needed anymore
+            if self.sms:
+                self.delete_messages_from_db_and_tv([self.sms])
+                self.sms = None
 
             self.state = IDLE
+            self.view.set_idle_view()
+            self.on_delete_event_cb(None)
 
         def smsc_eb(*arg):
             title = _('No SMSC number')
@@ -194,38 +186,9 @@ class NewSmsController(Controller):
 
     def get_smsc(self, cb, eb):
         """Get SMSC from preferences, networks DB or device, then callback"""
-
-        # try to get from preferences
-        if self.model.conf.get('preferences', 'use_alternate_smsc', False):
-            alternate_smsc = self.model.conf.get('preferences',
-                                                 'smsc_number', None)
-        else:
-            alternate_smsc = None
-
-        # try to get from networks DB
-        if self.model.imsi:
-            provider = NetworkProvider()
-            attrs = provider.get_network_by_id(self.model.imsi)
-            if attrs:
-                provider_smsc = attrs[0].smsc
-            else:
-                provider_smsc = None
-            provider.close()
-        else:
-            provider_smsc = None
-
-        # use the one from the best source
-        if alternate_smsc is not None:
-            logger.info("SMSC used from preferences")
-            cb(alternate_smsc)
-        elif provider_smsc is not None:
-            logger.info("SMSC used from networks DB")
-            cb(provider_smsc)
-        else:
-            logger.info("SMSC used from SIM")
-            self.model.device.GetSmsc(dbus_interface=SMS_INTFACE,
-                                      reply_handler=cb,
-                                      error_handler=eb)
+        # it's only looked up for the first message sent with this SIM
+        smsc_cache.resolve(self.model.conf, self.model.imsi,
+                           self.model.device, cb, eb)
 
     def on_save_button_clicked(self, widget):
         """This will save the selected SMS to the drafts tv and the DB"""
@@ -251,26 +214,27 @@ class NewSmsController(Controller):
         view = ContactsListView(ctrl)
         view.run()
 
+    def _textbuffer_insert_text(self, textbuffer, _iter, text, length):
+        self.counter.insert(text)
+
+    def _textbuffer_delete_range(self, textbuffer, start, end):
+        self.counter.delete(textbuffer.get_text(start, end))
+
     def _textbuffer_changed(self, textbuffer):
         """Handler for the textbuffer changed signal"""
-        text = textbuffer.get_text(textbuffer.get_start_iter(),
-                                   textbuffer.get_end_iter())
-        if not len(text):
+        counter = self.counter
+        if not counter.units:
             msg = _('Text message: 0/%d chars') % SEVENBIT_SIZE
+        elif counter.get_parts() == 1:
+            args = dict(num=counter.get_length(),
+                        total=counter.get_part_size())
+            msg = _('Text message: %(num)d/%(total)d chars') % args
         else:
-            # get the number of messages
-            # we use a default number for encoding purposes
-            num_sms = len(SmsSubmit('+342453435', text).to_pdu())
-            if num_sms == 1:
-                max_length = SEVENBIT_SIZE if is_gsm_text(text) else UCS2_SIZE
-                args = dict(num=len(text), total=max_length)
-                msg = _('Text message: %(num)d/%(total)d chars') % args
-            else:
-                max_length = SEVENBIT_MP_SIZE if is_gsm_text(text) else UCS2_MP_SIZE
-                used = len(text) - (max_length * (num_sms - 1))
-                args = dict(num=used, total=max_length, msgs=num_sms)
-                msg = _('Text message: '
-                        '%(num)d/%(total)d chars (%(msgs)d SMS)') % args
+            args = dict(num=counter.get_last_part_length(),
+                        total=counter.get_part_size(),
+                        msgs=counter.get_parts())
+            msg = _('Text message: '
+                    '%(num)d/%(total)d chars (%(msgs)d SMS)') % args
 
         self.view.get_top_widget().set_title(msg)
 
@@ -301,18 +265,18 @@ class NewSmsController(Controller):
             dblist[0].status_reference = smslist[0].status_reference
 
         tv_name = TV_DICT[where]
-        model = self.parent_ctrl.view[tv_name].get_model()
-        model.add_messages(dblist)
+        treeview = self.parent_ctrl.view[tv_name]
+        self.parent_ctrl.get_unfiltered_model(treeview).add_messages(dblist)
 
     def delete_messages_from_db_and_tv(self, smslist):
         messages = get_messages_obj(self.parent_ctrl.model.get_device())
         messages.delete_messages(smslist)
-        model = self.parent_ctrl.view['drafts_treeview'].get_model()
-        iter = model.get_iter_first()
-        while iter:
-            if model.get_value(iter, TV_SMS_OBJ) in smslist:
-                model.remove(iter)
-            iter = model.iter_next(iter)
+        treeview = self.parent_ctrl.view['drafts_treeview']
+        model = self.parent_ctrl.get_unfiltered_model(treeview)
+        for sms in smslist:
+            _iter = model.get_message_iter(sms)
+            if _iter is not None:
+                model.remove(_iter)
 
 
 class ForwardSmsController(NewSmsController):
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+incoming gathers the messages received in a burst
+"""
+
+from gobject import timeout_add, source_remove
+
+from gui.logger import logger
+from gui.pipeline import CallPipeline, MAX_PENDING
+
+# milliseconds to wait for more messages once one is received
+BATCH_DELAY = 300
+
+
+class IncomingBatcher(object):
+    """
+    I fetch the messages received in a burst together
+
+    When the modem registers again it may hand over dozens of queued
+    messages at once. I collect the indexes received within C{delay}
+    milliseconds of the first one, fetch them with C{max_pending} calls
+    in flight, and call C{batch_cb(messages)} once with all of them.
+    C{fetch(index, reply_handler, error_handler)} reads a message.
+    Indexes received while a batch is being fetched go in the next one.
+    L{cancel} drops the pending indexes and the batch in flight, whose
+    answers are ignored.
+    """
+
+    def __init__(self, fetch, batch_cb, delay=BATCH_DELAY,
+                 max_pending=MAX_PENDING):
+        super(IncomingBatcher, self).__init__()
+        self.fetch = fetch
+        self.batch_cb = batch_cb
+        self.delay = delay
+        self.max_pending = max_pending
+        # indexes waiting for the next batch
+        self.indexes = []
+        self.timeout_id = None
+        # messages of the batch being fetched
+        self.fetched = None
+
+    def add(self, index):
+        if index not in self.indexes:
+            self.indexes.append(index)
+        self._schedule()
+
+    def cancel(self):
+        if self.timeout_id is not None:
+            source_remove(self.timeout_id)
+            self.timeout_id = None
+        self.indexes = []
+        # the batch in flight is no longer ours, see _done
+        self.fetched = None
+
+    def _schedule(self):
+        if self.timeout_id is None and self.fetched is None and self.indexes:
+            self.timeout_id = timeout_add(self.delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self.timeout_id = None
+        indexes, self.indexes = self.indexes, []
+        batch = self.fetched = []
+
+        def fetch(index, reply_handler, error_handler):
+
+            def fetched(sms):
+                batch.append(sms)
+                reply_handler()
+
+            self.fetch(index, fetched, error_handler)
+
+        pipeline = CallPipeline(fetch,
+                                done_cb=lambda results:
+                                    self._done(batch, results),
+                                max_pending=self.max_pending)
+        pipeline.start(indexes)
+        return False
+
+    def _done(self, batch, results):
+        if batch is not self.fetched:
+            # cancelled while it was being fetched
+            return
+
+        for index, error in results:
+            if error is not None:
+                logger.error("Error reading received SMS %d: %s"
+                             % (index, error))
+
+        self.fetched = None
+        if batch:
+            self.batch_cb(batch)
+        self._schedule()
@@ -19,7 +19,11 @@
 messages presents a uniform layer to deal with messages from both SIM and DB
 """
 
+from calendar import timegm
+from datetime import datetime
 from os.path import exists
+import re
+import sqlite3
 
 from dateutil.tz import gettz
 
@@ -27,15 +31,227 @@ from wader.common.encoding import unpack_dbus_safe_string
 from wader.common.consts import SMS_INTFACE
 from wader.common.sms import Message as SMMessage
 from wader.common.provider import Message as DBMessage
-from wader.common.provider import (SmsProvider,
-                                   inbox_folder, outbox_folder, drafts_folder)
+from wader.common.provider import (inbox_folder, outbox_folder,
+                                   drafts_folder)
 
 from gui.consts import MESSAGES_DB
+from gui.contacts.index import SEPARATORS, DIALABLE
 from gui.logger import logger
+from gui.pipeline import CallPipeline, MAX_PENDING
+from gui.providers import pool, Connection, SmsProvider
 from gui.translate import _
 
 KNOWN_FOLDERS = [inbox_folder, drafts_folder, outbox_folder]
 
+# folder name -> SMS tab
+FOLDER_TABS = dict([(folder.name, i + 1)
+                    for i, folder in enumerate(KNOWN_FOLDERS)])
+
+# number of messages loaded at once in the SMS treeviews
+PAGE_SIZE = 200
+
+MESSAGES_QUERY = """
+select message.id, message.date, message.number, message.text,
+       message.flags, folder.name, delivery.reference, delivery.status
+from message
+    join thread on message.thread_id = thread.id
+    join folder on thread.folder_id = folder.id
+    left join delivery on delivery.message_id = message.id
+%s
+order by message.date desc, message.id desc
+"""
+
+MESSAGES_INDEXES = """
+create index if not exists message_date_idx on message(date, id);
+create index if not exists message_thread_date_idx on message(thread_id, date);
+create index if not exists thread_folder_idx on thread(folder_id);
+create index if not exists thread_number_idx on thread(number, folder_id);
+create index if not exists message_number_date_idx
+    on message(number, date, id);
+"""
+
+# delivery state of a sent message
+DELIVERY_NONE, DELIVERY_PENDING, DELIVERY_DELIVERED = range(3)
+
+# the status reference of the sent messages that asked for a delivery
+# report, receipts only carry the reference. References wrap around
+# after 255, a receipt is for the newest message pending with it
+DELIVERY_SCHEMA = """
+create table if not exists delivery (
+    message_id integer primary key,
+    reference integer not null,
+    status integer not null
+);
+create index if not exists delivery_reference_idx
+    on delivery(reference, status);
+create trigger if not exists delivery_message_delete
+after delete on message
+begin
+    delete from delivery where message_id = old.id;
+end;
+"""
+
+# the inbox messages that have been opened, wader keeps no such flag
+READ_SCHEMA = """
+create table message_read (
+    message_id integer primary key
+);
+insert into message_read(message_id) select id from message;
+"""
+
+# one row per thread of the provider, so the conversations can be listed
+# without reading every message. Like the full-text index, SQLite keeps
+# it up to date as messages are added, deleted or read. The summaries of
+# older versions were per number, they are made again
+CONVERSATION_SCHEMA = """
+drop trigger if exists conversation_insert;
+drop trigger if exists conversation_delete;
+drop table if exists conversation;
+create table conversation (
+    thread_id integer primary key,
+    number text not null,
+    last_message_id integer,
+    date integer not null,
+    total integer not null,
+    unread integer not null
+);
+create index conversation_date_idx on conversation(date, thread_id);
+"""
+
+CONVERSATION_FILL = """
+insert into conversation(thread_id, number, last_message_id, date, total,
+                         unread)
+    select m.thread_id, coalesce(t.number, max(m.number)),
+           (select id from message where thread_id = m.thread_id
+                order by date desc, id desc limit 1),
+           max(m.date), count(*),
+           sum(f.name = '%(inbox)s' and r.message_id is null)
+    from message m
+        left join thread t on t.id = m.thread_id
+        left join folder f on f.id = t.folder_id
+        left join message_read r on r.message_id = m.id
+    group by m.thread_id;
+""" % dict(inbox=inbox_folder.name)
+
+# the message is unread if it is in the inbox and it hasn't been opened
+IS_UNREAD = """(select count(*) from thread
+                    join folder on folder.id = thread.folder_id
+                where thread.id = %(message)s.thread_id
+                    and folder.name = '%(inbox)s'
+                    and not exists (select 1 from message_read
+                                    where message_id = %(message)s.id))"""
+
+CONVERSATION_TRIGGERS = """
+create trigger if not exists conversation_insert
+after insert on message
+begin
+    insert or ignore into conversation(thread_id, number, last_message_id,
+                                       date, total, unread)
+        values (new.thread_id, new.number, new.id, new.date, 0, 0);
+    update conversation set
+        total = total + 1,
+        unread = unread + %(new_unread)s,
+        last_message_id = case when new.date >= date
+                               then new.id else last_message_id end,
+        date = max(date, new.date)
+    where thread_id = new.thread_id;
+end;
+create trigger if not exists conversation_delete
+after delete on message
+begin
+    update conversation set
+        total = total - 1,
+        unread = unread - %(old_unread)s
+    where thread_id = old.thread_id;
+    delete from message_read where message_id = old.id;
+    delete from conversation where thread_id = old.thread_id and total <= 0;
+    update conversation set
+        last_message_id = (select id from message
+                               where thread_id = old.thread_id
+                               order by date desc, id desc limit 1),
+        date = (select max(date) from message
+                    where thread_id = old.thread_id)
+    where thread_id = old.thread_id and last_message_id = old.id;
+end;
+create trigger if not exists conversation_read
+after insert on message_read
+begin
+    update conversation set unread = unread - 1
+    where thread_id = (select message.thread_id from message
+                           join thread on thread.id = message.thread_id
+                           join folder on folder.id = thread.folder_id
+                       where message.id = new.message_id
+                           and folder.name = '%(inbox)s');
+end;
+""" % dict(inbox=inbox_folder.name,
+           new_unread=IS_UNREAD % dict(message='new',
+                                       inbox=inbox_folder.name),
+           old_unread=IS_UNREAD % dict(message='old',
+                                       inbox=inbox_folder.name))
+
+CONVERSATIONS_QUERY = """
+select conversation.thread_id, conversation.number, conversation.date,
+       conversation.total, conversation.unread, message.id, message.text
+from conversation
+    left join message on message.id = conversation.last_message_id
+%s
+order by conversation.date desc, conversation.thread_id desc
+limit ?
+"""
+
+# most DB messages returned by a search, the newest ones
+SEARCH_LIMIT = 1000
+
+# the full-text index is kept in sync with the message table by SQLite
+# itself, so it doesn't matter who adds, migrates or deletes a message
+SEARCH_FILL = """
+insert into message_search(docid, text, number)
+    select id, text, number from message
+"""
+
+SEARCH_TRIGGERS = """
+create trigger if not exists message_search_insert
+after insert on message
+begin
+    insert into message_search(docid, text, number)
+        values (new.id, new.text, new.number);
+end;
+create trigger if not exists message_search_delete
+after delete on message
+begin
+    delete from message_search where docid = old.id;
+end;
+create trigger if not exists message_search_update
+after update of text, number on message
+begin
+    update message_search set text = new.text, number = new.number
+        where docid = old.id;
+end;
+"""
+
+SEARCH_WORD = re.compile(r'\w+', re.UNICODE)
+
+# messages waiting to be sent, they are kept until the device accepts
+# them so they survive restarts, see L{gui.sendqueue.SendQueue}. Once
+# sent, sent_date is set until the message is in the sent folder, once
+# given up on, failed is set until it is back in the drafts folder
+SEND_QUEUE_SCHEMA = """
+create table if not exists send_queue (
+    id integer primary key autoincrement,
+    date integer not null,
+    number text not null,
+    text text not null,
+    smsc text,
+    msgvp integer,
+    status_request integer not null default 0,
+    attempts integer not null default 0,
+    next_attempt real not null default 0,
+    sent_date integer,
+    reference integer,
+    failed integer not null default 0
+);
+"""
+
 WAP_REPLACEMENT = _('WAP Push (Binary content)')
 
 
@@ -44,13 +260,122 @@ def is_sim_message(sms):
     return not isinstance(sms, DBMessage)
 
 
+def get_message_key(sms):
+    """Returns a key that tells C{sms} apart from every other message"""
+    return is_sim_message(sms), sms.index
+
+
+def _get_fts_query(query):
+    # every word is a prefix, so results show up while it is being typed
+    words = SEARCH_WORD.findall(query)
+    return ' '.join(['%s*' % word for word in words]) or None
+
+
+def _get_number_digits(query):
+    # the significant digits of a number being searched for, so the
+    # national '600 111 222' finds '+34600111222' too
+    cleaned = SEPARATORS.sub('', query)
+    if not DIALABLE.match(cleaned):
+        return None
+    return cleaned.lstrip('+').lstrip('0') or None
+
+
+def _get_like_pattern(query):
+    for c in '\\%_':
+        query = query.replace(c, '\\' + c)
+    return '%' + query + '%'
+
+
+def get_epoch(dt):
+    """Returns C{dt} as seconds since the epoch, 0 if None"""
+    # naive datetimes are considered to be UTC
+    return timegm(dt.utctimetuple()) if dt else 0
+
+
+class QueuedSMS(object):
+    """
+    I am a message waiting in the send queue
+    """
+
+    def __init__(self, number, text, smsc=None, msgvp=None,
+                 status_request=False, index=None, date=0, attempts=0,
+                 next_attempt=0):
+        super(QueuedSMS, self).__init__()
+        self.number = number
+        self.text = text
+        self.smsc = smsc
+        self.msgvp = msgvp
+        self.status_request = status_request
+        self.index = index
+        # epoch when it was queued
+        self.date = date
+        self.attempts = attempts
+        # epoch before which it must not be sent again
+        self.next_attempt = next_attempt
+
+    def __repr__(self):
+        return '<QueuedSMS %r to %s>' % (self.index, self.number)
+
+    def get_params(self):
+        """Returns the dict the device's Send method expects"""
+        params = dict(number=self.number, text=self.text,
+                      status_request=self.status_request)
+        if self.smsc:
+            params['smsc'] = self.smsc
+        if self.msgvp is not None:
+            params['msgvp'] = self.msgvp
+        return params
+
+
+class Conversation(object):
+    """
+    I summarize the messages of a thread, those exchanged with a number
+    """
+
+    def __init__(self, thread, number, date, total, unread=0, index=None,
+                 text=None):
+        super(Conversation, self).__init__()
+        # the thread's id
+        self.thread = thread
+        self.number = number
+        # epoch of the last message
+        self.date = date
+        self.total = total
+        # inbox messages not opened yet
+        self.unread = unread
+        # the last message
+        self.index = index
+        self.text = text or ''
+
+
 class DBSMSManager(object):
     """
     SMS manager for DB stored messages
+
+    The folder, thread and message tables belong to wader's
+    L{SmsProvider}, messages are only added and deleted through it. The
+    tables of our own (the send queue, delivery reports, full-text index
+    and conversations) live in the same DB but are written through a
+    connection of my own, see L{_begin}. The index and the conversations
+    are kept by triggers, so they change along with the provider's
+    writes. Nothing else spans both: a write through the provider and
+    one of ours are ordered so that a crash in between can be recovered,
+    like L{complete_queued_message} does.
     """
 
     def __init__(self, path=MESSAGES_DB):
         super(DBSMSManager, self).__init__()
+        self.path = path
+        # our own connection, set up on first use
+        self.conn = None
+        # the messages read are dated in local time
+        self.tz = None
+        try:
+            self.tz = gettz()
+        except:
+            pass
+        # whether the full-text index is available
+        self.fts = False
 
         if not exists(path):
             self.provider = SmsProvider(path)
@@ -60,8 +385,31 @@ class DBSMSManager(object):
             self.provider = SmsProvider(path)
 
     def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
         self.provider.close()
 
+    def _begin(self):
+        """
+        Starts a transaction on our connection
+
+        It must end with L{_commit} or L{_rollback}, and the provider must
+        not be written meanwhile: it has a connection of its own, which
+        would wait for ours to end.
+        """
+        self._get_conn().execute("begin")
+
+    def _commit(self):
+        self.conn.execute("commit")
+
+    def _rollback(self):
+        try:
+            self.conn.execute("rollback")
+        except sqlite3.Error:
+            # SQLite rolled it back already
+            pass
+
     def add_message(self, sms, where=None):
         if not where:
             folder = KNOWN_FOLDERS[0]
@@ -75,21 +423,528 @@ class DBSMSManager(object):
     def add_messages(self, sms_list, where=None):
         return [self.add_message(sms, where) for sms in sms_list]
 
+    def _find_message(self, msg, folder):
+        """Returns the id of a message just like C{msg} in C{folder}"""
+        c = self._get_conn().execute("select message.id from message "
+                    "join thread on message.thread_id = thread.id "
+                    "join folder on thread.folder_id = folder.id "
+                    "where message.number = ? and message.date = ? and "
+                    "message.text = ? and folder.name = ? limit 1",
+                    (msg.number, get_epoch(msg.datetime), msg.text,
+                     folder.name))
+        row = c.fetchone()
+        return row and row[0] or None
+
+    def copy_sim_messages(self, sms_list):
+        """
+        Adds the SIM messages C{sms_list} to the folders of their tabs
+
+        Every message is added by the provider on its own, so if one of
+        them fails those copied so far are deleted again and the error is
+        raised. A message copied already, by a migration that didn't get
+        to delete it from the SIM, is not copied twice. Returns the DB
+        messages.
+        """
+        ret, added = [], []
+        try:
+            for sms in sms_list:
+                folder = KNOWN_FOLDERS[sms.where - 1]
+                msg = DBMessage(sms.number, sms.text, _datetime=sms.datetime)
+                msg.index = self._find_message(msg, folder)
+                if msg.index is None:
+                    self.provider.add_sms(msg, folder=folder)
+                    added.append(msg)
+                ret.append(msg)
+        except sqlite3.Error:
+            for msg in added:
+                try:
+                    self.provider.delete_sms(msg)
+                except sqlite3.Error, e:
+                    logger.error("Error deleting the copy of SMS %d: %s"
+                                 % (msg.index, e))
+            raise
+
+        return ret
+
     def delete_message(self, sms):
         # we should delete the containing thread if it's empty
         self.provider.delete_sms(sms)
 
+    def delete_messages(self, sms_list):
+        """
+        Deletes C{sms_list} from the DB
+
+        Every message is deleted by the provider on its own, a failure
+        doesn't stop the rest. Returns an (sms, error) tuple per message,
+        C{error} being None for those deleted.
+        """
+        results = []
+        for sms in sms_list:
+            try:
+                self.provider.delete_sms(sms)
+            except sqlite3.Error, e:
+                logger.error("Error deleting SMS %d from the DB: %s"
+                             % (sms.index, e))
+                results.append((sms, e))
+            else:
+                results.append((sms, None))
+
+        return results
+
+    def queue_messages(self, queued):
+        """
+        Adds C{queued}, a list of L{QueuedSMS}, to the send queue
+
+        They are added in a single transaction, either all of them are
+        queued or none is and the error is raised.
+        """
+        self._begin()
+        try:
+            c = self.conn.cursor()
+            for sms in queued:
+                c.execute("insert into send_queue(date, number, text, smsc, "
+                          "msgvp, status_request) values (?, ?, ?, ?, ?, ?)",
+                          (sms.date, sms.number, sms.text, sms.smsc,
+                           sms.msgvp, int(bool(sms.status_request))))
+                sms.index = c.lastrowid
+            self._commit()
+        except sqlite3.Error, e:
+            self._rollback()
+            logger.error("Error queueing %d messages: %s" % (len(queued), e))
+            raise
+
+        return queued
+
+    def get_queued_messages(self):
+        """Returns the messages in the send queue, oldest first"""
+        c = self._get_conn().execute("select id, date, number, text, smsc, "
+                                     "msgvp, status_request, attempts, "
+                                     "next_attempt from send_queue "
+                                     "where sent_date is null and "
+                                     "not failed order by id")
+        return [QueuedSMS(number, text, smsc, msgvp, bool(status_request),
+                          index, date, attempts, next_attempt)
+                    for (index, date, number, text, smsc, msgvp,
+                         status_request, attempts, next_attempt) in c]
+
+    def reschedule_queued_message(self, sms):
+        """Stores the attempts and next attempt of queued C{sms}"""
+        self._get_conn().execute("update send_queue set attempts = ?, "
+                                 "next_attempt = ? where id = ?",
+                                 (sms.attempts, sms.next_attempt, sms.index))
+
+    def fail_queued_message(self, sms):
+        """
+        Moves the queued C{sms}, given up on, back to the drafts folder
+
+        Like in L{complete_queued_message}, C{sms} is marked first so it
+        is never sent again, and a message marked that didn't get to
+        leave the queue is saved when the DB is next opened. Returns the
+        new draft, None if C{sms} was not queued or could not be saved
+        yet.
+        """
+        c = self._get_conn().execute("update send_queue set failed = 1 "
+                                     "where id = ? and sent_date is null "
+                                     "and not failed", (sms.index,))
+        if c.rowcount != 1:
+            return None
+
+        try:
+            return self._save_failed_message(sms.index, sms.number,
+                                             sms.text, sms.date)
+        except sqlite3.Error, e:
+            logger.error("Error saving failed SMS %d: %s" % (sms.index, e))
+            return None
+
+    def _save_failed_message(self, index, number, text, date):
+        # dated when it was queued, so it is found again if need be
+        msg = DBMessage(number, text,
+                        _datetime=datetime.fromtimestamp(date, self.tz))
+        msg.index = self._find_message(msg, drafts_folder)
+        if msg.index is None:
+            self.provider.add_sms(msg, folder=drafts_folder)
+
+        self.conn.execute("delete from send_queue where id = ?", (index,))
+
+        for date, msg in self._iter_messages(index=msg.index):
+            return msg
+        return None
+
+    def complete_queued_message(self, sms, date, reference=None):
+        """
+        Moves the queued C{sms}, sent at C{date}, to the sent folder
+
+        The queue and the sent folder are written by different
+        connections, so C{sms} is first marked as sent: only the first
+        answer of the device gets to save it, and it is never sent again.
+        Then it is added to the sent folder, and at last it leaves the
+        queue along with storing its delivery C{reference} if it asked
+        for a report. A message marked as sent that didn't get to leave
+        the queue is saved when the DB is next opened, without adding it
+        twice. Returns the new DB message, None if C{sms} was not queued
+        or could not be saved yet.
+        """
+        c = self._get_conn().execute("update send_queue set sent_date = ?, "
+                                     "reference = ? where id = ? and "
+                                     "sent_date is null",
+                                     (get_epoch(date), reference, sms.index))
+        if c.rowcount != 1:
+            return None
+
+        try:
+            return self._save_sent_message(sms.index, sms.number, sms.text,
+                                           date, sms.status_request,
+                                           reference)
+        except sqlite3.Error, e:
+            logger.error("Error saving sent SMS %d: %s" % (sms.index, e))
+            return None
+
+    def _save_sent_message(self, index, number, text, date, status_request,
+                           reference):
+        msg = DBMessage(number, text, _datetime=date)
+        msg.index = self._find_message(msg, outbox_folder)
+        if msg.index is None:
+            self.provider.add_sms(msg, folder=outbox_folder)
+
+        self._begin()
+        try:
+            c = self.conn.cursor()
+            if status_request and reference is not None:
+                c.execute("insert or ignore into delivery(message_id, "
+                          "reference, status) values (?, ?, ?)",
+                          (msg.index, reference, DELIVERY_PENDING))
+            c.execute("delete from send_queue where id = ?", (index,))
+            self._commit()
+        except:
+            self._rollback()
+            raise
+
+        for date, msg in self._iter_messages(index=msg.index):
+            return msg
+        return None
+
+    def _save_queued_messages(self):
+        """Saves the messages done with that didn't get to leave the queue"""
+        c = self.conn.execute("select id, number, text, sent_date, "
+                              "status_request, reference from send_queue "
+                              "where sent_date is not null")
+        for (index, number, text, sent_date, status_request,
+             reference) in c.fetchall():
+            logger.info("Saving SMS %d, sent to %s" % (index, number))
+            try:
+                self._save_sent_message(index, number, text,
+                            datetime.fromtimestamp(sent_date, self.tz),
+                            status_request, reference)
+            except sqlite3.Error, e:
+                logger.error("Error saving sent SMS %d: %s" % (index, e))
+
+        c = self.conn.execute("select id, number, text, date from send_queue "
+                              "where failed")
+        for index, number, text, date in c.fetchall():
+            logger.info("Saving SMS %d to %s as a draft" % (index, number))
+            try:
+                self._save_failed_message(index, number, text, date)
+            except sqlite3.Error, e:
+                logger.error("Error saving failed SMS %d: %s" % (index, e))
+
+    def set_delivered(self, reference):
+        """
+        Marks the message a delivery receipt with C{reference} is for
+
+        Returns the message, None if no message is waiting for it
+        """
+        self._get_conn()
+        self._begin()
+        try:
+            c = self.conn.execute("select message_id from delivery "
+                                  "where reference = ? and status = ? "
+                                  "order by message_id desc limit 1",
+                                  (reference, DELIVERY_PENDING))
+            row = c.fetchone()
+            if row is None:
+                self._rollback()
+                return None
+
+            self.conn.execute("update delivery set status = ? "
+                              "where message_id = ?",
+                              (DELIVERY_DELIVERED, row[0]))
+            self._commit()
+        except:
+            self._rollback()
+            raise
+
+        for date, msg in self._iter_messages(index=row[0]):
+            return msg
+        return None
+
+    def _get_conn(self):
+        if self.conn is None:
+            # every statement commits on its own unless we begin a
+            # transaction, see _begin
+            self.conn = Connection(self.path, None)
+            self.conn.executescript(MESSAGES_INDEXES)
+            self.conn.executescript(SEND_QUEUE_SCHEMA)
+            self.conn.executescript(DELIVERY_SCHEMA)
+            self.fts = self._setup_search(self.conn)
+            self._setup_conversations(self.conn)
+            self._save_queued_messages()
+        return self.conn
+
+    def _setup_conversations(self, conn):
+        columns = [row[1] for row in
+                       conn.execute("pragma table_info(conversation)")]
+        if 'thread_id' in columns:
+            return
+
+        # summarize what was there before us, the messages already
+        # there when we first see them count as read
+        script = CONVERSATION_SCHEMA + CONVERSATION_FILL
+        c = conn.execute("select name from sqlite_master "
+                         "where name = 'message_read'")
+        if c.fetchone() is None:
+            script = READ_SCHEMA + script
+        try:
+            conn.executescript("begin;\n%s%scommit;"
+                               % (script, CONVERSATION_TRIGGERS))
+        except sqlite3.Error:
+            self._rollback()
+            raise
+
+    def _setup_search(self, conn):
+        c = conn.execute("select name from sqlite_master "
+                         "where name = 'message_search'")
+        if c.fetchone() is None:
+            for module in ['fts4', 'fts3']:
+                try:
+                    conn.execute("create virtual table message_search "
+                                 "using %s(text, number)" % module)
+                    break
+                except sqlite3.OperationalError:
+                    pass
+            else:
+                logger.warn("SQLite lacks full-text search support, "
+                            "message searches will be slow")
+                return False
+
+            # index what was there before us
+            conn.execute(SEARCH_FILL)
+
+        conn.executescript(SEARCH_TRIGGERS)
+        return True
+
+    def _iter_messages(self, where=None, since=None, until=None,
+                       before=None, limit=None, match=None, numbers=None,
+                       index=None):
+        conn = self._get_conn()
+        clauses, args = [], []
+        if index is not None:
+            clauses.append("message.id = ?")
+            args.append(index)
+        if where is not None:
+            clauses.append("folder.name = ?")
+            args.append(KNOWN_FOLDERS[where - 1].name)
+        if since is not None:
+            clauses.append("message.date >= ?")
+            args.append(get_epoch(since))
+        if until is not None:
+            clauses.append("message.date < ?")
+            args.append(get_epoch(until))
+        if before is not None:
+            # keyset pagination, so later pages don't get any slower
+            clauses.append("(message.date < ? or "
+                           "(message.date = ? and message.id < ?))")
+            args.extend([before[0], before[0], before[1]])
+        if match is not None or numbers:
+            matches = []
+            if match is not None and self.fts:
+                query = _get_fts_query(match)
+                if query is not None:
+                    # the unary + keeps SQLite walking the date index, so
+                    # a word found in every message doesn't need sorting
+                    matches.append("+message.id in (select docid from "
+                                   "message_search where message_search "
+                                   "match ?)")
+                    args.append(query)
+            elif match is not None:
+                matches.append("(message.text like ? escape '\\' or "
+                               "message.number like ? escape '\\')")
+                args.extend([_get_like_pattern(match)] * 2)
+            digits = match is not None and _get_number_digits(match)
+            if digits:
+                # the tokenizer keeps numbers whole, so they are not
+                # found by any of their inner digits through the index
+                matches.append("message.number like ?")
+                args.append('%' + digits + '%')
+            if numbers:
+                matches.append("message.thread_id in (select id from "
+                               "thread where number in (%s))"
+                               % ", ".join(["?"] * len(numbers)))
+                args.extend(numbers)
+            clauses.append(matches and "(%s)" % " or ".join(matches) or "0")
+
+        sql = MESSAGES_QUERY % (clauses and
+                                "where " + " and ".join(clauses) or "")
+        if limit is not None:
+            sql += "limit ?"
+            args.append(limit)
+
+        c = conn.cursor()
+        c.execute(sql, args)
+        # iterating the cursor streams the rows rather than fetching them all
+        for (index, date, number, text, flags, folder, reference,
+             status) in c:
+            msg = DBMessage(number, text, index=index, flags=flags,
+                            _datetime=datetime.fromtimestamp(date, self.tz))
+            msg.where = FOLDER_TABS[folder]
+            msg.status_reference = reference
+            msg.delivery_status = status or DELIVERY_NONE
+            yield date, msg
+
+    def iter_messages(self, where=None, since=None, until=None):
+        """
+        Yields the DB messages newest first, reading them in a single query
+
+        @param where: only yield the messages of this tab
+        @param since: only yield the messages received from this datetime
+        @param until: only yield the messages received before this datetime
+        """
+        for date, msg in self._iter_messages(where, since, until):
+            yield msg
+
     def get_messages(self):
+        return list(self.iter_messages())
+
+    def search(self, query, numbers=None, limit=SEARCH_LIMIT):
+        """
+        Returns the messages matching C{query}, newest first
+
+        A message matches if its text or number contains every word of
+        C{query}, if its number contains the digits of C{query}, or if it
+        was exchanged with any of C{numbers} (written as the DB has them).
+        """
+        return [msg for date, msg in self._iter_messages(match=query,
+                                            numbers=numbers, limit=limit)]
+
+    def get_conversations_page(self, before=None, limit=PAGE_SIZE):
+        """
+        Returns up to C{limit} L{Conversation}s, the most recent first
+
+        C{before} is the cursor returned along with the previous page, the
+        return value is a (conversations, cursor) tuple. Every page costs
+        the same no matter how many messages there are.
+        """
+        clauses, args = "", []
+        if before is not None:
+            clauses = ("where conversation.date < ? or "
+                       "(conversation.date = ? and "
+                       "conversation.thread_id < ?)")
+            args.extend([before[0], before[0], before[1]])
+        args.append(limit)
+
+        c = self._get_conn().execute(CONVERSATIONS_QUERY % clauses, args)
+        ret = [Conversation(*row) for row in c]
+        cursor = ret and (ret[-1].date, ret[-1].thread) or before
+        return ret, cursor
+
+    def mark_read(self, messages):
+        """
+        Marks C{messages}, DB messages that have been opened, as read
+
+        The unread count of their conversations goes down accordingly.
+        """
+        try:
+            self._get_conn().executemany("insert or ignore into "
+                                         "message_read(message_id) "
+                                         "values (?)",
+                                         [(msg.index,) for msg in messages])
+        except sqlite3.Error, e:
+            logger.error("Error marking %d messages as read: %s"
+                         % (len(messages), e))
+
+    def get_messages_page(self, where, before=None, limit=PAGE_SIZE):
+        """
+        Returns up to C{limit} messages of tab C{where}, newest first
+
+        C{before} is the cursor returned along with the previous page, the
+        return value is a (messages, cursor) tuple.
+        """
         ret = []
-        for i in range(3):
-            folder = KNOWN_FOLDERS[i]
-            tab = i + 1
-            for thread in self.provider.list_from_folder(folder):
-                msgs = list(self.provider.list_from_thread(thread))
-                for msg in msgs:
-                    msg.where = tab
-                ret.extend(msgs)
-        return ret
+        cursor = before
+        for date, msg in self._iter_messages(where, before=before,
+                                             limit=limit):
+            ret.append(msg)
+            cursor = (date, msg.index)
+
+        return ret, cursor
+
+
+class SMSPager(object):
+    """
+    I hand out the messages of a tab one page at a time, newest first
+
+    DB messages are read a page at a time, SIM messages are few and are
+    merged in as the pages reach their dates. They can be given after
+    the first pages were handed out, see L{add_sim_messages}.
+    """
+
+    def __init__(self, smanager, where, sim_messages=None):
+        super(SMSPager, self).__init__()
+        self.smanager = smanager
+        self.where = where
+        self.sim_messages = []
+        self.cursor = None
+        self.db_done = False
+        self.started = False
+        # epoch of the oldest message handed out
+        self.oldest = None
+        self.add_sim_messages(sim_messages or [])
+
+    def add_sim_messages(self, messages):
+        """
+        Merges C{messages} in, returns those older pages should have had
+
+        The messages returned are as recent as the pages handed out
+        already, they won't be in the next ones.
+        """
+        due = []
+        for sms in messages:
+            if self.started and (self.db_done or
+                                 get_epoch(sms.datetime) >= self.oldest):
+                due.append(sms)
+            else:
+                self.sim_messages.append(sms)
+
+        self.sim_messages.sort(key=lambda sms: get_epoch(sms.datetime),
+                               reverse=True)
+        return due
+
+    def is_done(self):
+        return self.db_done and not self.sim_messages
+
+    def next_page(self, limit=PAGE_SIZE):
+        """Returns the next page of messages, empty once we are done"""
+        self.started = True
+        page = []
+
+        if not self.db_done:
+            page, self.cursor = self.smanager.get_messages_page(self.where,
+                                                        self.cursor, limit)
+            self.db_done = len(page) < limit
+
+        if self.db_done:
+            # everything left is older than what was already handed out
+            page.extend(self.sim_messages)
+            self.sim_messages = []
+        elif page:
+            oldest = get_epoch(page[-1].datetime)
+            while self.sim_messages and \
+                    get_epoch(self.sim_messages[0].datetime) >= oldest:
+                page.append(self.sim_messages.pop(0))
+
+        page.sort(key=lambda sms: get_epoch(sms.datetime), reverse=True)
+        if page and not self.db_done:
+            self.oldest = get_epoch(page[-1].datetime)
+        return page
 
 
 class Messages(object):
@@ -99,7 +954,8 @@ class Messages(object):
 
     def __init__(self, device=None):
         self.device = device
-        self.smanager = DBSMSManager()
+        # the DB is shared by every Messages object, see L{pool}
+        self.smanager = pool.get(DBSMSManager, MESSAGES_DB)
 
         self.tz = None
         try:
@@ -108,7 +964,6 @@ class Messages(object):
             pass
 
     def close(self):
-        self.smanager.close()
         self.device = None
 
     def add_messages(self, smslist, where=None):
@@ -137,37 +992,54 @@ class Messages(object):
             ret.append(sms)
 
         # return messages in db storage too
-        lst = self.smanager.get_messages()
-        for msg in lst:
-            msg.datetime = msg.datetime.astimezone(self.tz)
-            ret.append(msg)
+        ret.extend(self.smanager.iter_messages())
 
         return ret
 
-    def get_messages_async(self, cb, eb):
+    def _get_sim_messages(self, slist):
+        ret = []
+        for dct in slist:
+            sms = SMMessage.from_dict(dct, self.tz)
+            try:
+                text = unpack_dbus_safe_string(sms.text)
+                if text[1] == '\x06':  # WAP Push
+                    dct['text'] = '%s\n%s' % \
+                        (WAP_REPLACEMENT, text.encode('string_escape'))
+                    sms = SMMessage.from_dict(dct, self.tz)
+            except ValueError:
+                pass
 
-        def _cb(slist):
-            ret = []
+            ret.append(sms)
+        return ret
 
-            # from sim storage
-            for dct in slist:
-                sms = SMMessage.from_dict(dct, self.tz)
-                try:
-                    text = unpack_dbus_safe_string(sms.text)
-                    if text[1] == '\x06':  # WAP Push
-                        dct['text'] = '%s\n%s' % \
-                            (WAP_REPLACEMENT, text.encode('string_escape'))
-                        sms = SMMessage.from_dict(dct, self.tz)
-                except ValueError:
-                    pass
+    def get_sim_messages_async(self, cb, eb):
+        """Calls C{cb} with the list of messages stored in the SIM"""
+        self.device.List(dbus_interface=SMS_INTFACE,
+                         reply_handler=lambda slist:
+                            cb(self._get_sim_messages(slist)),
+                         error_handler=eb)
 
-                ret.append(sms)
+    def get_pagers(self, sim_messages):
+        """
+        Returns a L{SMSPager} for every SMS tab
+
+        @type sim_messages: list
+        @rtype: dict of tab -> L{SMSPager}
+        """
+        pagers = {}
+        for i in range(len(KNOWN_FOLDERS)):
+            where = i + 1
+            pagers[where] = SMSPager(self.smanager, where,
+                        [sms for sms in sim_messages if sms.where == where])
+        return pagers
+
+    def get_messages_async(self, cb, eb):
+
+        def _cb(slist):
+            ret = self._get_sim_messages(slist)
 
             # return messages in db storage too
-            lst = self.smanager.get_messages()
-            for msg in lst:
-                msg.datetime = msg.datetime.astimezone(self.tz)
-                ret.append(msg)
+            ret.extend(self.smanager.iter_messages())
 
             cb(ret)
 
@@ -180,17 +1052,142 @@ class Messages(object):
         sms = SMMessage.from_dict(dct, self.tz)
         return sms
 
-    def delete_messages(self, smslist):
-        for sms in smslist:
-            if is_sim_message(sms):
-                self.device.Delete(sms.index, dbus_interface=SMS_INTFACE,
-                                   reply_handler=lambda: True,
-                                   error_handler=logger.error)
-            else:
-                self.smanager.delete_message(sms)
+    def get_message_async(self, index, cb, eb):
+        """Calls C{cb} with the SIM message at C{index}"""
+        self.device.Get(index, dbus_interface=SMS_INTFACE,
+                        reply_handler=lambda dct:
+                            cb(self._get_sim_messages([dct])[0]),
+                        error_handler=eb)
+
+    def search(self, query, contacts=None, sim_messages=None,
+               limit=SEARCH_LIMIT):
+        """
+        Returns the messages matching C{query}, the DB ones newest first
+
+        C{query} is looked up in the text and number of every message and,
+        if C{contacts} (a L{ContactIndex}) are given, in the name of the
+        contact the message was exchanged with. The SIM is not read again,
+        C{sim_messages} are searched instead.
+        """
+        if isinstance(query, str):
+            query = query.decode('utf8')
+        query = query.strip()
+        if not query:
+            return []
+
+        # the names are resolved to numbers once, the DB matches them
+        numbers = set()
+        if contacts:
+            numbers = contacts.find_numbers_by_name(query)
+
+        ret = self.smanager.search(query, list(numbers), limit)
+
+        lowered = query.lower()
+        digits = _get_number_digits(query)
+        for sms in sim_messages or []:
+            if lowered in sms.text.lower() or lowered in sms.number or \
+                    (digits and digits in sms.number) or \
+                    (numbers and numbers & contacts.get_number_forms(
+                                                    sms.number)):
+                ret.append(sms)
+
+        return ret
+
+    def delete_sim_message(self, sms, reply_handler, error_handler):
+        self.device.Delete(sms.index, dbus_interface=SMS_INTFACE,
+                           reply_handler=reply_handler,
+                           error_handler=error_handler)
+
+    def delete_messages(self, smslist, cb=None):
+        """
+        Deletes C{smslist}, the DB messages right away
+
+        The SIM messages are deleted asynchronously, a few at a time.
+        Once every message is gone C{cb} is called with an (sms, error)
+        tuple per message, C{error} being None for those deleted.
+        """
+        results = self.smanager.delete_messages(
+                        [sms for sms in smslist if not is_sim_message(sms)])
+
+        def done_cb(sim_results):
+            for sms, error in sim_results:
+                if error is not None:
+                    logger.error("Error deleting SMS %d from the SIM: %s"
+                                 % (sms.index, error))
+            if cb is not None:
+                cb(results + sim_results)
+
+        pipeline = CallPipeline(self.delete_sim_message, done_cb=done_cb)
+        pipeline.start([sms for sms in smslist if is_sim_message(sms)])
+
+    def delete_objs(self, objs, cb=None):
+        return self.delete_messages(objs, cb)
+
+    def mark_read(self, smslist):
+        """Marks the DB messages of C{smslist} as read"""
+        dbmessages = [sms for sms in smslist if not is_sim_message(sms)]
+        if dbmessages:
+            self.smanager.mark_read(dbmessages)
+
+
+class SIMMigration(object):
+    """
+    I move SIM messages to the DB
+
+    The messages are copied to the DB and, only once every copy is in,
+    deleted from the SIM keeping at most C{max_pending} D-Bus calls in
+    flight. If the copy fails nothing is deleted, see
+    L{DBSMSManager.copy_sim_messages}. C{progress_cb} is called for every message with the SIM
+    message, its DB copy (None if the SIM one could not be deleted), and
+    the number of messages processed and to process. C{done_cb} is called
+    with the DB copies once every message has been processed.
+    """
+
+    def __init__(self, messages, smslist, progress_cb=None, done_cb=None,
+                 max_pending=MAX_PENDING):
+        super(SIMMigration, self).__init__()
+        self.messages = messages
+        self.smslist = smslist
+        self.progress_cb = progress_cb
+        self.done_cb = done_cb
+        self.pipeline = CallPipeline(messages.delete_sim_message,
+                                     self._deleted, self._done, max_pending)
+        # id(SIM message) -> DB copy
+        self.copies = {}
+        self.migrated = []
+
+    def start(self):
+        try:
+            new = self.messages.smanager.copy_sim_messages(self.smslist)
+        except sqlite3.Error, e:
+            # the SIM still holds every message, leave it alone
+            logger.error("Error copying the SIM messages to the DB: %s" % e)
+            self._done([])
+            return
+
+        for old, copy in zip(self.smslist, new):
+            self.copies[id(old)] = copy
+
+        self.pipeline.start(self.smslist)
+
+    def _deleted(self, old, error):
+        new = self.copies.pop(id(old))
+        if error is None:
+            self.migrated.append(new)
+        else:
+            logger.error("Error deleting SMS %d from the SIM: %s"
+                         % (old.index, error))
+            # it is still in the SIM, don't keep a copy
+            self.messages.smanager.delete_message(new)
+            new = None
+
+        if self.progress_cb is not None:
+            self.progress_cb(old, new, len(self.pipeline.results),
+                             len(self.smslist))
 
-    def delete_objs(self, objs):
-        return self.delete_messages(objs)
+    def _done(self, results):
+        if self.done_cb is not None:
+            self.done_cb(self.migrated)
 
 
 def get_messages_obj(device):
@@ -25,6 +25,25 @@ from gui.contrib.gtkmvc import ListStoreModel
 
 from gui.consts import (TV_CNT_TYPE, TV_CNT_NAME, TV_CNT_NUMBER,
                         TV_CNT_EDITABLE, TV_CNT_OBJ)
+from gui.contacts.index import ContactIndex
+
+# path -> pixbuf, every contact of a backend shares its icon
+_icons = {}
+
+
+def _get_icon(path):
+    if path not in _icons:
+        _icons[path] = gtk.gdk.pixbuf_new_from_file(path)
+    return _icons[path]
+
+
+def get_contact_key(contact):
+    """Returns a key that tells C{contact} apart from every other contact"""
+    index = contact.get_index()
+    if index is None:
+        # KDE contacts have no index
+        return contact.__class__, contact.get_name(), contact.get_number()
+    return contact.__class__, index
 
 
 class ContactsStoreModel(ListStoreModel):
@@ -33,6 +52,14 @@ class ContactsStoreModel(ListStoreModel):
     def __init__(self):
         super(ContactsStoreModel, self).__init__(gtk.gdk.Pixbuf,
                 TYPE_STRING, TYPE_STRING, TYPE_BOOLEAN, TYPE_PYOBJECT)
+        # shared by every number lookup, kept in sync with the rows
+        self.index = ContactIndex()
+        # key of every contact in the model -> its iter, see
+        # get_contact_key
+        self.rows = {}
+        # keys of the rows to remove unless their contact is added again,
+        # see mark_stale
+        self.stale = set()
 
     def add_contacts(self, contacts):
         """Adds C{contacts} to the store"""
@@ -40,26 +67,147 @@ class ContactsStoreModel(ListStoreModel):
             self.add_contact(contact)
 
     def add_contact(self, contact):
-        """Adds C{contact} to the store"""
+        """
+        Adds C{contact} to the store
+
+        If it's in already, its row is updated instead.
+        """
+        key = get_contact_key(contact)
+        self.stale.discard(key)
+        _iter = self.rows.get(key)
+        if _iter is not None:
+            if self._is_shown(_iter, contact):
+                self._refresh(_iter, contact)
+            else:
+                self._update(_iter, contact)
+            return
+
+        self.rows[key] = self.append(self._make_entry(contact))
+        self.index.add(contact)
+
+    def _make_entry(self, contact):
         c = [None] * (TV_CNT_OBJ + 1)
-        c[TV_CNT_TYPE] = gtk.gdk.pixbuf_new_from_file(contact.image_16x16())
+        c[TV_CNT_TYPE] = _get_icon(contact.image_16x16())
         c[TV_CNT_NAME] = contact.name
         c[TV_CNT_NUMBER] = contact.number
         c[TV_CNT_EDITABLE] = contact.writable
         c[TV_CNT_OBJ] = contact
-        self.append(c)
-
-    def find_contacts_by_number(self, number):
-        ret = []
+        return c
+
+    def _is_shown(self, _iter, contact):
+        # only what is displayed counts
+        shown = self.get_value(_iter, TV_CNT_OBJ)
+        return (shown.name == contact.name and
+                shown.number == contact.number and
+                shown.writable == contact.writable)
+
+    def _refresh(self, _iter, contact):
+        # the row is left alone, but the SIM contacts hold the device,
+        # which is a new one after every re-enable or suspend
+        vars(self.get_value(_iter, TV_CNT_OBJ)).update(vars(contact))
+
+    def _update(self, _iter, contact):
+        self.index.remove(self.get_value(_iter, TV_CNT_OBJ))
+        entry = self._make_entry(contact)
+        for column in range(len(entry)):
+            self.set_value(_iter, column, entry[column])
+        self.index.add(contact)
+
+    def remove(self, _iter):
+        contact = self.get_value(_iter, TV_CNT_OBJ)
+        self.rows.pop(get_contact_key(contact), None)
+        self.index.remove(contact)
+        return super(ContactsStoreModel, self).remove(_iter)
+
+    def clear(self):
+        self.index.clear()
+        self.rows = {}
+        self.stale = set()
+        super(ContactsStoreModel, self).clear()
+
+    def get_row_key(self, _iter):
+        return get_contact_key(self.get_value(_iter, TV_CNT_OBJ))
+
+    def get_key_iter(self, key):
+        """Returns the iter of the row with C{key} or None"""
+        return self.rows.get(key)
+
+    def get_diff(self, contacts, cclasses):
+        """
+        Returns how the rows differ from C{contacts}, a fresh read
+
+        Only the rows of the contacts that are instances of C{cclasses}
+        are compared, the backends C{contacts} come from. The diff is an
+        (added, removed, changed) tuple: the contacts without a row, the
+        iters of the rows no longer in C{contacts} and the (iter,
+        contact) of the rows showing an outdated copy. See L{apply_diff}
+        """
+        cclasses = tuple(cclasses)
+        rows = dict([(key, _iter) for key, _iter in self.rows.iteritems()
+                        if issubclass(key[0], cclasses)])
+        added, changed = [], []
+        for contact in contacts:
+            _iter = rows.pop(get_contact_key(contact), None)
+            if _iter is None:
+                added.append(contact)
+            elif self._is_shown(_iter, contact):
+                self._refresh(_iter, contact)
+            else:
+                changed.append((_iter, contact))
+        return added, rows.values(), changed
+
+    def apply_diff(self, diff):
+        """Applies C{diff}, as returned by L{get_diff}"""
+        added, removed, changed = diff
+        for _iter in removed:
+            self.remove(_iter)
+        for _iter, contact in changed:
+            self._update(_iter, contact)
+        self.add_contacts(added)
+
+    def mark_stale(self, cclass):
+        """
+        Marks the rows of the C{cclass} contacts to be read again
+
+        The contacts added from now on keep their rows, the rows of
+        those that are not are removed by the diff of L{get_stale_diff}.
+        """
+        self.stale.update([key for key in self.rows
+                               if issubclass(key[0], cclass)])
+
+    def get_stale_diff(self):
+        """Returns the diff removing the rows still marked stale"""
+        removed = [self.rows[key] for key in self.stale if key in self.rows]
+        self.stale = set()
+        return [], removed, []
+
+    def remove_contacts_of_type(self, cclass):
+        """Removes the contacts that are instances of C{cclass}"""
         _iter = self.get_iter_first()
         while _iter:
-            _number = self.get_value(_iter, TV_CNT_NUMBER)
-            if _number == number:
-                ret.append(self.get_value(_iter, TV_CNT_OBJ))
+            contact = self.get_value(_iter, TV_CNT_OBJ)
+            if isinstance(contact, cclass):
+                # _iter points to the next row now, if any
+                if not self.remove(_iter):
+                    break
+            else:
+                _iter = self.iter_next(_iter)
+
+    def set_contact_number(self, _iter, number):
+        """Shows the new C{number} of the contact at C{_iter}"""
+        self.set_value(_iter, TV_CNT_NUMBER, number)
+        self.index.update(self.get_value(_iter, TV_CNT_OBJ))
+
+    def set_imsi(self, imsi):
+        """
+        Sets the SIM used to expand national numbers
+
+        Returns True if the contacts had to be reindexed
+        """
+        return self.index.set_imsi(imsi)
 
-            _iter = self.iter_next(_iter)
-
-        return ret
+    def find_contacts_by_number(self, number):
+        return self.index.lookup(number)
 
     def find_contacts(self, pattern):
         ret = []
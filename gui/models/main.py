@@ -19,12 +19,13 @@
 import os
 import datetime
 import re
+import time
 
 import dbus
 import dbus.mainloop.glib
 dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
-from gobject import timeout_add_seconds
+from gobject import timeout_add_seconds, source_remove
 
 #from gtkmvc import Model
 from gui.contrib.gtkmvc import Model
@@ -41,7 +42,6 @@ from wader.common.consts import (WADER_SERVICE, WADER_OBJPATH, WADER_INTFACE,
                                  APP_VERSION as CORE_VERSION)
 import wader.common.aterrors as E
 import wader.common.signals as S
-from wader.common.provider import UsageProvider
 
 from gui.logger import logger
 from gui.dialogs import show_error_dialog
@@ -59,8 +59,11 @@ from gui.constx import (GUI_SIM_AUTH_NONE, GUI_SIM_AUTH_PIN,
                               GUI_MODEM_STATE_ENABLED,
                               GUI_MODEM_STATE_CONNECTED)
 from gui.config import config
+from gui.throughput import ThroughputHistory
 from gui.uptime import get_uptime
+from gui.usage import UsageRollups, to_local
 from gui.network_codes import get_msisdn_ussd_info
+from gui.providers import pool, UsageProvider
 
 
 TWOG_TECH = [MM_GSM_ACCESS_TECH_GSM, MM_GSM_ACCESS_TECH_GSM_COMPAT,
@@ -75,6 +78,10 @@ REGISTER_TIMEOUT = 3 * 60   # 3m
 
 ONE_MB = 2 ** 20
 
+# flush the usage of the session in progress at least this often
+CHECKPOINT_INTERVAL = 5 * 60    # 5m
+CHECKPOINT_BYTES = 8 * ONE_MB
+
 
 class MainModel(Model):
 
@@ -112,6 +119,10 @@ class MainModel(Model):
         'current_month_name': '',
         'rx_rate': -1,
         'tx_rate': -1,
+        # (min, avg, peak) rates of the last minute, the last 15 minutes
+        # and the session, see ThroughputHistory
+        'rx_rate_stats': None,
+        'tx_rate_stats': None,
         'transfer_limit_exceeded': False,
         # payt properties
         'payt_available': None,
@@ -136,6 +147,10 @@ class MainModel(Model):
         self.start_time = None
         self.stop_time = None
         self.rx_bytes = self.tx_bytes = 0
+        self._checkpoint_bytes = 0
+        self.checkpoint_id = None
+        # rate history of the session, read by the status bar
+        self.throughput = ThroughputHistory()
         # DialStats SignalMatch
         self.stats_sm = None
         self.rssi_sm = None
@@ -147,7 +162,8 @@ class MainModel(Model):
         self._we_dialed = None
         self.preferences_model = PreferencesModel()
         self.profiles_model = ProfilesModel(self)
-        self.provider = UsageProvider(USAGE_DB)
+        self.provider = pool.get(UsageProvider, USAGE_DB)
+        self.usage_rollups = UsageRollups(self.provider, USAGE_DB)
         self._init_wader_object()
         # Per device
         self.card_manufacturer = None
@@ -225,20 +241,24 @@ class MainModel(Model):
             logger.info('Device path: %s' % self.device_opath)
 
         if opath == self.device_opath:
-            self.device = None
-            self.device_opath = None
-            self.dial_path = None
-            self.status = GUI_MODEM_STATE_NODEVICE
-            self.operator = ''
-            self.tech = None
-            self.rssi = None
-            self.registration = -1
-            self.card_manufacturer = None
-            self.card_model = None
-            self.card_firmware = None
-            self.imei = None
-            self.imsi = None
-            self.msisdn = None
+            self.begin_batch()
+            try:
+                self.device = None
+                self.device_opath = None
+                self.dial_path = None
+                self.status = GUI_MODEM_STATE_NODEVICE
+                self.operator = ''
+                self.tech = None
+                self.rssi = None
+                self.registration = -1
+                self.card_manufacturer = None
+                self.card_model = None
+                self.card_firmware = None
+                self.imei = None
+                self.imsi = None
+                self.msisdn = None
+            finally:
+                self.end_batch()
 
             self.stop_reginfo_tracking()
             self.stop_rssi_tracking()
@@ -259,8 +279,12 @@ class MainModel(Model):
         return self.dialer_manager
 
     def quit(self, quit_cb):
-        # close UsageProvider on exit
-        self.provider.close()
+        # don't lose the traffic of a connection we didn't make
+        if self.stats_sm is not None:
+            self.stop_stats_tracking()
+
+        # close UsageProvider and the other shared DB handles on exit
+        pool.close_all()
 
         def quit_eb(e):
             logger.error("Error while removing device: %s" % get_error_msg(e))
@@ -518,13 +542,17 @@ class MainModel(Model):
         self.on_registration_info_cb(*args)
 
     def on_registration_info_cb(self, status, operator_code, operator_name):
-        if self.registration != status:
-            logger.info('Registration changed %d' % status)
-        self.registration = status
+        self.begin_batch()
+        try:
+            if self.registration != status:
+                logger.info('Registration changed %d' % status)
+            self.registration = status
 
-        if self.operator != operator_name:
-            logger.info('Operator changed %s' % str(operator_name))
-        self.operator = operator_name
+            if self.operator != operator_name:
+                logger.info('Operator changed %s' % str(operator_name))
+            self.operator = operator_name
+        finally:
+            self.end_batch()
 
     def on_rssi_changed_cb(self, rssi):
         if self.rssi != rssi:
@@ -718,15 +746,8 @@ class MainModel(Model):
             self.transfer_limit_exceeded = False
 
     def calc_month(self, offset):
-        v_3g = v_2g = 0
-
-        for item in self._get_month(offset):
-            if item.is_3g():
-                v_3g += item.total()
-            else:
-                v_2g += item.total()
-
-        return (v_3g, v_2g)
+        month = self._get_month_date(offset)
+        return self.usage_rollups.get_usage_for_month(month)
 
     def calc_current_summed(self):
         self.current_summed_3g = \
@@ -763,15 +784,33 @@ class MainModel(Model):
         #       devices e.g. HSO, don't get initialised to zero on connect.
         self.rx_bytes, self.tx_bytes = self.device.GetStats()
         self.rx_rate = self.tx_rate = 0
+        self.throughput.reset()
+        self._update_rate_stats()
 
         # the last values written to DB
         self._last_time = self.start_time
         self._last_rx = self.rx_bytes
         self._last_tx = self.tx_bytes
+        # the traffic saved by the last checkpoint
+        self._checkpoint_bytes = 0
+
+    def _get_pending_bytes(self):
+        return ((self.rx_bytes - self._last_rx) +
+                (self.tx_bytes - self._last_tx))
+
+    def _write_usage_segment(self, now):
+        self.usage_rollups.write_segment(self._last_time, now,
+                                         self.rx_bytes - self._last_rx,
+                                         self.tx_bytes - self._last_tx,
+                                         self.is_3g_bearer)
+        self._last_time = now
+        self._last_rx = self.rx_bytes
+        self._last_tx = self.tx_bytes
+        self._checkpoint_bytes = 0
 
     def write_dial_stats(self, is_3g_bearer=None):
-        # Save data to the DB. Called on bearer change, connection tear down,
-        # or possibly day transition(future)
+        # Save data to the DB. Called on bearer change, connection tear down
+        # or day transition (see checkpoint_dial_stats)
 
         # nothing to write
         if ((self._last_rx == self.rx_bytes) and
@@ -783,18 +822,66 @@ class MainModel(Model):
             return
 
         # before resetting the counters, we'll store the stats
+        self._write_usage_segment(datetime.datetime.utcnow())
+
+    def checkpoint_dial_stats(self):
+        """
+        Saves the traffic of the segment in progress to the usage DB
+
+        If the segment has gone past midnight it is written out instead, so
+        the traffic is accounted to the right days
+        """
+        if self._last_time is None:
+            return
+
         now = datetime.datetime.utcnow()
-        self.provider.add_usage_item(self._last_time, now,
-                                     self.rx_bytes - self._last_rx,
-                                     self.tx_bytes - self._last_tx,
-                                     self.is_3g_bearer)
-        self._last_time = now
-        self._last_rx = self.rx_bytes
-        self._last_tx = self.tx_bytes
+        pending = self._get_pending_bytes()
+
+        if to_local(now).date() != to_local(self._last_time).date():
+            if pending:
+                self._write_usage_segment(now)
+            else:
+                self._last_time = now
+            return
+
+        # nothing new since the last checkpoint
+        if pending == self._checkpoint_bytes:
+            return
+
+        self.usage_rollups.save_checkpoint(self._last_time, now,
+                                           self.rx_bytes - self._last_rx,
+                                           self.tx_bytes - self._last_tx,
+                                           self.is_3g_bearer)
+        self._checkpoint_bytes = pending
+
+    def _checkpoint_timeout_cb(self):
+        self.checkpoint_dial_stats()
+        return True
 
     def on_dial_stats(self, stats):
-        rx_bytes, tx_bytes = stats[:2]
-        self.rx_rate, self.tx_rate = stats[2:]
+        # a tick changes a dozen properties, notify each of them once
+        self.begin_batch()
+        try:
+            self._update_dial_stats(stats)
+        finally:
+            self.end_batch()
+
+    def _update_rate_stats(self):
+        history = self.throughput
+        windows = [history.last_minute, history.last_quarter,
+                   history.session]
+        self.rx_rate_stats = tuple([(w.rx_min, w.rx_avg, w.rx_peak)
+                                    for w in windows])
+        self.tx_rate_stats = tuple([(w.tx_min, w.tx_avg, w.tx_peak)
+                                    for w in windows])
+
+    def _update_dial_stats(self, stats):
+        rx_bytes, tx_bytes, rx_rate, tx_rate = stats
+        # record the sample first, the rate graph reads the history
+        self.throughput.add_sample(time.time(), rx_rate, tx_rate,
+                                   rx_bytes, tx_bytes)
+        self._update_rate_stats()
+        self.rx_rate, self.tx_rate = rx_rate, tx_rate
         dx_rx_bytes = dx_tx_bytes = 0
 
         # sanitise txfr values - they have been known to go backwards :-)
@@ -825,6 +912,11 @@ class MainModel(Model):
         if not self.transfer_limit_exceeded:
             self.check_transfer_limit()
 
+        # don't wait for the timer if lots of traffic is unsaved
+        if self._get_pending_bytes() - self._checkpoint_bytes >= \
+                CHECKPOINT_BYTES:
+            self.checkpoint_dial_stats()
+
     def start_stats_tracking(self):
         # ok make sure we get the current epoch start time in UTC format.
         # store it in the models properites for start_time
@@ -834,6 +926,10 @@ class MainModel(Model):
         self.stats_sm = self.bus.add_signal_receiver(self.on_dial_stats,
                                                      S.SIG_DIAL_STATS,
                                                      MDM_INTFACE)
+        # periodically save the session usage in case we don't get to
+        # write it out at tear down
+        self.checkpoint_id = timeout_add_seconds(CHECKPOINT_INTERVAL,
+                                                 self._checkpoint_timeout_cb)
 
     def stop_reginfo_tracking(self):
         if self.reginfo_sm is not None:
@@ -850,6 +946,10 @@ class MainModel(Model):
             self.stats_sm.remove()
             self.stats_sm = None
 
+        if self.checkpoint_id is not None:
+            source_remove(self.checkpoint_id)
+            self.checkpoint_id = None
+
         self.write_dial_stats()
         self.txfr_current_summed_to_month_to_date()
 
@@ -872,10 +972,6 @@ class MainModel(Model):
             month = today
         return month
 
-    def _get_month(self, offset):
-        month = self._get_month_date(offset)
-        return self.provider.get_usage_for_month(month)
-
     def get_month(self, offset):
         # returns a string like "Dec 2009" showing month and year.
         month = self._get_month_date(offset)
@@ -30,6 +30,7 @@ from gui.consts import (CFG_PREFS_DEFAULT_BROWSER,
                               CFG_PREFS_DEFAULT_EXIT_WITHOUT_CONFIRMATION,
                               CFG_PREFS_DEFAULT_SMS_VALIDITY,
                               CFG_PREFS_DEFAULT_SMS_CONFIRMATION)
+from gui.smsc import smsc_cache
 
 PREF_TABS = ["PROFILES"]
 
@@ -122,6 +123,8 @@ class PreferencesModel(Model):
                    self.use_alternate_smsc)
         config.set('preferences', 'smsc_profile', self.smsc_profile)
         config.set('preferences', 'smsc_number', self.smsc_number)
+        # the SMSC might come from somewhere else now
+        smsc_cache.invalidate()
         config.set('preferences', 'sms_validity', self.sms_validity)
         config.set('preferences', 'sms_confirmation', self.sms_confirmation)
 
@@ -17,14 +17,29 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 """Model for SMS-related controllers"""
 
+from datetime import datetime
+
 import gtk
-from gobject import TYPE_PYOBJECT, TYPE_STRING
+from gobject import TYPE_INT64, TYPE_PYOBJECT, TYPE_STRING
+
+from dateutil.tz import gettz
 
 from gui.contrib.gtkmvc import ListStoreModel
 
-from gui.consts import TV_SMS_NUMBER, TV_SMS_OBJ
+from gui.consts import (TV_SMS_NUMBER, TV_SMS_OBJ, TV_SMS_STATUS,
+                        TV_CONV_NAME, TV_CONV_OBJ)
+from gui.contacts.index import ContactIndex
 from gui.images import MOBILE_IMG, COMPUTER_IMG
-from gui.messages import is_sim_message
+from gui.messages import (is_sim_message, get_message_key, get_epoch,
+                          PAGE_SIZE,
+                          DELIVERY_NONE, DELIVERY_PENDING, DELIVERY_DELIVERED)
+from gui.translate import _
+
+DELIVERY_STATUS_TEXT = {
+    DELIVERY_NONE: '',
+    DELIVERY_PENDING: _('Pending'),
+    DELIVERY_DELIVERED: _('Delivered'),
+}
 
 
 class SMSStoreModel(ListStoreModel):
@@ -37,9 +52,154 @@ class SMSStoreModel(ListStoreModel):
 
     def __init__(self, _callable):
         super(SMSStoreModel, self).__init__(gtk.gdk.Pixbuf,
-            TYPE_STRING, TYPE_STRING, TYPE_PYOBJECT, TYPE_PYOBJECT)
+            TYPE_STRING, TYPE_STRING, TYPE_INT64, TYPE_PYOBJECT,
+            TYPE_STRING, TYPE_STRING)
         self._callable = _callable
         self.device = None
+        # the messages not loaded yet, see set_pager
+        self.pager = None
+        self.contacts = None
+        # dates are shown in local time
+        self.tz = None
+        try:
+            self.tz = gettz()
+        except:
+            pass
+        # key of every message in the model -> its iter, which stays
+        # valid as long as the row exists, see get_message_key
+        self.loaded = {}
+
+    def clear(self):
+        self.pager = None
+        self.loaded = {}
+        super(SMSStoreModel, self).clear()
+
+    def remove(self, _iter):
+        message = self.get_value(_iter, TV_SMS_OBJ)
+        self.loaded.pop(get_message_key(message), None)
+        return super(SMSStoreModel, self).remove(_iter)
+
+    def set_pager(self, pager, contacts=None):
+        """
+        Empties the model, which will be filled a page at a time by C{pager}
+
+        See L{load_page}
+        """
+        self.clear()
+        self.pager = pager
+        self.contacts = contacts
+
+    def is_loaded(self):
+        """Returns True if every message has been loaded"""
+        return self.pager is None or self.pager.is_done()
+
+    def load_page(self):
+        """
+        Loads the next page of messages, returns the number of rows added
+        """
+        if self.is_loaded():
+            return 0
+
+        page = self.pager.next_page()
+        self.add_messages(page, self.contacts)
+        return len(page)
+
+    def load_all(self):
+        """Loads every message left, as needed to sort by other columns"""
+        while self.load_page():
+            pass
+
+    def get_pager_diff(self, pager, contacts=None):
+        """
+        Sets C{pager} and returns how the DB rows differ from its messages
+
+        As many DB messages as are loaded are read from C{pager}, so the
+        rows can be updated rather than loaded again. If none are, the
+        first page is left for L{load_page}. The SIM rows are compared
+        once the SIM is read again, see L{get_sim_diff}. The diff is an
+        (added, removed, changed) tuple: the messages without a row, the
+        iters of the rows no longer there and the (iter, message) of the
+        rows showing an outdated copy. See L{apply_diff}
+        """
+        rows = dict([(key, _iter) for key, _iter in self.loaded.iteritems()
+                        if not key[0]])
+        self.pager = pager
+        self.contacts = contacts
+
+        messages = []
+        while len(messages) < len(rows) and not pager.is_done():
+            messages.extend(pager.next_page())
+        return self._get_diff(rows, messages)
+
+    def get_sim_diff(self, messages):
+        """
+        Returns how the SIM rows differ from C{messages}, the SIM read again
+
+        The messages older than the rows loaded are left to the pager.
+        """
+        if self.pager is not None:
+            messages = self.pager.add_sim_messages(messages)
+        rows = dict([(key, _iter) for key, _iter in self.loaded.iteritems()
+                        if key[0]])
+        return self._get_diff(rows, messages)
+
+    def _get_diff(self, rows, messages):
+        contacts = self._get_index(self.contacts)
+        added, changed = [], []
+        for sms in messages:
+            _iter = rows.pop(get_message_key(sms), None)
+            if _iter is None:
+                added.append(sms)
+            elif not self._is_shown(_iter, sms, contacts):
+                changed.append((_iter, sms))
+        return added, rows.values(), changed
+
+    def _is_shown(self, _iter, message, contacts):
+        if self.get_value(_iter, TV_SMS_OBJ).text != message.text:
+            return False
+
+        entry = self._make_entry(message, contacts)
+        for column in range(len(entry)):
+            if column != TV_SMS_OBJ and \
+                    self.get_value(_iter, column) != entry[column]:
+                return False
+        return True
+
+    def apply_diff(self, diff):
+        """Applies C{diff}, see L{get_pager_diff} and L{get_sim_diff}"""
+        added, removed, changed = diff
+        for _iter in removed:
+            self.remove(_iter)
+        contacts = self._get_index(self.contacts)
+        for _iter, sms in changed:
+            self.update_message(_iter, sms, contacts)
+        for sms in added:
+            self._append(sms, contacts)
+
+    def get_row_key(self, _iter):
+        return get_message_key(self.get_value(_iter, TV_SMS_OBJ))
+
+    def get_key_iter(self, key):
+        """Returns the iter of the row with C{key} or None"""
+        return self.loaded.get(key)
+
+    def get_sim_messages(self):
+        """Returns the SIM messages, including those not loaded yet"""
+        ret = [sms for sms in self.get_messages() if is_sim_message(sms)]
+        if self.pager is not None:
+            ret.extend(self.pager.sim_messages)
+        return ret
+
+    def add_search_results(self, messages, contacts=None):
+        """
+        Adds the C{messages} found by a search that were not loaded yet
+
+        The pager will skip them when it gets to their page.
+        """
+        contacts = self._get_index(contacts)
+        for sms in messages:
+            if get_message_key(sms) not in self.loaded:
+                self._append(sms, contacts)
 
     def add_messages(self, messages, contacts=None):
         """
@@ -47,32 +207,49 @@ class SMSStoreModel(ListStoreModel):
 
         See L{add_message} docs
         """
+        contacts = self._get_index(contacts)
         for sms in messages:
             self.add_message(sms, contacts)
 
+    def _get_index(self, contacts):
+        if contacts is None or isinstance(contacts, ContactIndex):
+            return contacts
+        return ContactIndex(contacts)
+
+    def _get_date_text(self, dt):
+        if not dt:
+            return ''
+        if dt.tzinfo is not None and self.tz is not None:
+            dt = dt.astimezone(self.tz)
+        return dt.strftime("%c")
+
     def _make_entry(self, message, contacts):
+        # only the first line is shown
+        text = message.text
+        if '\n' in text:
+            text = text[:text.index('\n')]
+
         if is_sim_message(message):
-            entry = [MOBILE_IMG, message.text.split('\n')[0]]
+            entry = [MOBILE_IMG, text]
         else:
-            entry = [COMPUTER_IMG, message.text.split('\n')[0]]
-
-        if contacts or contacts == []:
-            # this is only used at startup received as the return value
-            # of sconn.get_all_contacts(), an unmodified fresh copy of all
-            # the contacts, we use it instead of doing a lookup for each
-            # contact
-            match = [contact.name for contact in contacts
-                            if message.number == contact.get_number()]
-            if match:
-                entry.append(match[0])
-            else:
-                entry.append(message.number)
+            entry = [COMPUTER_IMG, text]
+
+        contacts = self._get_index(contacts)
+        if contacts:
+            # usually the index of the contacts treeview, so we don't have
+            # to look the number up in every backend for each message
+            name = contacts.get_name(message.number)
+            entry.append(name if name is not None else message.number)
 
         else: # no contacts received
             entry.append(message.number)
 
-        entry.append(message.datetime)
+        # sorting and drawing the rows won't call back into Python
+        entry.append(get_epoch(message.datetime))
         entry.append(message)
+        status = getattr(message, 'delivery_status', DELIVERY_NONE)
+        entry.append(DELIVERY_STATUS_TEXT[status])
+        entry.append(self._get_date_text(message.datetime))
 
         return entry
 
@@ -83,29 +260,76 @@ class SMSStoreModel(ListStoreModel):
         Whenever a new message is inserted, I lookup the number on the
         phonebook and will show the name instead of the number if its a
         contact. As this can be really expensive for mass insertions, such as
-        during startup, it also accepts a list of contacts to save the lookup.
+        during startup, it also accepts the contacts to save the lookup.
 
         @type message: L{wader.common.sms.ShortMessage}
-        @type contacts: list
+        @type contacts: L{ContactIndex} or list
         """
 
-        entry = self._make_entry(message, contacts)
-        self.append(entry)
+        if self.pager is not None and not self.pager.started and \
+                not is_sim_message(message):
+            # it's already in the DB, the first page will bring it
+            return
+
+        if get_message_key(message) in self.loaded:
+            # brought in by a search
+            return
+
+        self._append(message, contacts)
+
+    def _append(self, message, contacts):
+        _iter = self.append(self._make_entry(message, contacts))
+        self.loaded[get_message_key(message)] = _iter
 
     def update_message(self, _iter, message, contacts=None):
         """
         Updates the existing row specified by C{_iter} with the C{message}
         """
 
+        old = self.get_value(_iter, TV_SMS_OBJ)
+        self.loaded.pop(get_message_key(old), None)
+        self.loaded[get_message_key(message)] = _iter
+
         entry = self._make_entry(message, contacts)
         for column in range(len(entry)):
             self.set_value(_iter, column, entry[column])
 
+    def get_message_iter(self, message):
+        """Returns the iter of the row showing C{message} or None"""
+        return self.loaded.get(get_message_key(message))
+
+    def set_delivery_status(self, key, status):
+        """
+        Sets the delivery C{status} of the message with C{key}
+
+        Returns the message, None if it's not loaded
+        """
+        _iter = self.loaded.get(key)
+        if _iter is None:
+            return None
+
+        message = self.get_value(_iter, TV_SMS_OBJ)
+        message.delivery_status = status
+        self.set_value(_iter, TV_SMS_STATUS, DELIVERY_STATUS_TEXT[status])
+        return message
+
+    def replace_message(self, old, new, contacts=None):
+        """Shows C{new} instead of C{old}, e.g. once it's moved to the DB"""
+        _iter = self.get_message_iter(old)
+        if _iter is not None:
+            self.update_message(_iter, new, contacts)
+        elif self.pager is not None:
+            # not loaded yet, the page that would have brought it will
+            # bring its replacement from the DB
+            self.pager.sim_messages = [sms for sms in self.pager.sim_messages
+                                          if sms is not old]
+
     def update_contacts(self, contacts):
         """
         Iterates through the liststore updating the contacts
         """
 
+        contacts = self._get_index(contacts)
         if not contacts:
             return
 
@@ -113,12 +337,12 @@ class SMSStoreModel(ListStoreModel):
         while _iter:
             message = self.get_value(_iter, TV_SMS_OBJ)
 
-            match = [contact.name for contact in contacts
-                            if message.number == contact.get_number()]
-            if match:
-                self.set_value(_iter, TV_SMS_NUMBER, match[0])
-            else:
-                self.set_value(_iter, TV_SMS_NUMBER, message.number)
+            name = contacts.get_name(message.number)
+            if name is None:
+                name = message.number
+            # every change makes the view lay the row out again
+            if self.get_value(_iter, TV_SMS_NUMBER) != name:
+                self.set_value(_iter, TV_SMS_NUMBER, name)
 
             _iter = self.iter_next(_iter)
 
@@ -131,3 +355,85 @@ class SMSStoreModel(ListStoreModel):
             _iter = self.iter_next(_iter)
 
         return ret
+
+
+class ConversationStoreModel(ListStoreModel):
+    """
+    I list the conversations, the most recent first, a page at a time
+
+    Every row comes from the conversation summaries kept in the messages
+    DB, so the cost of a page doesn't depend on how many messages there
+    are.
+    """
+
+    def __init__(self):
+        super(ConversationStoreModel, self).__init__(TYPE_STRING,
+            TYPE_STRING, TYPE_STRING, TYPE_STRING, TYPE_PYOBJECT)
+        self.smanager = None
+        self.contacts = None
+        self.cursor = None
+        self.done = True
+        self.tz = None
+        try:
+            self.tz = gettz()
+        except:
+            pass
+
+    def load(self, smanager, contacts=None):
+        """Empties the model and loads the first page from C{smanager}"""
+        self.clear()
+        self.smanager = smanager
+        self.contacts = self._get_index(contacts)
+        self.cursor = None
+        self.done = False
+        self.load_page()
+
+    def load_page(self, limit=PAGE_SIZE):
+        """Loads the next page, returns the number of rows added"""
+        if self.done:
+            return 0
+
+        page, self.cursor = self.smanager.get_conversations_page(self.cursor,
+                                                                 limit)
+        self.done = len(page) < limit
+        for conversation in page:
+            self.append(self._make_entry(conversation))
+        return len(page)
+
+    def _get_index(self, contacts):
+        if contacts is None or isinstance(contacts, ContactIndex):
+            return contacts
+        return ContactIndex(contacts)
+
+    def _get_name(self, number):
+        name = None
+        if self.contacts:
+            name = self.contacts.get_name(number)
+        return name if name is not None else number
+
+    def _make_entry(self, conversation):
+        text = conversation.text
+        if '\n' in text:
+            text = text[:text.index('\n')]
+
+        if conversation.unread:
+            count = _('%(total)d (%(unread)d new)') % \
+                        dict(total=conversation.total,
+                             unread=conversation.unread)
+        else:
+            count = str(conversation.total)
+
+        date = datetime.fromtimestamp(conversation.date, self.tz)
+        return [self._get_name(conversation.number), text, count,
+                date.strftime("%c"), conversation]
+
+    def update_contacts(self, contacts):
+        """Shows the names of C{contacts} instead of their numbers"""
+        self.contacts = self._get_index(contacts)
+        _iter = self.get_iter_first()
+        while _iter:
+            conversation = self.get_value(_iter, TV_CONV_OBJ)
+            name = self._get_name(conversation.number)
+            if self.get_value(_iter, TV_CONV_NAME) != name:
+                self.set_value(_iter, TV_CONV_NAME, name)
+            _iter = self.iter_next(_iter)
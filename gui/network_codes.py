@@ -230,3 +230,75 @@ def get_customer_support_info(imsi):
         if imsi.startswith(net[0]):
             return net[1:]
     return None
+
+
+DIALING_CODES = [
+    # mcc, country calling code, national trunk prefix[, length of the
+    # national numbers, which are dialled without the trunk prefix too]
+    ('202', '30', ''),      # Greece
+    ('204', '31', '0'),     # Netherlands
+    ('206', '32', '0'),     # Belgium
+    ('208', '33', '0'),     # France
+    ('214', '34', ''),      # Spain
+    ('216', '36', '06'),    # Hungary
+    ('219', '385', '0'),    # Croatia
+    ('220', '381', '0'),    # Serbia
+    ('222', '39', ''),      # Italy, the leading 0 is part of the number
+    ('226', '40', '0'),     # Romania
+    ('228', '41', '0'),     # Switzerland
+    ('230', '420', ''),     # Czech Republic
+    ('231', '421', '0'),    # Slovakia
+    ('232', '43', '0'),     # Austria
+    ('234', '44', '0'),     # United Kingdom
+    ('235', '44', '0'),     # United Kingdom
+    ('238', '45', ''),      # Denmark
+    ('240', '46', '0'),     # Sweden
+    ('242', '47', ''),      # Norway
+    ('244', '358', '0'),    # Finland
+    ('246', '370', '8'),    # Lithuania
+    ('247', '371', ''),     # Latvia
+    ('248', '372', ''),     # Estonia
+    ('250', '7', '8'),      # Russia
+    ('255', '380', '0'),    # Ukraine
+    ('260', '48', ''),      # Poland
+    ('262', '49', '0'),     # Germany
+    ('268', '351', ''),     # Portugal
+    ('270', '352', ''),     # Luxembourg
+    ('272', '353', '0'),    # Ireland
+    ('274', '354', ''),     # Iceland
+    ('276', '355', '0'),    # Albania
+    ('278', '356', ''),     # Malta
+    ('280', '357', ''),     # Cyprus
+    ('284', '359', '0'),    # Bulgaria
+    ('286', '90', '0'),     # Turkey
+    ('288', '298', ''),     # Faroe Islands
+    ('293', '386', '0'),    # Slovenia
+    ('294', '389', '0'),    # Macedonia
+    ('302', '1', '1', 10),  # Canada
+    ('310', '1', '1', 10),  # USA
+    ('311', '1', '1', 10),  # USA
+    ('400', '994', '0'),    # Azerbaijan
+    ('404', '91', '0'),     # India
+    ('405', '91', '0'),     # India
+    ('424', '971', '0'),    # United Arab Emirates
+    ('427', '974', ''),     # Qatar
+    ('505', '61', '0'),     # Australia
+    ('530', '64', '0'),     # New Zealand
+    ('542', '679', ''),     # Fiji
+    ('602', '20', '0'),     # Egypt
+    ('620', '233', '0'),    # Ghana
+    ('639', '254', '0'),    # Kenya
+    ('655', '27', '0'),     # South Africa
+    ('730', '56', ''),      # Chile
+]
+
+
+def get_dialing_info(imsi):
+    """
+    Returns the (country code, trunk prefix, national length) of the
+    SIM's country, the length being None unless it's known
+    """
+    info = get_ussd_info(imsi, DIALING_CODES)
+    if not info:
+        return None
+    return (tuple(info[1:]) + (None,))[:3]
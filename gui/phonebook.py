@@ -22,6 +22,9 @@ phonebook presents a uniform layer to deal with contacts from all sources
 from gui.contacts import supported_types
 # just for now, we'll interrogate later
 from gui.contacts.contact_sim import SIMContactsManager
+from gui.contacts.snapshot import snapshots
+from gui.logger import logger
+from gui.pipeline import CallPipeline
 
 
 def all_same_type(l):
@@ -69,10 +72,18 @@ class PhoneBook(object):
 
     def __init__(self, device=None):
         self.device = device
+        # the backends being read in the background
+        self.loaders = []
 
     def close(self):
+        self._cancel_loaders()
         self.device = None
 
+    def _cancel_loaders(self):
+        for loader in self.loaders:
+            loader.cancel()
+        self.loaders = []
+
     def add_contact(self, contact, sim=False):
         if sim:
             manager = SIMContactsManager()
@@ -103,28 +114,210 @@ class PhoneBook(object):
             ret.extend(manager.get_contacts())
         return ret
 
-    def get_contacts_async(self, cb, eb):
+    def _get_snapshot(self, manager):
+        """Returns the contacts of C{manager}'s snapshot"""
+        rows = snapshots.load(manager.__class__.__name__)
+        return [manager.make_contact(name, number, index)
+                    for name, number, index in rows]
+
+    def _get_contacts(self, manager):
+        """Returns the contacts of C{manager}, read only if they changed"""
+        name = manager.__class__.__name__
+        fingerprint = manager.get_fingerprint()
+        if snapshots.get_fingerprint(name) == fingerprint:
+            return self._get_snapshot(manager)
+
+        contacts = manager.get_contacts()
+        snapshots.save(name, fingerprint, contacts)
+        return contacts
+
+    def get_contacts_async(self, cb, eb, chunk_cb=None, done_cb=None,
+                           stale_cb=None, imsi=None):
+        """
+        Fetches the contacts from all sources
+
+        Every backend keeps a snapshot of its contacts on disk, which is
+        used instead of reading it as long as its fingerprint does not
+        change, see L{snapshots}.
+
+        C{cb} is called with the SIM contacts and those of the desktop
+        backends, see L{get_sim_contacts_async} and
+        L{get_desktop_contacts_async} for the rest of the arguments.
+        """
+
+        def sim_cb(scontacts):
+            self.get_desktop_contacts_async(lambda dcontacts:
+                                                cb(scontacts + dcontacts),
+                                            chunk_cb, done_cb, stale_cb)
+
+        self.get_sim_contacts_async(sim_cb, eb, imsi)
+
+    def get_sim_contacts_async(self, cb, eb, imsi=None):
+        """
+        Calls C{cb} with the SIM contacts
+
+        The SIM is not read again while the C{imsi} is the same.
+        """
         sim_manager = SIMContactsManager()
         sim_manager.set_device(self.device)
 
-        def _cb(scontacts):
-            ret = scontacts
+        name = SIMContactsManager.__name__
+        if imsi is not None and snapshots.get_fingerprint(name) == imsi:
+            cb(self._get_snapshot(sim_manager))
+            return
 
-            for cclass, mclass in supported_types:
-                manager = mclass()
-                if manager.device_reqd():  # SIM
-                    continue
-                ret.extend(manager.get_contacts())
+        def sim_cb(scontacts):
+            if imsi is not None:
+                snapshots.save(name, imsi, scontacts)
+            cb(scontacts)
+
+        sim_manager.get_contacts_async(sim_cb, eb)
+
+    def get_desktop_contacts_async(self, cb, chunk_cb=None, done_cb=None,
+                                   stale_cb=None):
+        """
+        Fetches the contacts from the backends other than the SIM
+
+        The backends that are slow to read (Evolution) are read in the
+        background. If C{chunk_cb} is given, C{cb} is called with the
+        other contacts as soon as they are read, C{chunk_cb(contacts)}
+        as the background ones arrive and C{done_cb()} once all of them
+        have. If C{stale_cb} is given too, C{cb} gets the snapshot of the
+        background backends right away, and C{stale_cb(contact_class)} is
+        called for a backend before its contacts are handed again: before
+        C{cb} if it has no snapshot, or once it turns out to have changed.
+        Without C{chunk_cb}, C{cb} is called once with every contact. A new
+        call cancels the background reads of the previous one.
+        """
+        self._cancel_loaders()
+        progressive = chunk_cb is not None
+
+        ret = []
+        managers = []
+        for cclass, mclass in supported_types:
+            manager = mclass()
+            if manager.device_reqd():  # SIM
+                continue
+            if hasattr(manager, 'get_contacts_async'):
+                managers.append((cclass, manager))
+            else:
+                ret.extend(self._get_contacts(manager))
+
+        if not managers:
             cb(ret)
+            if done_cb is not None:
+                done_cb()
+            return
 
-        sim_manager.get_contacts_async(_cb, eb)
+        pending = [len(managers)]
 
-    def delete_objs(self, objs):
-        return self.delete_contacts(objs)
+        def loader_done():
+            pending[0] -= 1
+            if pending[0]:
+                return
+            if not progressive:
+                cb(ret)
+            if done_cb is not None:
+                done_cb()
 
-    def delete_contacts(self, clist):
-        for contact in clist:
-            self.delete_contact(contact)
+        def start(cclass, manager):
+            name = manager.__class__.__name__
+            known = snapshots.get_fingerprint(name)
+            cached = []
+            if known is not None:
+                cached = self._get_snapshot(manager)
+            # whether the snapshot is being shown, until it's stale
+            shown = [progressive and stale_cb is not None and
+                     known is not None]
+            if shown[0]:
+                ret.extend(cached)
+            elif progressive and stale_cb is not None:
+                # nothing to show, what was there stays until it's read
+                stale_cb(cclass)
+            live = []
+
+            def forget_shown():
+                if shown[0]:
+                    shown[0] = False
+                    stale_cb(cclass)
+
+            def on_chunk(contacts):
+                forget_shown()
+                live.extend(contacts)
+                if progressive:
+                    chunk_cb(contacts)
+
+            def on_done(fingerprint, changed):
+                if changed:
+                    forget_shown()
+                    if fingerprint is None:
+                        snapshots.invalidate(name)
+                    else:
+                        snapshots.save(name, fingerprint, live)
+                    if not progressive:
+                        ret.extend(live)
+                elif not progressive:
+                    ret.extend(cached)
+                elif not shown[0]:
+                    chunk_cb(cached)
+                loader_done()
+
+            self.loaders.append(
+                manager.get_contacts_async(on_chunk, on_done, known=known))
+
+        for cclass, manager in managers:
+            start(cclass, manager)
+
+        if progressive:
+            # the loaders answer from the main loop, after this
+            cb(ret)
+
+    def delete_objs(self, objs, cb=None):
+        return self.delete_contacts(objs, cb)
+
+    def delete_contacts(self, clist, cb=None):
+        """
+        Deletes C{clist}, using a single manager per backend
+
+        The SIM contacts are deleted asynchronously, a few at a time.
+        Once every contact is gone C{cb} is called with a (contact, error)
+        tuple per contact, C{error} being None for those deleted.
+        """
+        results = []
+        sim_manager = None
+        for cclass, mclass in supported_types:
+            contacts = [c for c in clist if isinstance(c, cclass)]
+            if not contacts:
+                continue
+
+            manager = mclass()
+            if manager.device_reqd():
+                # the SIM ones are deleted below
+                manager.set_device(self.device)
+                sim_manager, sim_contacts = manager, contacts
+                continue
+
+            for contact in contacts:
+                if manager.delete_contact(contact):
+                    results.append((contact, None))
+                else:
+                    results.append((contact,
+                                    ValueError("Cannot delete %r" % contact)))
+
+        def done_cb(sim_results):
+            for contact, error in results + sim_results:
+                if error is not None:
+                    logger.error("Error deleting contact %r: %s"
+                                 % (contact, error))
+            if cb is not None:
+                cb(results + sim_results)
+
+        if sim_manager is None:
+            done_cb([])
+        else:
+            pipeline = CallPipeline(sim_manager.delete_contact_async,
+                                    done_cb=done_cb)
+            pipeline.start(sim_contacts)
 
     def delete_contact(self, contact):
         for cclass, mclass in supported_types:
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+pipeline issues asynchronous calls to the device a few at a time
+"""
+
+import time
+
+from gui.logger import logger
+
+# calls in flight at once, the modem answers them one after the other
+# anyway, but this way it always has the next one at hand
+MAX_PENDING = 4
+
+
+class CallPipeline(object):
+    """
+    I make one asynchronous call per item, keeping C{max_pending} in flight
+
+    C{call(item, reply_handler, error_handler)} issues the call for an
+    item. C{item_cb(item, error)} is called as every call is answered,
+    C{error} being None if it succeeded, and C{done_cb(results)} once all
+    of them have been, with the (item, error) tuples in the order they
+    were answered.
+    """
+
+    def __init__(self, call, item_cb=None, done_cb=None,
+                 max_pending=MAX_PENDING):
+        super(CallPipeline, self).__init__()
+        self.call = call
+        self.item_cb = item_cb
+        self.done_cb = done_cb
+        self.max_pending = max_pending
+        self.queue = []
+        self.pending = 0
+        self.results = []
+
+    def start(self, items):
+        self.queue.extend(items)
+        if self.queue:
+            self._call_next()
+        elif not self.pending and self.done_cb is not None:
+            self.done_cb(self.results)
+
+    def _call_next(self):
+        while self.queue and self.pending < self.max_pending:
+            self.pending += 1
+            self._call(self.queue.pop(0))
+
+    def _call(self, item):
+        try:
+            self.call(item, lambda *args: self._answered(item, None),
+                      lambda e: self._answered(item, e))
+        except Exception, e:
+            # a call that can't even be issued (say the device is gone)
+            # fails its item, rather than leaving it pending forever
+            self._answered(item, e)
+
+    def _answered(self, item, error):
+        self.pending -= 1
+        self.results.append((item, error))
+        if self.item_cb is not None:
+            self.item_cb(item, error)
+
+        if self.queue:
+            self._call_next()
+        elif not self.pending and self.done_cb is not None:
+            self.done_cb(self.results)
+
+
+class StageBarrier(object):
+    """
+    I run several asynchronous stages at once and wait for all of them
+
+    C{add(name, call, cb)} registers a stage, C{call(reply_handler,
+    error_handler)} starting it once L{start} is called. As soon as a
+    stage is answered C{cb(result)} is called with what the reply handler
+    got, so each result is used as soon as it is ready, and once every
+    stage has finished C{done_cb(timings)} is, with the (name, seconds)
+    of every stage in the order they were added. How long each stage
+    took is logged, to tell what a slow C{name} is waiting on.
+    """
+
+    def __init__(self, name, done_cb=None):
+        super(StageBarrier, self).__init__()
+        self.name = name
+        self.done_cb = done_cb
+        # name, call, cb
+        self.stages = []
+        self.started = {}
+        self.timings = {}
+        self.start_time = None
+
+    def add(self, name, call, cb=None):
+        self.stages.append((name, call, cb))
+
+    def start(self):
+        self.start_time = time.time()
+        for name, call, cb in self.stages:
+            self.started[name] = time.time()
+            self._call(name, call, cb)
+
+        if not self.stages:
+            self._finish()
+
+    def _call(self, name, call, cb):
+        call(lambda result=None: self._answered(name, cb, result),
+             lambda e: self._failed(name, e))
+
+    def _answered(self, name, cb, result):
+        if cb is not None:
+            cb(result)
+        self._stage_done(name)
+
+    def _failed(self, name, error):
+        logger.error("%s: %s failed: %s" % (self.name, name, error))
+        self._stage_done(name)
+
+    def _stage_done(self, name):
+        if name in self.timings:
+            # answered twice, keep the first
+            return
+
+        self.timings[name] = time.time() - self.started[name]
+        logger.info("%s: %s took %.3fs" % (self.name, name,
+                                           self.timings[name]))
+        if len(self.timings) == len(self.stages):
+            self._finish()
+
+    def _finish(self):
+        logger.info("%s took %.3fs" % (self.name,
+                                       time.time() - self.start_time))
+        if self.done_cb is not None:
+            self.done_cb([(name, self.timings[name])
+                            for name, call, cb in self.stages])
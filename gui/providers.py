@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+providers keeps the database handles shared by the whole process
+"""
+
+import sqlite3
+
+from wader.common import provider
+
+from gui.logger import logger
+
+# (provider name, args) -> times it has been opened this session
+_opens = {}
+
+
+def _count_open(name, args):
+    key = (name, args)
+    _opens[key] = _opens.get(key, 0) + 1
+    if _opens[key] > 1:
+        logger.warn("%s%r opened %d times, is somebody bypassing the pool?"
+                    % (name, args, _opens[key]))
+    else:
+        logger.debug("Opening %s%r" % (name, args))
+
+
+def _counted(provider_class):
+    """Returns C{provider_class} counting how many times it's opened"""
+
+    class CountedProvider(provider_class):
+
+        def __init__(self, *args, **kwargs):
+            _count_open(provider_class.__name__, args)
+            provider_class.__init__(self, *args, **kwargs)
+
+    CountedProvider.__name__ = provider_class.__name__
+    return CountedProvider
+
+# the providers to open, whether through the pool or not
+NetworkProvider = _counted(provider.NetworkProvider)
+SmsProvider = _counted(provider.SmsProvider)
+UsageProvider = _counted(provider.UsageProvider)
+
+
+class Connection(sqlite3.Connection):
+    """
+    I am a plain SQLite connection for the tables that are only ours
+
+    I am counted like the providers above, so I am opened once per
+    database: through the pool, or by a handle of the pool.
+    """
+
+    def __init__(self, path, isolation_level='', detect_types=0):
+        _count_open(self.__class__.__name__,
+                    (path, isolation_level, detect_types))
+        sqlite3.Connection.__init__(self, path,
+                                    isolation_level=isolation_level,
+                                    detect_types=detect_types)
+
+
+def get_open_counts():
+    """
+    Returns how many times every kind of handle has been opened
+
+    The handles of the pool are opened once, a count greater than the
+    number of databases of a kind means somebody is opening it directly.
+    """
+    counts = {}
+    for (name, args), count in _opens.iteritems():
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+class ProviderPool(object):
+    """
+    I hand out one long-lived handle per database
+
+    Opening a provider reconnects to SQLite and checks its schema, so
+    rather than opening one per operation every user gets the same handle,
+    which is closed once by L{close_all} when the application quits. The
+    providers above count every time they are opened, see
+    L{get_open_counts}.
+    """
+
+    def __init__(self):
+        super(ProviderPool, self).__init__()
+        # (factory, args) -> handle
+        self.handles = {}
+
+    def get(self, factory, *args):
+        """Returns the shared C{factory(*args)} handle, opening it if needed"""
+        key = (factory, args)
+        if key not in self.handles:
+            self.handles[key] = factory(*args)
+
+        return self.handles[key]
+
+    def close_all(self):
+        for (factory, args), handle in self.handles.items():
+            try:
+                handle.close()
+            except Exception, e:
+                logger.error("Error closing %s%r: %s"
+                             % (factory.__name__, args, e))
+        self.handles = {}
+
+        logger.info("Database handles opened this session: %r"
+                    % get_open_counts())
+
+
+pool = ProviderPool()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+segments counts the parts a text takes when sent as SMS
+"""
+
+from messaging.sms.consts import (SEVENBIT_SIZE, UCS2_SIZE,
+                                  SEVENBIT_MP_SIZE, UCS2_MP_SIZE)
+
+# the GSM 03.38 default alphabet, one septet each
+GSM_BASIC = frozenset(u"@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./"
+                      u"0123456789:;<=>?¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿"
+                      u"abcdefghijklmnopqrstuvwxyzäöñüà")
+# its extension table, escaped so they take two septets
+GSM_EXTENDED = frozenset(u"\x0c^{}\\[~]|€")
+
+
+def _to_unicode(text):
+    if isinstance(text, str):
+        return text.decode('utf8', 'replace')
+    return text
+
+
+def _is_high_surrogate(c):
+    # narrow builds hold characters out of the BMP as two code units
+    return u'\ud800' <= c <= u'\udbff'
+
+
+def _iter_widths(text, gsm):
+    """
+    Yields the septets (if C{gsm}) or UCS-2 units of every character of
+    C{text} that can't be split across parts
+    """
+    text = _to_unicode(text)
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        i += 1
+        if gsm:
+            yield c in GSM_EXTENDED and 2 or 1
+        elif ord(c) > 0xffff:
+            yield 2
+        elif _is_high_surrogate(c) and i < n:
+            i += 1
+            yield 2
+        else:
+            yield 1
+
+
+class SegmentCounter(object):
+    """
+    I count the characters and parts of a text as it is edited
+
+    Rather than encoding the whole text on every keystroke, I'm told
+    what is inserted and deleted and keep the totals the length depends
+    on: the characters, how many of them take two GSM-7 septets and how
+    many are not in the GSM-7 alphabet at all, which forces UCS-2. Every
+    edit costs as much as the text it adds or removes.
+
+    An escape pair or a surrogate pair is never split across parts, so a
+    multipart text holding any may need more parts than its length says.
+    Only then is the whole text, as returned by C{get_text()}, walked to
+    tell where every part ends, once per edit: the part lengths are kept
+    until the next insert or delete.
+    """
+
+    def __init__(self, text=u'', get_text=None):
+        super(SegmentCounter, self).__init__()
+        self.get_text = get_text
+        # UCS-2 code units
+        self.units = 0
+        # characters from the GSM-7 extension table
+        self.extended = 0
+        # characters missing from GSM-7
+        self.non_gsm = 0
+        # characters taking a UCS-2 surrogate pair
+        self.surrogates = 0
+        # length of every part, None until asked for after an edit
+        self.part_lengths = None
+        self.insert(text)
+
+    def _count(self, text):
+        units = extended = non_gsm = surrogates = 0
+        for c in _to_unicode(text):
+            # characters out of the BMP take a surrogate pair
+            units += ord(c) > 0xffff and 2 or 1
+            if c in GSM_BASIC:
+                continue
+            if c in GSM_EXTENDED:
+                extended += 1
+            else:
+                non_gsm += 1
+            if ord(c) > 0xffff or _is_high_surrogate(c):
+                surrogates += 1
+        return units, extended, non_gsm, surrogates
+
+    def insert(self, text):
+        units, extended, non_gsm, surrogates = self._count(text)
+        self.units += units
+        self.extended += extended
+        self.non_gsm += non_gsm
+        self.surrogates += surrogates
+        self.part_lengths = None
+
+    def delete(self, text):
+        units, extended, non_gsm, surrogates = self._count(text)
+        self.units -= units
+        self.extended -= extended
+        self.non_gsm -= non_gsm
+        self.surrogates -= surrogates
+        self.part_lengths = None
+
+    def is_gsm(self):
+        """Returns True if the text can be sent with the GSM-7 alphabet"""
+        return not self.non_gsm
+
+    def get_length(self):
+        """Returns the length of the text in septets or UCS-2 units"""
+        if self.is_gsm():
+            return self.units + self.extended
+        return self.units
+
+    def get_part_size(self):
+        """Returns how long each part can be"""
+        if self.is_gsm():
+            single, multi = SEVENBIT_SIZE, SEVENBIT_MP_SIZE
+        else:
+            single, multi = UCS2_SIZE, UCS2_MP_SIZE
+        return self.get_length() > single and multi or single
+
+    def _has_pairs(self):
+        if self.is_gsm():
+            return self.extended > 0
+        return self.surrogates > 0
+
+    def _get_part_lengths(self):
+        """Returns the length of every part of the text"""
+        if self.part_lengths is None:
+            self.part_lengths = self._split()
+        return self.part_lengths
+
+    def _split(self):
+        size = self.get_part_size()
+        length = self.get_length()
+        if length <= size or not self._has_pairs() or self.get_text is None:
+            parts = max(1, (length + size - 1) / size)
+            return [size] * (parts - 1) + [length - (parts - 1) * size]
+
+        lengths = [0]
+        for width in _iter_widths(self.get_text(), self.is_gsm()):
+            if lengths[-1] + width > size:
+                lengths.append(0)
+            lengths[-1] += width
+        return lengths
+
+    def get_parts(self):
+        """Returns the number of SMS the text takes, 1 if empty"""
+        return len(self._get_part_lengths())
+
+    def get_last_part_length(self):
+        """Returns the length of the text in the last part"""
+        return self._get_part_lengths()[-1]
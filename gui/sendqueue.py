@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+sendqueue sends the outgoing messages stored in the messages DB
+"""
+
+from datetime import datetime
+import time
+
+from dateutil.tz import tzutc
+from gobject import timeout_add, source_remove
+
+from wader.common.consts import SMS_INTFACE
+
+from gui.consts import CFG_PREFS_DEFAULT_SMS_SEND_WINDOW
+from gui.logger import logger
+from gui.messages import QueuedSMS
+from gui.utils import get_error_msg
+
+# attempts before giving up on a message that keeps failing
+MAX_ATTEMPTS = 5
+# seconds until the first retry, doubled after every failure
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 300
+
+# errors worth retrying, the message itself is fine
+TRANSIENT_ERRORS = ['NoReply', 'Timeout', 'SerialSendFailed', 'NoNetwork',
+                    'NetworkNotAllowed', 'SimBusy']
+
+
+def is_transient_error(e):
+    msg = get_error_msg(e) or ''
+    for name in TRANSIENT_ERRORS:
+        if name in msg:
+            return True
+    return False
+
+
+class SendQueue(object):
+    """
+    I send the messages waiting in the send queue of the messages DB
+
+    At most C{window} messages are handed to the device at once, the rest
+    wait for one of them to be answered. Messages failing with a transient
+    error are retried later, with an exponential backoff, and nothing is
+    sent while I have no device, i.e. while the modem is not registered.
+    A message is marked as sent in the queue before it is saved to the sent
+    folder, so it is saved once, and the queue survives restarts. The
+    messages given up on are moved back to the drafts folder.
+
+    C{sent_cb(msg, sms)} is called with the new sent folder message and
+    the queued one, and C{progress_cb(processed, total)} as messages are
+    processed, with None once the queue is empty. The messages given up
+    on are reported together once the queue is empty or held, calling
+    C{failed_cb(failures)} with a (draft, sms, error) tuple per message,
+    C{draft} being None if it could not be saved.
+    """
+
+    def __init__(self, smanager, sent_cb=None, failed_cb=None,
+                 progress_cb=None, window=CFG_PREFS_DEFAULT_SMS_SEND_WINDOW):
+        super(SendQueue, self).__init__()
+        self.smanager = smanager
+        self.sent_cb = sent_cb
+        self.failed_cb = failed_cb
+        self.progress_cb = progress_cb
+        self.window = max(1, window)
+        self.device = None
+        # messages waiting their turn, oldest first
+        self.queue = smanager.get_queued_messages()
+        # index -> message handed to the device
+        self.in_flight = {}
+        self.retry_id = None
+        # progress since the queue was last empty
+        self.processed = 0
+        self.total = len(self.queue)
+        # messages given up on and not reported yet
+        self.failures = []
+
+        if self.queue:
+            logger.info("%d messages waiting to be sent" % len(self.queue))
+
+    def __len__(self):
+        return len(self.queue) + len(self.in_flight)
+
+    def set_device(self, device):
+        """Sends through C{device} from now on, holds the queue if None"""
+        self.device = device
+        if device is None:
+            self._cancel_retry()
+            self._report_failures()
+        else:
+            self._send_next()
+
+    def enqueue(self, numbers, text, smsc=None, msgvp=None,
+                status_request=False):
+        """
+        Queues C{text} for every number in C{numbers}
+
+        Returns the queued messages, the DB error is raised if they could
+        not be stored.
+        """
+        now = int(time.time())
+        queued = [QueuedSMS(number, text, smsc, msgvp, status_request,
+                            date=now) for number in numbers]
+        self.smanager.queue_messages(queued)
+
+        self.queue.extend(queued)
+        self.total += len(queued)
+        self._notify_progress()
+        self._send_next()
+        return queued
+
+    def _send_next(self):
+        if self.device is None:
+            return
+
+        now = time.time()
+        while len(self.in_flight) < self.window:
+            # the device might answer right away and change the queue
+            due = [sms for sms in self.queue if sms.next_attempt <= now]
+            if not due:
+                break
+            sms = due[0]
+            self.queue.remove(sms)
+            self.in_flight[sms.index] = sms
+            self._send(sms)
+
+        self._schedule_retry()
+
+    def _send(self, sms):
+        # sms is bound per call, every answer finds its own message
+        self.device.Send(sms.get_params(), dbus_interface=SMS_INTFACE,
+                         reply_handler=lambda ref: self._sent(sms, ref),
+                         error_handler=lambda e: self._failed(sms, e))
+
+    def _answered(self, sms):
+        # the device might answer a message twice, only the first counts
+        if self.in_flight.pop(sms.index, None) is None:
+            logger.warn("SMS %d answered twice, ignoring it" % sms.index)
+            return False
+        return True
+
+    def _sent(self, sms, ref):
+        if not self._answered(sms):
+            return
+        reference = int(ref[0]) if len(ref) else None
+        msg = self.smanager.complete_queued_message(sms,
+                                        datetime.now(tzutc()), reference)
+        if msg is not None and self.sent_cb is not None:
+            self.sent_cb(msg, sms)
+
+        self.processed += 1
+        self._notify_progress()
+        self._send_next()
+
+    def _failed(self, sms, error):
+        if not self._answered(sms):
+            return
+        sms.attempts += 1
+
+        if is_transient_error(error) and sms.attempts < MAX_ATTEMPTS:
+            delay = min(RETRY_DELAY * 2 ** (sms.attempts - 1),
+                        MAX_RETRY_DELAY)
+            logger.warn("Error sending SMS to %s, retrying in %ds: %s"
+                        % (sms.number, delay, get_error_msg(error)))
+            sms.next_attempt = time.time() + delay
+            self.smanager.reschedule_queued_message(sms)
+            self.queue.append(sms)
+        else:
+            logger.error("Error sending SMS to %s, giving up: %s"
+                         % (sms.number, get_error_msg(error)))
+            draft = self.smanager.fail_queued_message(sms)
+            self.failures.append((draft, sms, error))
+            self.processed += 1
+            self._notify_progress()
+
+        self._send_next()
+
+    def _schedule_retry(self):
+        self._cancel_retry()
+        # a free slot is needed, otherwise the next answer will do
+        if not self.queue or len(self.in_flight) >= self.window:
+            return
+
+        delay = min([sms.next_attempt for sms in self.queue]) - time.time()
+        self.retry_id = timeout_add(max(0, int(delay * 1000)) + 1,
+                                    self._on_retry_timeout)
+
+    def _cancel_retry(self):
+        if self.retry_id is not None:
+            source_remove(self.retry_id)
+            self.retry_id = None
+
+    def _on_retry_timeout(self):
+        self.retry_id = None
+        self._send_next()
+        return False
+
+    def _notify_progress(self):
+        if not self.queue and not self.in_flight:
+            self.processed = self.total = 0
+            self._report_failures()
+            if self.progress_cb is not None:
+                self.progress_cb(None)
+        elif self.progress_cb is not None:
+            self.progress_cb(self.processed, self.total)
+
+    def _report_failures(self):
+        failures, self.failures = self.failures, []
+        if failures and self.failed_cb is not None:
+            self.failed_cb(failures)
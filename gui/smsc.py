@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+smsc resolves the SMSC messages are sent through, once per SIM
+"""
+
+from wader.common.consts import SMS_INTFACE
+
+from gui.logger import logger
+from gui.providers import pool, NetworkProvider
+
+# where an SMSC was found
+SMSC_PREFERENCES, SMSC_NETWORKS_DB, SMSC_SIM = range(3)
+
+SMSC_SOURCES = {
+    SMSC_PREFERENCES: 'preferences',
+    SMSC_NETWORKS_DB: 'networks DB',
+    SMSC_SIM: 'SIM',
+}
+
+
+class SMSCCache(object):
+    """
+    I remember the SMSC of every SIM and where it was found
+
+    The SMSC is taken from the preferences, the networks DB or the SIM,
+    in that order. The first send resolves it and the following ones get
+    it from me, without touching the DB or the modem. L{invalidate} must
+    be called when the SMSC preferences change or the SIM is swapped.
+    """
+
+    def __init__(self):
+        super(SMSCCache, self).__init__()
+        # IMSI -> (SMSC, source)
+        self.resolved = {}
+        # IMSI -> SMSC in the networks DB, None if there's none
+        self.networks = {}
+
+    def get(self, imsi):
+        """Returns the (SMSC, source) resolved for C{imsi} or None"""
+        return self.resolved.get(imsi)
+
+    def get_network_smsc(self, imsi):
+        """Returns the SMSC of C{imsi}'s network in the networks DB"""
+        if not imsi:
+            return None
+
+        if imsi not in self.networks:
+            try:
+                nets = pool.get(NetworkProvider).get_network_by_id(imsi)
+            except (TypeError, ValueError):
+                nets = []
+            self.networks[imsi] = nets[0].smsc if nets else None
+
+        return self.networks[imsi]
+
+    def resolve(self, conf, imsi, device, cb, eb):
+        """
+        Calls C{cb} with the SMSC to use with C{imsi}, C{eb} if unknown
+
+        @param conf: the configuration holding the SMSC preferences
+        @param device: the device asked if neither the preferences nor
+                       the networks DB know the SMSC
+        """
+        cached = self.resolved.get(imsi)
+        if cached is not None:
+            cb(cached[0])
+            return
+
+        def found(smsc, source):
+            logger.info("SMSC used from %s" % SMSC_SOURCES[source])
+            # without an IMSI we can't tell if the SIM is swapped
+            if imsi:
+                self.resolved[imsi] = (smsc, source)
+            cb(smsc)
+
+        if conf.get('preferences', 'use_alternate_smsc', False):
+            smsc = conf.get('preferences', 'smsc_number', None)
+            if smsc is not None:
+                found(smsc, SMSC_PREFERENCES)
+                return
+
+        smsc = self.get_network_smsc(imsi)
+        if smsc is not None:
+            found(smsc, SMSC_NETWORKS_DB)
+            return
+
+        device.GetSmsc(dbus_interface=SMS_INTFACE,
+                       reply_handler=lambda smsc: found(smsc, SMSC_SIM),
+                       error_handler=eb)
+
+    def invalidate(self, imsi=None):
+        """Forgets the SMSC of C{imsi}, of every SIM if None"""
+        if imsi is None:
+            self.resolved = {}
+            self.networks = {}
+        else:
+            self.resolved.pop(imsi, None)
+            self.networks.pop(imsi, None)
+
+
+smsc_cache = SMSCCache()
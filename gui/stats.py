@@ -195,3 +195,62 @@ class StatsBar(gtk.Object):
             self.user_limit = user_limit
 
             self.update()
+
+
+class RateGraph(gtk.Object):
+    """Sparkline of the last minute of a L{ThroughputHistory}"""
+
+    def __init__(self, history, width=60, height=16, drawingarea=None):
+        self.history = history
+        self.drawingarea = gtk.DrawingArea() \
+            if drawingarea is None else drawingarea
+        self.drawingarea.set_size_request(width, height)
+        self.drawingarea.connect('expose-event', self.on_expose)
+
+    def DrawingArea(self):
+        return self.drawingarea
+
+    def on_expose(self, widget, event):
+        if not widget.window:
+            return
+
+        cr = widget.window.cairo_create()
+        x, y, width, height = widget.get_allocation()
+
+        cr.set_source_rgba(.8, 0.8, 0.8, 0.4)
+        cr.rectangle(0, 0, width, height)
+        cr.fill()
+
+        history = self.history
+        window = history.last_minute
+        peak = max(window.rx_peak, window.tx_peak)
+        if not len(history) or not peak:
+            return False
+
+        cr.set_line_width(1.0)
+        self.draw_rates(cr, history.rx_rates, peak, width, height)
+        cr.set_source_rgba(0.2, 0.4, 0.8, 0.9)
+        cr.stroke()
+        self.draw_rates(cr, history.tx_rates, peak, width, height)
+        cr.set_source_rgba(0.8, 0.3, 0.2, 0.9)
+        cr.stroke()
+
+        return False
+
+    def draw_rates(self, cr, rates, peak, width, height):
+        # one pixel per sample, newest on the right
+        history = self.history
+        held = len(history)
+        samples = min(held, width)
+        scale = (height - 1.0) / peak
+        for i in xrange(samples):
+            rate = rates[history.get_slot(held - samples + i)]
+            px = width - samples + i + 0.5
+            py = height - 0.5 - rate * scale
+            if i:
+                cr.line_to(px, py)
+            else:
+                cr.move_to(px, py)
+
+    def update(self):
+        self.drawingarea.queue_draw()
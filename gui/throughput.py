@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+throughput keeps a fixed size history of the transfer rates of a session
+"""
+
+from array import array
+
+# enough for fifteen minutes of SIG_DIAL_STATS ticks
+HISTORY_SIZE = 1024
+
+WINDOW_1M = 60
+WINDOW_15M = 15 * 60
+
+
+class _MonotonicQueue(object):
+    """
+    Sample numbers whose values are monotonic, the head being the extreme
+
+    Used to get the min or peak of a sliding window in amortized O(1)
+    """
+
+    def __init__(self, values, size, peak):
+        self.values = values
+        self.size = size
+        self.peak = peak
+        self.queue = array('l', [0] * size)
+        self.head = self.tail = 0
+
+    def reset(self):
+        self.head = self.tail = 0
+
+    def push(self, n):
+        values, size, queue = self.values, self.size, self.queue
+        value = values[n % size]
+        while self.tail > self.head:
+            last = values[queue[(self.tail - 1) % size] % size]
+            if (last > value) if self.peak else (last < value):
+                break
+            self.tail -= 1
+        queue[self.tail % self.size] = n
+        self.tail += 1
+
+    def expire(self, first):
+        while self.head < self.tail and \
+                self.queue[self.head % self.size] < first:
+            self.head += 1
+
+    def get(self):
+        if self.head == self.tail:
+            return 0.0
+        return self.values[self.queue[self.head % self.size] % self.size]
+
+
+class RateWindow(object):
+    """
+    Min, average and peak rates over the last C{span} seconds
+
+    A C{span} of None covers the whole session
+    """
+
+    def __init__(self, history, span=None):
+        self.history = history
+        self.span = span
+
+        size = history.size
+        self._rx_min = _MonotonicQueue(history.rx_rates, size, False)
+        self._rx_peak = _MonotonicQueue(history.rx_rates, size, True)
+        self._tx_min = _MonotonicQueue(history.tx_rates, size, False)
+        self._tx_peak = _MonotonicQueue(history.tx_rates, size, True)
+        self.reset()
+
+    def reset(self):
+        self.first = 0
+        self.count = 0
+        self.rx_sum = self.tx_sum = 0.0
+        # the session window doesn't depend on the samples still held
+        self.session_rx_min = self.session_tx_min = None
+        self.session_rx_peak = self.session_tx_peak = 0.0
+        for queue in [self._rx_min, self._rx_peak,
+                      self._tx_min, self._tx_peak]:
+            queue.reset()
+
+    def _evict(self, first):
+        size = self.history.size
+        while self.first < first:
+            slot = self.first % size
+            self.rx_sum -= self.history.rx_rates[slot]
+            self.tx_sum -= self.history.tx_rates[slot]
+            self.count -= 1
+            self.first += 1
+
+        for queue in [self._rx_min, self._rx_peak,
+                      self._tx_min, self._tx_peak]:
+            queue.expire(first)
+
+    def make_room(self, n):
+        """Drops sample C{n - size} as its slot is about to be reused"""
+        if self.span is not None:
+            self._evict(max(self.first, n - self.history.size + 1))
+
+    def push(self, n, now):
+        slot = n % self.history.size
+        rx = self.history.rx_rates[slot]
+        tx = self.history.tx_rates[slot]
+
+        self.rx_sum += rx
+        self.tx_sum += tx
+        self.count += 1
+
+        if self.span is None:
+            if self.session_rx_min is None or rx < self.session_rx_min:
+                self.session_rx_min = rx
+            if self.session_tx_min is None or tx < self.session_tx_min:
+                self.session_tx_min = tx
+            self.session_rx_peak = max(self.session_rx_peak, rx)
+            self.session_tx_peak = max(self.session_tx_peak, tx)
+            return
+
+        for queue in [self._rx_min, self._rx_peak,
+                      self._tx_min, self._tx_peak]:
+            queue.push(n)
+
+        # expire what's older than our span
+        times, size = self.history.times, self.history.size
+        first = self.first
+        while first < n and times[first % size] < now - self.span:
+            first += 1
+        self._evict(first)
+
+    @property
+    def rx_avg(self):
+        return self.rx_sum / self.count if self.count else 0.0
+
+    @property
+    def tx_avg(self):
+        return self.tx_sum / self.count if self.count else 0.0
+
+    @property
+    def rx_min(self):
+        if self.span is None:
+            return self.session_rx_min or 0.0
+        return self._rx_min.get()
+
+    @property
+    def tx_min(self):
+        if self.span is None:
+            return self.session_tx_min or 0.0
+        return self._tx_min.get()
+
+    @property
+    def rx_peak(self):
+        if self.span is None:
+            return self.session_rx_peak
+        return self._rx_peak.get()
+
+    @property
+    def tx_peak(self):
+        if self.span is None:
+            return self.session_tx_peak
+        return self._tx_peak.get()
+
+
+class ThroughputHistory(object):
+    """
+    I keep the last C{size} rate samples of a session in a ring buffer
+
+    Samples are stored in preallocated arrays, so adding one does not
+    allocate, and the aggregates of every window are updated as samples
+    come and go rather than being recomputed.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        super(ThroughputHistory, self).__init__()
+        self.size = size
+        self.times = array('d', [0.0] * size)
+        self.rx_rates = array('d', [0.0] * size)
+        self.tx_rates = array('d', [0.0] * size)
+        self.rx_bytes = array('d', [0.0] * size)
+        self.tx_bytes = array('d', [0.0] * size)
+        # number of samples added so far
+        self.count = 0
+
+        self.last_minute = RateWindow(self, WINDOW_1M)
+        self.last_quarter = RateWindow(self, WINDOW_15M)
+        self.session = RateWindow(self)
+        self.windows = [self.last_minute, self.last_quarter, self.session]
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def reset(self):
+        self.count = 0
+        for window in self.windows:
+            window.reset()
+
+    def add_sample(self, now, rx_rate, tx_rate, rx_bytes, tx_bytes):
+        n = self.count
+        for window in self.windows:
+            window.make_room(n)
+
+        slot = n % self.size
+        self.times[slot] = now
+        self.rx_rates[slot] = rx_rate
+        self.tx_rates[slot] = tx_rate
+        self.rx_bytes[slot] = rx_bytes
+        self.tx_bytes[slot] = tx_bytes
+        self.count += 1
+
+        for window in self.windows:
+            window.push(n, now)
+
+    def get_slot(self, i):
+        """Returns the slot of the C{i}-th oldest sample still held"""
+        return (self.count - len(self) + i) % self.size
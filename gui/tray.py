@@ -87,7 +87,7 @@ class TrayIcon(object):
         """
 
         # Create
-        if not pynotify.init(APP_NAME):
+        if not pynotify.is_initted() and not pynotify.init(APP_NAME):
             raise RuntimeError("Can not initialize pynotify")
 
         n = pynotify.Notification(title, text)
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+usage keeps daily and monthly traffic totals alongside the usage DB
+"""
+
+import datetime
+import sqlite3
+
+from dateutil.tz import tzlocal, tzutc
+
+from gui.consts import USAGE_DB
+from gui.logger import logger
+from gui.providers import Connection, pool
+
+ROLLUP_VERSION = 2
+
+ROLLUP_SCHEMA = """
+create table if not exists usage_day(
+    day text not null,
+    umts boolean not null,
+    total integer not null,
+    primary key (day, umts));
+
+create table if not exists usage_month(
+    month text not null,
+    umts boolean not null,
+    total integer not null,
+    primary key (month, umts));
+
+create table if not exists usage_rollup_state(
+    version integer not null,
+    raw_mark integer not null);
+
+create table if not exists usage_checkpoint(
+    start_time timestamp not null,
+    end_time timestamp not null,
+    bytes_recv integer not null,
+    bytes_sent integer not null,
+    umts boolean not null,
+    raw_mark integer not null);
+"""
+
+DAY_FORMAT = '%Y-%m-%d'
+MONTH_FORMAT = '%Y-%m'
+
+
+def to_local(utc):
+    """Returns C{utc}, a naive UTC datetime, as a naive local one"""
+    local = utc.replace(tzinfo=tzutc()).astimezone(tzlocal())
+    return local.replace(tzinfo=None)
+
+
+def to_utc(local):
+    """Returns C{local}, a naive local datetime, as a naive UTC one"""
+    utc = local.replace(tzinfo=tzlocal()).astimezone(tzutc())
+    return utc.replace(tzinfo=None)
+
+
+def _parse_time(value):
+    # the usage timestamps might not be converted, depending on the type
+    # they were declared with
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.strptime(str(value)[:19], '%Y-%m-%d %H:%M:%S')
+
+
+def next_month(date):
+    """Returns the first day of the month following C{date}"""
+    if date.month == 12:
+        return date.replace(year=date.year + 1, month=1, day=1)
+    return date.replace(month=date.month + 1, day=1)
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+def split_by_day(start, end, bytes_recv, bytes_sent):
+    """
+    Splits a segment at every local midnight between C{start} and C{end}
+
+    C{start} and C{end} are naive UTC datetimes, like those of the pieces.
+    Traffic is apportioned to each piece according to its duration, as we
+    have no better idea of when it was actually transferred. Returns a list
+    of (start, end, bytes_recv, bytes_sent) tuples.
+    """
+    day, last_day = to_local(start).date(), to_local(end).date()
+    if end <= start or day == last_day:
+        return [(start, end, bytes_recv, bytes_sent)]
+
+    duration = _seconds(end - start)
+    rx_left, tx_left = bytes_recv, bytes_sent
+
+    pieces = []
+    current = start
+    while day < last_day:
+        day += datetime.timedelta(days=1)
+        boundary = to_utc(datetime.datetime.combine(day, datetime.time()))
+        fraction = _seconds(boundary - current) / duration
+        rx = int(bytes_recv * fraction)
+        tx = int(bytes_sent * fraction)
+        pieces.append([current, boundary, rx, tx])
+        rx_left -= rx
+        tx_left -= tx
+        current = boundary
+
+    if current < end:
+        pieces.append([current, end, rx_left, tx_left])
+    else:
+        # ended exactly at midnight, rounding leftovers go to the last day
+        pieces[-1][2] += rx_left
+        pieces[-1][3] += tx_left
+
+    return [tuple(piece) for piece in pieces]
+
+
+class UsageRollups(object):
+    """
+    I keep materialized per-day and per-month 2G/3G totals
+
+    The raw segments are still written by wader's L{UsageProvider}, the
+    totals are derived from them: every segment stored after the last one
+    accounted for is added up, and the mark of the last one is moved in
+    the same transaction as the totals. So the totals never diverge from
+    the segments whatever fails in between, they just catch up later, and
+    a month total is a single lookup rather than a scan of every segment
+    stored for that month. Days and months are local.
+
+    I also keep a checkpoint of the segment in progress, so the traffic of
+    a session that never got to close its segment (crash, bad suspend) is
+    recovered the next time I am instantiated. Along with it goes the last
+    segment stored by then: the segments stored after it can only be the
+    pieces of the checkpointed one, so those are not written twice.
+    """
+
+    def __init__(self, provider, path=USAGE_DB):
+        super(UsageRollups, self).__init__()
+        self.provider = provider
+        self.conn = pool.get(Connection, path, None,
+                             sqlite3.PARSE_DECLTYPES)
+        self.conn.executescript(ROLLUP_SCHEMA)
+
+        if self._get_version() != ROLLUP_VERSION:
+            self.backfill()
+        else:
+            self.catch_up()
+
+        self.recover_checkpoint()
+
+    def _get_version(self):
+        c = self.conn.cursor()
+        c.execute("select version from usage_rollup_state")
+        row = c.fetchone()
+        return row[0] if row else None
+
+    def _bump(self, c, table, column, key, umts, total):
+        sql = "update %s set total = total + ? where %s = ? and umts = ?"
+        c.execute(sql % (table, column), (total, key, umts))
+        if not c.rowcount:
+            sql = "insert into %s values (?, ?, ?)"
+            c.execute(sql % table, (key, umts, total))
+
+    def _catch_up(self, c):
+        c.execute("select raw_mark from usage_rollup_state")
+        mark = c.fetchone()[0]
+        try:
+            c.execute("select rowid, start_time, bytes_recv + bytes_sent, "
+                      "umts from usage where rowid > ? order by rowid",
+                      (mark,))
+        except sqlite3.OperationalError:
+            # the provider has not created its schema yet
+            return 0
+
+        rows = c.fetchall()
+        if not rows:
+            return 0
+
+        totals = {}
+        for rowid, start, total, umts in rows:
+            start = to_local(_parse_time(start))
+            key = (start.strftime(DAY_FORMAT), int(bool(umts)))
+            totals[key] = totals.get(key, 0) + total
+
+        months = {}
+        for (day, umts), total in totals.iteritems():
+            key = (day[:7], umts)
+            months[key] = months.get(key, 0) + total
+
+        for (day, umts), total in totals.iteritems():
+            self._bump(c, 'usage_day', 'day', day, umts, total)
+        for (month, umts), total in months.iteritems():
+            self._bump(c, 'usage_month', 'month', month, umts, total)
+        c.execute("update usage_rollup_state set raw_mark = ?",
+                  (rows[-1][0],))
+        return len(rows)
+
+    def catch_up(self):
+        """Accounts for the segments stored since the last time"""
+        c = self.conn.cursor()
+        c.execute("begin")
+        try:
+            self._catch_up(c)
+        except:
+            c.execute("rollback")
+            raise
+        c.execute("commit")
+
+    def write_segment(self, start, end, bytes_recv, bytes_sent, umts):
+        """
+        Writes a usage segment split at day boundaries
+
+        The raw pieces go to the L{UsageProvider}, catching up with them
+        and the removal of the now obsolete checkpoint share a single
+        transaction. Returns the list of pieces written.
+        """
+        pieces = split_by_day(start, end, bytes_recv, bytes_sent)
+        self._write_pieces(pieces, umts)
+        return pieces
+
+    def _write_pieces(self, pieces, umts):
+        for _start, _end, rx, tx in pieces:
+            self.provider.add_usage_item(_start, _end, rx, tx, umts)
+
+        c = self.conn.cursor()
+        c.execute("begin")
+        try:
+            self._catch_up(c)
+            c.execute("delete from usage_checkpoint")
+        except:
+            c.execute("rollback")
+            raise
+        c.execute("commit")
+
+    def _get_raw_mark(self, c):
+        try:
+            c.execute("select max(rowid) from usage")
+        except sqlite3.OperationalError:
+            # the provider has not created its schema yet
+            return 0
+        return c.fetchone()[0] or 0
+
+    def save_checkpoint(self, start, end, bytes_recv, bytes_sent, umts):
+        """Records the traffic of the segment in progress"""
+        c = self.conn.cursor()
+        c.execute("begin")
+        try:
+            c.execute("delete from usage_checkpoint")
+            c.execute("insert into usage_checkpoint values "
+                      "(?, ?, ?, ?, ?, ?)",
+                      (start, end, bytes_recv, bytes_sent, int(bool(umts)),
+                       self._get_raw_mark(c)))
+        except:
+            c.execute("rollback")
+            raise
+        c.execute("commit")
+
+    def get_checkpoint(self):
+        """
+        Returns the checkpointed segment or None
+
+        The segment is a (start, end, bytes_recv, bytes_sent, umts) tuple
+        """
+        c = self.conn.cursor()
+        c.execute("select start_time, end_time, bytes_recv, bytes_sent, umts "
+                  "from usage_checkpoint")
+        return c.fetchone()
+
+    def recover_checkpoint(self):
+        """
+        Writes out a segment left behind by an unclean shutdown
+
+        The pieces of the segment stored before the shutdown are not
+        written again.
+        """
+        c = self.conn.cursor()
+        c.execute("select start_time, end_time, bytes_recv, bytes_sent, "
+                  "umts, raw_mark from usage_checkpoint")
+        checkpoint = c.fetchone()
+        if checkpoint is None:
+            return
+
+        start, end, rx, tx, umts, raw_mark = checkpoint
+        # the pieces are stored in order
+        c.execute("select count(*) from usage where rowid > ?", (raw_mark,))
+        written = c.fetchone()[0]
+        logger.info("Recovering usage segment %s - %s, %d pieces stored "
+                    "already" % (start, end, written))
+        self._write_pieces(split_by_day(start, end, rx, tx)[written:],
+                           bool(umts))
+
+    def backfill(self):
+        """Rebuilds the totals from every segment in the usage DB"""
+        c = self.conn.cursor()
+        c.execute("begin")
+        try:
+            # the state used to be kept in usage_rollup_version
+            c.execute("drop table if exists usage_rollup_version")
+            c.execute("delete from usage_day")
+            c.execute("delete from usage_month")
+            c.execute("delete from usage_rollup_state")
+            c.execute("insert into usage_rollup_state values (?, 0)",
+                      (ROLLUP_VERSION,))
+            segments = self._catch_up(c)
+        except:
+            c.execute("rollback")
+            raise
+        c.execute("commit")
+
+        logger.info("Usage totals rebuilt from %d segments" % segments)
+
+    def _get_totals(self, table, column, key):
+        v_3g = v_2g = 0
+
+        c = self.conn.cursor()
+        c.execute("select umts, total from %s where %s = ?" % (table, column),
+                  (key,))
+        for umts, total in c.fetchall():
+            if umts:
+                v_3g += total
+            else:
+                v_2g += total
+
+        return (v_3g, v_2g)
+
+    def get_usage_for_day(self, day):
+        """Returns a (3g, 2g) tuple with the bytes used on C{day}"""
+        return self._get_totals('usage_day', 'day',
+                                day.strftime(DAY_FORMAT))
+
+    def get_usage_for_month(self, month):
+        """Returns a (3g, 2g) tuple with the bytes used during C{month}"""
+        return self._get_totals('usage_month', 'month',
+                                month.strftime(MONTH_FORMAT))
@@ -102,6 +102,16 @@ class DiagnosticsView(View):
             imei = _('Unknown')
         self['imei_number_label'].set_text(imei)
 
+    def set_observers_info(self, count):
+        # helps spotting controllers leaked by the main model
+        self['observers_number_label'].set_text(str(count))
+
+    def set_db_opens_info(self, counts):
+        # more than one open of a DB means somebody bypasses the pool
+        text = ', '.join(['%s %d' % (name.replace('Provider', ''), count)
+                          for name, count in sorted(counts.items())])
+        self['db_opens_number_label'].set_text(text or '0')
+
     def set_appVersion_info(self, appVersion):
         self['vmb_version'].set_text(appVersion)
 
@@ -46,7 +46,9 @@ from gui.consts import (APP_LONG_NAME, APP_SLUG_NAME, APP_URL,
                         TV_CNT_TYPE, TV_CNT_NAME, TV_CNT_NUMBER,
                         TV_CNT_EDITABLE,
                         TV_SMS_TYPE, TV_SMS_TEXT, TV_SMS_NUMBER,
-                        TV_SMS_DATE)
+                        TV_SMS_DATE, TV_SMS_STATUS, TV_SMS_DATE_TEXT,
+                        TV_CONV_NAME, TV_CONV_TEXT, TV_CONV_COUNT,
+                        TV_CONV_DATE_TEXT)
 
 from gui.constx import (GUI_MODEM_STATE_NODEVICE,
                         GUI_MODEM_STATE_HAVEDEVICE,
@@ -65,10 +67,10 @@ from gui.constx import (GUI_MODEM_STATE_NODEVICE,
                         TV_DICT)
 
 
-from gui.stats import StatsBar
+from gui.stats import StatsBar, RateGraph
 from gui.utils import UNIT_KB, UNIT_MB, units_to_bytes
 
-from gui.models.sms import SMSStoreModel
+from gui.models.sms import SMSStoreModel, ConversationStoreModel
 from gui.models.contacts import ContactsStoreModel
 
 WIDGETS_TO_SHOW = ['change_pin1', 'request_pin1',
@@ -84,6 +86,15 @@ WIN_HEIGHT = 500
 SMS_TEXT_TV_WIDTH = 220
 
 
+def _bps_to_human(bps):
+    f = float(bps)
+    for m in ['b/s ', 'kb/s', 'mb/s', 'gb/s']:
+        if f < 1000:
+            return "%3.2f %s" % (f, m)
+        f /= 1000
+    return _("N/A")
+
+
 class MainView(View):
     """View for the main window"""
 
@@ -109,10 +120,13 @@ class MainView(View):
         self.signal = 0         # -1, 0, 25, 50, 75, 100
 
         self.setup_view(height)
+        self._setup_rate_graph(ctrl.model.throughput)
+        self._setup_rate_tooltips()
         ctrl.register_view(self)
         self.throbber = None
         ctrl.update_usage_view()
         self.setup_treeview(ctrl)
+        self.setup_conversations_treeview()
 
     def show(self):
         ret = super(MainView, self).show()
@@ -188,6 +202,14 @@ class MainView(View):
         self.get_top_widget().hide()
         self['sms_message_pane'].hide()
 
+    def _setup_rate_graph(self, history):
+        # lives next to the download rate, so it is shown and hidden
+        # along with the rest of the statistics
+        self.rate_graph = RateGraph(history)
+        graph = self.rate_graph.DrawingArea()
+        self['hbox37'].pack_start(graph, expand=False)
+        graph.show()
+
     def show_current_session(self, show):
         items = ['usage_label7', 'current_session_2g_label',
                  'usage_label8', 'current_session_3g_label',
@@ -206,19 +228,52 @@ class MainView(View):
         self['time_statusbar'].push(1, str(td).split('.')[0])
 
     def set_transfer_rate(self, rate, upload=False):
-
-        def bps_to_human(bps):
-            f = float(bps)
-            for m in ['b/s ', 'kb/s', 'mb/s', 'gb/s']:
-                if f < 1000:
-                    return "%3.2f %s" % (f, m)
-                f /= 1000
-            return _("N/A")
-
         if upload:
-            self['upload_statusbar'].push(1, bps_to_human(rate * 8))
+            self['upload_statusbar'].push(1, _bps_to_human(rate * 8))
         else:
-            self['download_statusbar'].push(1, bps_to_human(rate * 8))
+            self['download_statusbar'].push(1, _bps_to_human(rate * 8))
+            self.rate_graph.update()
+
+    def _setup_rate_tooltips(self):
+        # upload -> (min, avg, peak) rates of every window and the text
+        # made out of them, made when first shown
+        self.rate_stats = {}
+        self.rate_tooltips = {}
+        for name, upload in [('download_statusbar', False),
+                             ('upload_statusbar', True)]:
+            self[name].set_has_tooltip(True)
+            self[name].connect('query-tooltip', self._on_rate_query_tooltip,
+                               upload)
+
+    def set_rate_stats(self, stats, upload=False):
+        """
+        Shows C{stats} in the tooltip of the download or upload rate
+
+        C{stats} holds the (min, avg, peak) rates of the last minute, the
+        last 15 minutes and the session.
+        """
+        self.rate_stats[upload] = stats
+        self.rate_tooltips.pop(upload, None)
+
+    def _on_rate_query_tooltip(self, widget, x, y, keyboard_mode, tooltip,
+                               upload):
+        text = self.rate_tooltips.get(upload)
+        if text is None:
+            stats = self.rate_stats.get(upload)
+            if stats is None:
+                return False
+
+            lines = []
+            for label, (low, avg, peak) in zip([_("Last minute"),
+                                                _("Last 15 minutes"),
+                                                _("Session")], stats):
+                lines.append(_("%s: min %s, avg %s, peak %s") % (label,
+                             _bps_to_human(low * 8), _bps_to_human(avg * 8),
+                             _bps_to_human(peak * 8)))
+            text = self.rate_tooltips[upload] = '\n'.join(lines)
+
+        tooltip.set_text(text)
+        return True
 
     def set_usage_value(self, widget, value):
 
@@ -550,41 +605,65 @@ class MainView(View):
                 column.set_sort_column_id(TV_SMS_NUMBER)
                 treeview.append_column(column)
 
-                def render_date(cellview, cell, model, _iter):
-                    datetime = model.get_value(_iter, TV_SMS_DATE)
-                    if datetime:
-                        cell.set_property('text', datetime.strftime("%c"))
-
-                def sort_date(model, iter1, iter2, data):
-                    date1 = model.get_value(iter1, TV_SMS_DATE)
-                    date2 = model.get_value(iter2, TV_SMS_DATE)
-                    if date1 and not date2:
-                        return 1
-                    if date2 and not date1:
-                        return -1
-                    if date1 == date2:
-                        return 0
-                    if date1 < date2:
-                        return -1
-                    else:
-                        return 1
-
+                # the date is formatted when the row is added and sorted
+                # by its epoch, so GTK compares integers by itself
                 cell = gtk.CellRendererText()
                 cell.set_property('xalign', 1.0)
                 cell.set_property('editable', False)
-                column = gtk.TreeViewColumn(_("Date"), cell)  # TV_SMS_DATE
+                column = gtk.TreeViewColumn(_("Date"), cell,
+                                            text=TV_SMS_DATE_TEXT)
                 column.set_resizable(True)
                 column.set_sort_column_id(TV_SMS_DATE)
-                column.set_cell_data_func(cell, render_date)
                 treeview.append_column(column)
                 model.set_sort_column_id(TV_SMS_DATE, gtk.SORT_DESCENDING)
-                model.set_sort_func(TV_SMS_DATE, sort_date, None)
+
+                if name == 'sent_treeview':
+                    cell = gtk.CellRendererText()
+                    cell.set_property('editable', False)
+                    column = gtk.TreeViewColumn(_("Status"), cell,
+                                                text=TV_SMS_STATUS)
+                    column.set_resizable(True)
+                    column.set_sort_column_id(TV_SMS_STATUS)
+                    treeview.append_column(column)
 
                 cell = None
                 column = gtk.TreeViewColumn('', cell)  # TV_SMS_OBJ
                 column.set_visible(False)
                 treeview.append_column(column)
 
+    def setup_conversations_treeview(self):
+        """Sets up the conversations treeview"""
+        treeview = self['conversations_treeview']
+        # rows come in the DB order, most recent first, a page at a time
+        treeview.set_model(ConversationStoreModel())
+
+        cell = gtk.CellRendererText()
+        column = gtk.TreeViewColumn(_("Name"), cell, text=TV_CONV_NAME)
+        column.set_resizable(True)
+        treeview.append_column(column)
+
+        cell = gtk.CellRendererText()
+        cell.set_fixed_height_from_font(1)
+        cell.set_property('ellipsize', ELLIPSIZE_END)
+        cell.set_property('ellipsize-set', True)
+        column = gtk.TreeViewColumn(_("Last message"), cell,
+                                    text=TV_CONV_TEXT)
+        column.set_resizable(True)
+        column.set_sizing(gtk.TREE_VIEW_COLUMN_FIXED)
+        column.set_fixed_width(SMS_TEXT_TV_WIDTH)
+        treeview.append_column(column)
+
+        cell = gtk.CellRendererText()
+        column = gtk.TreeViewColumn(_("Messages"), cell, text=TV_CONV_COUNT)
+        column.set_resizable(True)
+        treeview.append_column(column)
+
+        cell = gtk.CellRendererText()
+        cell.set_property('xalign', 1.0)
+        column = gtk.TreeViewColumn(_("Date"), cell, text=TV_CONV_DATE_TEXT)
+        column.set_resizable(True)
+        treeview.append_column(column)
+
     def set_message_preview(self, content):
         if content is None:
             self['smsbody_textview'].get_buffer().set_text('')
@@ -593,6 +672,28 @@ class MainView(View):
             self['smsbody_textview'].get_buffer().set_text(content)
             self['sms_message_pane'].show()
 
+    def set_sms_migration_progress(self, processed, total=None):
+        """Shows how many SIM messages have been moved, hides it if None"""
+        if processed is None:
+            self['sms_migration_item'].hide()
+            return
+
+        bar = self['sms_migration_progressbar']
+        bar.set_fraction(float(processed) / total if total else 0.0)
+        bar.set_text(_("%d of %d moved") % (processed, total))
+        self['sms_migration_item'].show()
+
+    def set_sms_send_progress(self, processed, total=None):
+        """Shows how many queued messages have been sent, hides it if None"""
+        if processed is None:
+            self['sms_send_item'].hide()
+            return
+
+        bar = self['sms_send_progressbar']
+        bar.set_fraction(float(processed) / total if total else 0.0)
+        bar.set_text(_("%d of %d sent") % (processed, total))
+        self['sms_send_item'].show()
+
     def start_throbber(self):
         pass
 
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Tests for the asynchronous call pipeline
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gui.pipeline import CallPipeline
+
+
+class CallPipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.answered = []
+        self.done = []
+        # item -> (reply_handler, error_handler) of the calls in flight
+        self.calls = {}
+
+    def call(self, item, reply_handler, error_handler):
+        self.calls[item] = (reply_handler, error_handler)
+
+    def get_pipeline(self, call, max_pending=2):
+        return CallPipeline(call,
+                            lambda item, e: self.answered.append((item, e)),
+                            self.done.append, max_pending)
+
+    def test_keeps_max_pending_in_flight(self):
+        pipeline = self.get_pipeline(self.call)
+        pipeline.start([1, 2, 3])
+        self.assertEqual(sorted(self.calls), [1, 2])
+
+        self.calls.pop(1)[0]()
+        self.assertEqual(sorted(self.calls), [2, 3])
+        self.assertEqual(self.answered, [(1, None)])
+
+    def test_done_once_every_call_is_answered(self):
+        pipeline = self.get_pipeline(self.call)
+        pipeline.start([1, 2])
+        error = Exception('busy')
+        self.calls.pop(2)[1](error)
+        self.assertEqual(self.done, [])
+
+        self.calls.pop(1)[0]()
+        self.assertEqual(self.done, [[(2, error), (1, None)]])
+
+    def test_nothing_to_call(self):
+        self.get_pipeline(self.call).start([])
+        self.assertEqual(self.done, [[]])
+
+    def test_call_raising(self):
+        error = ValueError('no such device')
+
+        def call(item, reply_handler, error_handler):
+            if item == 2:
+                raise error
+            reply_handler()
+
+        self.get_pipeline(call).start([1, 2, 3])
+        # the item failed and the rest went on
+        self.assertEqual(self.answered, [(1, None), (2, error), (3, None)])
+        self.assertEqual(len(self.done), 1)
+
+    def test_every_call_raising(self):
+
+        def call(item, reply_handler, error_handler):
+            raise ValueError('no such device')
+
+        pipeline = self.get_pipeline(call)
+        pipeline.start(range(10))
+        self.assertEqual(pipeline.pending, 0)
+        self.assertEqual([item for item, e in self.done[0]], range(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
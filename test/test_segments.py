@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Tests for the SMS segment counter
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from messaging.sms import SmsSubmit
+
+from gui.segments import SegmentCounter
+
+NUMBER = '+34600000000'
+# a character out of the BMP, a UCS-2 surrogate pair
+CLEF = u'\U0001d11e'
+
+
+def get_pdu_parts(text):
+    return len(SmsSubmit(NUMBER, text).to_pdu())
+
+
+def get_counter(text):
+    return SegmentCounter(text, get_text=lambda: text)
+
+
+class SegmentCounterTestCase(unittest.TestCase):
+
+    def assertPartsLikePdu(self, text):
+        self.assertEqual(get_counter(text).get_parts(), get_pdu_parts(text))
+
+    def test_empty(self):
+        counter = get_counter(u'')
+        self.assertEqual(counter.get_parts(), 1)
+        self.assertEqual(counter.get_last_part_length(), 0)
+
+    def test_gsm_boundaries(self):
+        for length in (160, 161, 306, 307, 459, 460):
+            self.assertPartsLikePdu(u'a' * length)
+
+    def test_ucs2_boundaries(self):
+        for length in (70, 71, 134, 135, 201, 202):
+            self.assertPartsLikePdu(u'Ж' * length)
+
+    def test_escape_counts_twice(self):
+        counter = get_counter(u'a' * 158 + u'€')
+        self.assertEqual(counter.get_length(), 160)
+        self.assertEqual(counter.get_parts(), 1)
+        self.assertPartsLikePdu(u'a' * 158 + u'€')
+        self.assertPartsLikePdu(u'a' * 159 + u'€')
+
+    def test_escape_pair_not_split(self):
+        # the pair would straddle the end of the first part
+        text = u'a' * 152 + u'€' + u'a' * 152
+        counter = get_counter(text)
+        self.assertEqual(counter.get_length(), 306)
+        self.assertEqual(counter.get_parts(), 3)
+        self.assertEqual(counter.get_last_part_length(), 1)
+        self.assertPartsLikePdu(text)
+
+    def test_escape_pairs_at_every_boundary(self):
+        for length in range(150, 156):
+            text = u'a' * length + u'{}' * 10 + u'a' * 140
+            self.assertPartsLikePdu(text)
+
+    def test_surrogate_pair_not_split(self):
+        # 66 units and a pair, it can't take the last unit of the part
+        counter = get_counter(u'Ж' * 66 + CLEF + u'Ж' * 66)
+        self.assertEqual(counter.get_length(), 134)
+        self.assertEqual(counter.get_parts(), 3)
+        self.assertEqual(counter.get_last_part_length(), 1)
+
+    def test_edits(self):
+        text = u'a' * 152 + u'€' + u'a' * 152
+        counter = SegmentCounter(get_text=lambda: text)
+        counter.insert(text)
+        self.assertEqual(counter.get_parts(), 3)
+
+        text = u'a' * 152 + u'a' * 152
+        counter.delete(u'€')
+        self.assertEqual(counter.get_parts(), 2)
+        self.assertEqual(counter.get_last_part_length(), 151)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2006-2012  Vodafone España, S.A.
+# Author:  Various
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+"""
+Tests for the queue sending the outgoing messages
+"""
+
+from datetime import datetime
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from gui import sendqueue
+from gui.messages import DBSMSManager
+from gui.sendqueue import (SendQueue, MAX_ATTEMPTS, RETRY_DELAY,
+                           MAX_RETRY_DELAY)
+
+# the drafts and sent tabs
+DRAFTS, SENT = 2, 3
+
+NUMBERS = ['+34600000001', '+34600000002', '+34600000003']
+
+
+class FakeDevice(object):
+    """I keep the Send calls in flight until the test answers them"""
+
+    def __init__(self):
+        super(FakeDevice, self).__init__()
+        # number -> (reply_handler, error_handler) of the calls in flight
+        self.calls = {}
+        self.sent = []
+
+    def Send(self, params, dbus_interface=None, reply_handler=None,
+             error_handler=None):
+        self.sent.append(params['number'])
+        self.calls[params['number']] = (reply_handler, error_handler)
+
+    def reply(self, number, reference=1):
+        self.calls.pop(number)[0]([reference])
+
+    def fail(self, number, name):
+        self.calls.pop(number)[1](Exception(name))
+
+
+class SendQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # the provider and our own tables are opened on the same file
+        self.tmpdir = tempfile.mkdtemp()
+        self.smanager = DBSMSManager(os.path.join(self.tmpdir, 'sms.db'))
+        self.device = FakeDevice()
+        self.sent = []
+        self.failures = []
+        # delay in ms of the retries scheduled, and those cancelled
+        self.timeouts = {}
+        self.cancelled = []
+        self.patch('timeout_add', self.timeout_add)
+        self.patch('source_remove', self.cancelled.append)
+
+    def tearDown(self):
+        for name, value in self.patched:
+            setattr(sendqueue, name, value)
+        self.smanager.close()
+        shutil.rmtree(self.tmpdir)
+
+    def patch(self, name, value):
+        if not hasattr(self, 'patched'):
+            self.patched = []
+        self.patched.append((name, getattr(sendqueue, name)))
+        setattr(sendqueue, name, value)
+
+    def timeout_add(self, delay, func):
+        source = len(self.timeouts) + 1
+        self.timeouts[source] = delay
+        return source
+
+    def get_queue(self, window=2):
+        return SendQueue(self.smanager,
+                         lambda msg, sms: self.sent.append(msg),
+                         self.failures.append, window=window)
+
+    def get_messages(self, where):
+        return [msg.number for msg in self.smanager.iter_messages(where)]
+
+    def test_keeps_window_in_flight(self):
+        queue = self.get_queue()
+        queue.set_device(self.device)
+        queue.enqueue(NUMBERS, 'hi')
+        self.assertEqual(sorted(self.device.calls), NUMBERS[:2])
+
+        self.device.reply(NUMBERS[0])
+        self.assertEqual(sorted(self.device.calls), NUMBERS[1:])
+        self.assertEqual(self.get_messages(SENT), NUMBERS[:1])
+
+    def test_backoff(self):
+        queue = self.get_queue()
+        queue.set_device(self.device)
+        sms = queue.enqueue(NUMBERS[:1], 'hi')[0]
+
+        for attempt in range(1, 4):
+            start = time.time()
+            self.device.fail(NUMBERS[0], 'NoReply')
+            delay = min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+            self.assertEqual(sms.attempts, attempt)
+            self.assertTrue(start + delay <= sms.next_attempt
+                            <= time.time() + delay)
+            # nothing is due until the retry
+            self.assertEqual(self.device.calls, {})
+            last = max(self.timeouts)
+            self.assertTrue(self.timeouts[last] > (delay - 1) * 1000)
+
+            sms.next_attempt = 0
+            queue._on_retry_timeout()
+            self.assertEqual(self.device.calls.keys(), NUMBERS[:1])
+
+        # the attempts survive a restart
+        self.assertEqual(self.smanager.get_queued_messages()[0].attempts, 3)
+
+    def test_gives_up_to_drafts(self):
+        queue = self.get_queue()
+        queue.set_device(self.device)
+        queue.enqueue(NUMBERS[:2], 'hi')
+        # not worth retrying
+        self.device.fail(NUMBERS[0], 'InvalidNumber')
+        # reported once the batch is over
+        self.assertEqual(self.failures, [])
+
+        for attempt in range(MAX_ATTEMPTS):
+            self.device.fail(NUMBERS[1], 'NoReply')
+            for sms in queue.queue:
+                sms.next_attempt = 0
+            queue._send_next()
+
+        self.assertEqual(len(self.failures), 1)
+        self.assertEqual([sms.number for draft, sms, e in self.failures[0]],
+                         NUMBERS[:2])
+        self.assertEqual(sorted(self.get_messages(DRAFTS)), NUMBERS[:2])
+        self.assertEqual(self.smanager.get_queued_messages(), [])
+        self.assertEqual(len(queue), 0)
+
+    def test_holds_without_device(self):
+        queue = self.get_queue()
+        queue.set_device(self.device)
+        queue.enqueue(NUMBERS[:1], 'hi')
+        self.device.fail(NUMBERS[0], 'NoNetwork')
+        retry = max(self.timeouts)
+
+        queue.set_device(None)
+        self.assertEqual(self.cancelled, [retry])
+        queue.enqueue(NUMBERS[1:], 'hi')
+        self.assertEqual(self.device.calls, {})
+
+        for sms in queue.queue:
+            sms.next_attempt = 0
+        queue.set_device(self.device)
+        self.assertEqual(sorted(self.device.calls), NUMBERS[:2])
+
+    def test_queue_survives_restart(self):
+        self.get_queue().enqueue(NUMBERS, 'hi')
+        queue = self.get_queue(window=5)
+        self.assertEqual(len(queue), 3)
+        queue.set_device(self.device)
+        self.assertEqual(sorted(self.device.calls), NUMBERS)
+
+    def test_saved_once_when_answered_twice(self):
+        queue = self.get_queue()
+        queue.set_device(self.device)
+        queue.enqueue(NUMBERS[:1], 'hi')
+        reply_handler, error_handler = self.device.calls[NUMBERS[0]]
+        reply_handler([1])
+        reply_handler([1])
+        error_handler(Exception('NoReply'))
+
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.get_messages(SENT), NUMBERS[:1])
+        self.assertEqual(self.device.sent, NUMBERS[:1])
+
+    def test_complete_queued_message_once(self):
+        sms = self.get_queue().enqueue(NUMBERS[:1], 'hi')[0]
+        complete = self.smanager.complete_queued_message
+        self.assertEqual(complete(sms, datetime.now(), 7).number, NUMBERS[0])
+        self.assertEqual(complete(sms, datetime.now(), 7), None)
+        self.assertEqual(self.get_messages(SENT), NUMBERS[:1])
+
+    def test_complete_queued_message_recovered(self):
+        sms = self.get_queue().enqueue(NUMBERS[:1], 'hi')[0]
+
+        def crash():
+            raise sqlite3.OperationalError('disk I/O error')
+
+        # saved to the sent folder, but it didn't get to leave the queue
+        self.smanager._begin = crash
+        complete = self.smanager.complete_queued_message
+        self.assertEqual(complete(sms, datetime.now(), 7), None)
+        self.assertEqual(self.smanager.get_queued_messages(), [])
+
+        self.smanager.close()
+        self.smanager = DBSMSManager(self.smanager.path)
+        self.assertEqual(self.get_messages(SENT), NUMBERS[:1])
+        self.assertEqual(self.get_queue().queue, [])
+
+
+if __name__ == '__main__':
+    unittest.main()